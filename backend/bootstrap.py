@@ -0,0 +1,32 @@
+"""Inizializzazione una tantum del database: tabelle, ruoli, utente admin e impostazioni.
+
+In produzione viene eseguito da entrypoint.sh prima di avviare i worker uvicorn
+(`python bootstrap.py`), che poi partono con APP_BOOTSTRAPPED=1 e non la ripetono.
+"""
+import logging
+import os
+
+from database import SessionLocal, init_db
+from dependencies import init_roles_and_admin, initialize_settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_bootstrapped() -> bool:
+    return os.getenv("APP_BOOTSTRAPPED", "0") == "1"
+
+
+def run_bootstrap():
+    init_db()
+    db = SessionLocal()
+    try:
+        init_roles_and_admin(db)
+        initialize_settings(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_bootstrap()
+    logger.info("Bootstrap completato.")
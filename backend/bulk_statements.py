@@ -0,0 +1,48 @@
+"""Valori degli statement bulk ORM, per le proiezioni mantenute dagli eventi di sessione.
+
+inventory_access e metadata_doc li usano per limitare il ricalcolo alle righe toccate da
+un insert/update bulk. Quando non si possono determinare le funzioni restituiscono None
+e il chiamante ricade sul ricalcolo completo, mai su "nessuna riga".
+"""
+from sqlalchemy import BindParameter
+from sqlalchemy.orm import ORMExecuteState
+
+_MISSING = object()
+
+
+def _statement_values(orm_execute_state: ORMExecuteState) -> dict | None:
+    # Valori passati con .values(): SQLAlchemy non li espone pubblicamente, quindi se
+    # l'attributo interno manca (o cambia nome) i valori risultano non noti
+    values = getattr(orm_execute_state.statement, "_values", _MISSING)
+    if values is _MISSING:
+        return None
+    return dict(values or {})
+
+
+def _parameter_rows(orm_execute_state: ORMExecuteState) -> list[dict]:
+    # Parametri di session.execute(statement, params): un dict o una lista di dict
+    parameters = orm_execute_state.parameters
+    if isinstance(parameters, dict):
+        return [parameters] if parameters else []
+    return list(parameters or [])
+
+
+def statement_rows(orm_execute_state: ORMExecuteState) -> list[dict] | None:
+    """Righe di valori dello statement (colonna -> valore), o None se non si possono determinare."""
+    rows = _parameter_rows(orm_execute_state)
+    if rows:
+        return rows
+    values = _statement_values(orm_execute_state)
+    if not values or not all(isinstance(value, BindParameter) for value in values.values()):
+        return None  # valori assenti o espressioni SQL
+    return [{getattr(key, "key", key): value.value for key, value in values.items()}]
+
+
+def assigned_columns(orm_execute_state: ORMExecuteState) -> set[str] | None:
+    """Colonne assegnate dallo statement, anche con espressioni SQL, o None se non note."""
+    values = _statement_values(orm_execute_state)
+    if values is None:
+        return None
+    columns = {getattr(key, "key", key) for key in values}
+    columns |= {key for row in _parameter_rows(orm_execute_state) for key in row}
+    return columns or None
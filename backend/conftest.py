@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    """Statement SQL eseguiti (da qualunque engine) dentro un blocco `count_queries()`."""
+
+    def __init__(self):
+        self.statements: list[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def query_counter():
+    """Context manager che conta le query SQL: `with query_counter() as counter: ...`."""
+    return count_queries
+
+
+@pytest.fixture
+def assert_queries_constant():
+    """Verifica che il numero di query di una richiesta non cresca con il numero di righe.
+
+    `call` esegue la richiesta, `grow` aggiunge righe al database. La prima chiamata
+    scalda le cache (es. utente autenticato) e non viene conteggiata.
+    Restituisce il numero di query misurato, da confrontare con la baseline.
+    """
+    def check(call, grow, label: str = "") -> int:
+        call()
+        with count_queries() as before:
+            call()
+        grow()
+        with count_queries() as after:
+            call()
+        assert after.count == before.count, (
+            f"{label}: {before.count} -> {after.count} query dopo l'aggiunta di righe (N+1?)\n"
+            + "\n".join(after.statements)
+        )
+        return after.count
+
+    return check
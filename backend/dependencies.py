@@ -1,7 +1,11 @@
+from dataclasses import dataclass, field
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
-from database import SessionLocal, Session
-from models import User, RoleEnum, Role
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from cache import TTLCache
+from database import SessionLocal, Session, get_async_session_factory
+from models import User, RoleEnum, Role, UserGroupAssociation
 from crud import get_setting, set_setting
 import jwt
 import os
@@ -24,6 +28,12 @@ def get_db():
     finally:
         db.close()
 
+# Sessione async per le route `async def` (nessun thread occupato durante l'I/O).
+# Il codice sync esistente si riusa con `await adb.run_sync(lambda db: funzione(db, ...))`.
+async def get_async_db():
+    async with get_async_session_factory()() as adb:
+        yield adb
+
 # Funzione per inizializzare i ruoli e l'admin
 def init_roles_and_admin(db: Session):
     from routes.auth import hash_password
@@ -60,30 +70,104 @@ def init_roles_and_admin(db: Session):
         role.user_ins = admin_user.id  # 👈 Ora assegniamo l'utente
     db.commit()
 
-# Funzione per ottenere l'utente corrente
-def get_current_user(security_scopes: SecurityScopes,
-                     token: str = Depends(oauth2_scheme),
-                     db: Session = Depends(get_db)
-):
+# Utente autenticato in forma compatta (niente sessione ORM): è ciò che restituisce
+# get_current_user e viene messo in cache per `sub` del token.
+@dataclass(frozen=True)
+class PrincipalRole:
+    id: int
+    name: str
+
+
+@dataclass(frozen=True)
+class AuthPrincipal:
+    id: int
+    username: str
+    role: PrincipalRole | None
+    is_blocked: bool
+    group_ids: frozenset[int] = field(default_factory=frozenset)
+
+
+principal_cache: TTLCache[AuthPrincipal] = TTLCache(
+    ttl_seconds=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30")),
+    max_entries=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "1024")),
+)
+
+
+def invalidate_principal(user_id: int | None = None) -> None:
+    # Da chiamare dopo modifiche a utente/ruolo/gruppi; senza user_id svuota tutta la cache
+    if user_id is None:
+        principal_cache.clear()
+    else:
+        principal_cache.invalidate_where(lambda _key, principal: principal.id == user_id)
+
+
+def _load_principal(db: Session, username: str) -> AuthPrincipal | None:
+    user = db.query(User).options(joinedload(User.role)).filter(User.username == username).first()
+    if user is None:
+        return None
+    group_ids = frozenset(
+        group_id for (group_id,) in db.query(UserGroupAssociation.group_id).filter(UserGroupAssociation.user_id == user.id)
+    )
+    return AuthPrincipal(
+        id=user.id,
+        username=user.username,
+        role=PrincipalRole(id=user.role.id, name=user.role.name) if user.role else None,
+        is_blocked=bool(user.is_blocked),
+        group_ids=group_ids,
+    )
+
+
+def _token_username(token: str) -> str:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token non valido")
-        user = db.query(User).filter(User.username == username).first()
-        if user is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utente non trovato")
-        if user.role is None:
-            raise HTTPException(status_code=403, detail="Accesso negato: ruolo non assegnato")
-        if user.is_blocked:  # ✅ Blocca l'accesso agli utenti disabilitati
-            raise HTTPException(status_code=403, detail="Utente bloccato. Accesso negato.")
-        return user
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token non valido")
+    username: str = payload.get("sub")
+    if username is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token non valido")
+    return username
+
+
+def _remember_principal(username: str, user: AuthPrincipal | None) -> AuthPrincipal:
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utente non trovato")
+    principal_cache.set(username, user)
+    return user
+
+
+def _check_principal(user: AuthPrincipal) -> AuthPrincipal:
+    if user.role is None:
+        raise HTTPException(status_code=403, detail="Accesso negato: ruolo non assegnato")
+    if user.is_blocked:  # ✅ Blocca l'accesso agli utenti disabilitati
+        raise HTTPException(status_code=403, detail="Utente bloccato. Accesso negato.")
+    return user
+
+
+# Funzione per ottenere l'utente corrente
+def get_current_user(security_scopes: SecurityScopes,
+                     token: str = Depends(oauth2_scheme),
+                     db: Session = Depends(get_db)
+) -> AuthPrincipal:
+    username = _token_username(token)
+    user = principal_cache.get(username)
+    if user is None:
+        user = _remember_principal(username, _load_principal(db, username))
+    return _check_principal(user)
+
+
+# Variante async di get_current_user per le route `async def`
+async def get_current_user_async(token: str = Depends(oauth2_scheme),
+                                 adb: AsyncSession = Depends(get_async_db)
+) -> AuthPrincipal:
+    username = _token_username(token)
+    user = principal_cache.get(username)
+    if user is None:
+        user = _remember_principal(username, await adb.run_sync(_load_principal, username))
+    return _check_principal(user)
 
 # Funzione per verificare il ruolo dell'utente
 def role_required(required_role: RoleEnum):  # ✅ Accetta RoleEnum invece di str
-    def dependency(user: User = Depends(get_current_user)):
+    def dependency(user: AuthPrincipal = Depends(get_current_user)):
         if user.role is None:
             raise HTTPException(status_code=403, detail="Accesso negato: ruolo non assegnato")
         if user.role.name != required_role.value:  # ✅ Confronto con RoleEnum
@@ -7,5 +7,17 @@ chmod 777 /app/backups
 echo "🔄 Applying database migrations..."
 alembic upgrade head
 
-echo "🚀 Starting backend..."
-exec uvicorn main:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
+echo "🌱 Bootstrapping roles, admin user and settings..."
+python bootstrap.py
+export APP_BOOTSTRAPPED=1
+
+if [ "${UVICORN_RELOAD:-false}" = "true" ]; then
+    echo "🚀 Starting backend (development, --reload)..."
+    exec uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+fi
+
+# Un worker per core, salvo override con WEB_CONCURRENCY
+WORKERS="${WEB_CONCURRENCY:-$(nproc 2>/dev/null || echo 1)}"
+
+echo "🚀 Starting backend with ${WORKERS} workers..."
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${WORKERS}"
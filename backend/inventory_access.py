@@ -0,0 +1,324 @@
+"""Accesso effettivo materializzato nella tabella `inventory_access`.
+
+Una riga (user_id, inventory_id, level) per ogni utente che vede l'inventario come
+proprietario, per condivisione diretta o tramite un gruppo; `level` vale "edit" per
+admin e moderatori e "view" per gli altri ruoli. Gli admin vedono comunque tutto
+(bypass in inventory_access_filter), quindi il controllo di visibilità diventa una
+singola lookup sulla chiave primaria.
+
+La tabella si aggiorna nella stessa transazione delle modifiche che la influenzano:
+gli eventi di sessione raccolgono utenti e inventari coinvolti (proprietario, condivisioni,
+membri dei gruppi, ruolo o eliminazione di utenti) e ne ricalcolano le righe dopo il flush.
+Gli statement bulk ORM ricalcolano al commit solo se toccano colonne che influenzano
+l'accesso, limitati agli utenti/inventari letti dai parametri o dalla WHERE; chi scrive
+fuori dall'ORM (restore via psql) deve chiamare rebuild_inventory_access().
+
+Ricalcolo completo manuale: `python inventory_access.py`.
+"""
+import logging
+
+from sqlalchemy import Connection, case, event, false, func, inspect, or_, select, union
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from bulk_statements import assigned_columns, statement_rows
+from models import (
+    Group,
+    Inventory,
+    InventoryAccess,
+    Role,
+    RoleEnum,
+    SharedInventory,
+    SharedInventoryGroup,
+    User,
+    UserGroupAssociation,
+)
+
+logger = logging.getLogger(__name__)
+
+EDIT_ROLES = (RoleEnum.admin.value, RoleEnum.moderator.value)
+
+# Colonne che, aggiornate da uno statement bulk, cambiano l'accesso (il ruolo dei gruppi non conta)
+_ACCESS_COLUMNS = {
+    Inventory: {"owner_id"},
+    SharedInventory: {"inventory_id", "user_id"},
+    SharedInventoryGroup: {"inventory_id", "group_id"},
+    UserGroupAssociation: {"user_id", "group_id"},
+    User: {"role_id"},
+    Group: set(),
+    Role: {"name"},
+}
+_PENDING_KEY = "inventory_access_pending"
+_BULK_SCOPE_KEY = "inventory_access_bulk_scope"
+
+
+def _scope(user_column, inventory_column, user_ids, inventory_ids):
+    # Righe da ricalcolare: quelle degli utenti OPPURE degli inventari indicati (tutte se entrambi None)
+    conditions = []
+    if user_ids is not None:
+        conditions.append(user_column.in_(sorted(user_ids)) if user_ids else false())
+    if inventory_ids is not None:
+        conditions.append(inventory_column.in_(sorted(inventory_ids)) if inventory_ids else false())
+    return or_(*conditions) if conditions else None
+
+
+def effective_access_select(user_ids: set[int] | None = None, inventory_ids: set[int] | None = None):
+    branches = [
+        select(Inventory.owner_id.label("user_id"), Inventory.id.label("inventory_id"))
+        .where(Inventory.owner_id.isnot(None)),
+        select(SharedInventory.user_id, SharedInventory.inventory_id)
+        .where(SharedInventory.user_id.isnot(None), SharedInventory.inventory_id.isnot(None)),
+        select(UserGroupAssociation.user_id, SharedInventoryGroup.inventory_id)
+        .join(SharedInventoryGroup, SharedInventoryGroup.group_id == UserGroupAssociation.group_id)
+        .where(SharedInventoryGroup.inventory_id.isnot(None)),
+    ]
+    scoped = []
+    for branch in branches:
+        user_column, inventory_column = branch.selected_columns
+        condition = _scope(user_column, inventory_column, user_ids, inventory_ids)
+        scoped.append(branch.where(condition) if condition is not None else branch)
+    paths = union(*scoped).subquery("paths")  # UNION: una riga per coppia anche con più percorsi
+
+    return (
+        select(
+            paths.c.user_id,
+            paths.c.inventory_id,
+            case((Role.name.in_(EDIT_ROLES), "edit"), else_="view").label("level"),
+        )
+        .join(User, User.id == paths.c.user_id)
+        .join(Role, Role.id == User.role_id)
+    )
+
+
+def rebuild_inventory_access(
+    connection: Connection,
+    user_ids: set[int] | None = None,
+    inventory_ids: set[int] | None = None,
+) -> None:
+    """Ricalcola le righe degli utenti/inventari indicati, o l'intera tabella se non se ne indicano."""
+    if user_ids is not None and inventory_ids is not None and not user_ids and not inventory_ids:
+        return
+    table = InventoryAccess.__table__
+    condition = _scope(table.c.user_id, table.c.inventory_id, user_ids, inventory_ids)
+
+    delete = table.delete()
+    connection.execute(delete.where(condition) if condition is not None else delete)
+
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    # DO NOTHING: due transazioni concorrenti possono ricalcolare la stessa coppia
+    statement = (
+        dialect_insert(table)
+        .from_select(["user_id", "inventory_id", "level"], effective_access_select(user_ids, inventory_ids))
+        .on_conflict_do_nothing()
+    )
+    connection.execute(statement)
+
+
+def user_access_level(db: Session, user_id: int, inventory_id: int) -> str | None:
+    return db.execute(
+        select(InventoryAccess.level).where(
+            InventoryAccess.user_id == user_id,
+            InventoryAccess.inventory_id == inventory_id,
+        )
+    ).scalar()
+
+
+#############################################################################
+# Manutenzione automatica sulle scritture ORM
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault(_PENDING_KEY, {"users": [], "inventories": [], "full": False})
+
+
+def _history_values(obj, attribute: str) -> list:
+    history = inspect(obj).attrs[attribute].history
+    return [*history.added, *history.deleted, *history.unchanged]
+
+
+def _changed(obj, attribute: str) -> bool:
+    return inspect(obj).attrs[attribute].history.has_changes()
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_access_changes(session, flush_context, instances):
+    pending = _pending(session)
+    users, inventories = pending["users"], pending["inventories"]
+
+    # Gli oggetti nuovi non hanno ancora un ID: si risolvono in after_flush
+    for obj in session.new:
+        if isinstance(obj, Inventory):
+            inventories.append(obj)
+        elif isinstance(obj, (SharedInventory, SharedInventoryGroup)):
+            inventories.append((obj, "inventory_id"))
+        elif isinstance(obj, UserGroupAssociation):
+            users.append((obj, "user_id"))
+
+    for obj in session.deleted:
+        if isinstance(obj, Inventory):
+            inventories.append(obj)
+        elif isinstance(obj, (SharedInventory, SharedInventoryGroup)):
+            inventories.extend(_history_values(obj, "inventory_id"))
+        elif isinstance(obj, UserGroupAssociation):
+            users.extend(_history_values(obj, "user_id"))
+        elif isinstance(obj, User):
+            users.append(obj)
+        elif isinstance(obj, Group):
+            users.extend(obj.users)
+
+    for obj in session.dirty:
+        if isinstance(obj, Inventory) and _changed(obj, "owner_id"):
+            inventories.append(obj)
+        elif isinstance(obj, (SharedInventory, SharedInventoryGroup)):
+            if _changed(obj, "inventory_id") or _changed(obj, "user_id" if isinstance(obj, SharedInventory) else "group_id"):
+                inventories.extend(_history_values(obj, "inventory_id"))
+        elif isinstance(obj, UserGroupAssociation) and (_changed(obj, "user_id") or _changed(obj, "group_id")):
+            users.extend(_history_values(obj, "user_id"))
+        elif isinstance(obj, User):
+            # `role` oltre a role_id: assegnando la relazione, role_id si allinea solo durante il flush
+            if any(_changed(obj, attribute) for attribute in ("role_id", "role", "groups", "group_associations")):
+                users.append(obj)
+        elif isinstance(obj, Role) and _changed(obj, "name"):
+            pending["full"] = True  # cambia il livello di tutti gli utenti con quel ruolo
+        elif isinstance(obj, Group):
+            # Membri aggiunti o rimossi tramite la relazione many-to-many Group.users
+            for attribute in ("users", "user_associations"):
+                history = inspect(obj).attrs[attribute].history
+                for member in (*history.added, *history.deleted):
+                    users.append(member if isinstance(member, User) else (member, "user_id"))
+
+
+def _resolve(refs: list) -> set[int]:
+    ids = set()
+    for ref in refs:
+        if isinstance(ref, tuple):
+            value = getattr(*ref)
+        elif isinstance(ref, int):
+            value = ref
+        else:
+            value = ref.id
+        if value is not None:
+            ids.add(value)
+    return ids
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_access_changes(session, flush_context):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    if pending["full"]:
+        rebuild_inventory_access(session.connection())
+        return
+    user_ids, inventory_ids = _resolve(pending["users"]), _resolve(pending["inventories"])
+    if user_ids or inventory_ids:
+        rebuild_inventory_access(session.connection(), user_ids, inventory_ids)
+
+
+def _bulk_statement_scope(orm_execute_state: ORMExecuteState) -> tuple[set[int], set[int]] | None:
+    """(utenti, inventari) toccati da uno statement bulk, o None se non si possono determinare."""
+    model = orm_execute_state.bind_mapper.class_
+    rows = statement_rows(orm_execute_state)
+    assigned = assigned_columns(orm_execute_state) if orm_execute_state.is_update else set()
+    if orm_execute_state.is_update:
+        if assigned is None:
+            return None  # colonne non note: ricalcolo completo
+        if not assigned & _ACCESS_COLUMNS[model]:
+            return set(), set()  # es. data_mod/user_mod degli inventari: l'accesso non cambia
+    if orm_execute_state.is_insert:
+        # Utenti, gruppi e ruoli nuovi non hanno ancora accessi
+        column = {Inventory: "owner_id", SharedInventory: "inventory_id",
+                  SharedInventoryGroup: "inventory_id", UserGroupAssociation: "user_id"}.get(model)
+        if column is None:
+            return set(), set()
+        if rows is None or not all(column in row for row in rows):
+            return None
+        ids = {row[column] for row in rows} - {None}
+        return (set(), ids) if column == "inventory_id" else (ids, set())
+
+    # Update e delete: righe lette dalla WHERE prima dell'esecuzione (dopo un delete non ci sono più)
+    whereclause = orm_execute_state.statement.whereclause
+    if model is Inventory:
+        inventories = select(Inventory.id)
+    elif model in (SharedInventory, SharedInventoryGroup):
+        if "inventory_id" in assigned:
+            return None  # l'inventario di destinazione è nei valori, non nella WHERE
+        inventories = select(model.inventory_id)
+    else:
+        inventories = None
+    if model is UserGroupAssociation:
+        if "user_id" in assigned:
+            return None
+        users = select(UserGroupAssociation.user_id)
+    elif model is User:
+        users = select(User.id)
+    elif model is Group:
+        users = select(UserGroupAssociation.user_id).where(UserGroupAssociation.group_id.in_(
+            select(Group.id).where(whereclause) if whereclause is not None else select(Group.id)
+        ))
+        whereclause = None
+    elif model is Role:
+        users = select(User.id).where(User.role_id.in_(
+            select(Role.id).where(whereclause) if whereclause is not None else select(Role.id)
+        ))
+        whereclause = None
+    else:
+        users = None
+
+    connection = orm_execute_state.session.connection()
+
+    def read(query) -> set[int]:
+        if query is None:
+            return set()
+        return set(connection.execute(query.where(whereclause) if whereclause is not None else query).scalars())
+
+    return read(users) - {None}, read(inventories) - {None}
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statement(orm_execute_state: ORMExecuteState):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in _ACCESS_COLUMNS:
+        return
+    info = orm_execute_state.session.info
+    scope = _bulk_statement_scope(orm_execute_state)
+    if scope is None:
+        info[_BULK_SCOPE_KEY] = None  # righe non note: ricalcolo completo al commit
+        return
+    if not any(scope):
+        return
+    bulk_scope = info.setdefault(_BULK_SCOPE_KEY, (set(), set()))
+    if bulk_scope is not None:
+        bulk_scope[0].update(scope[0])
+        bulk_scope[1].update(scope[1])
+
+
+@event.listens_for(Session, "before_commit")
+def _rebuild_after_bulk_statements(session):
+    if _BULK_SCOPE_KEY in session.info:
+        scope = session.info.pop(_BULK_SCOPE_KEY)
+        if scope is None:
+            rebuild_inventory_access(session.connection())
+        else:
+            rebuild_inventory_access(session.connection(), *scope)
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_BULK_SCOPE_KEY, None)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        rebuild_inventory_access(db.connection())
+        db.commit()
+        rows = db.execute(select(func.count()).select_from(InventoryAccess)).scalar()
+        logger.info("Tabella inventory_access ricostruita: %d righe", rows)
+    finally:
+        db.close()
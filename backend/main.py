@@ -2,13 +2,13 @@ import os
 from fastapi import FastAPI, Depends
 from contextlib import asynccontextmanager
 import logging
-from database import SessionLocal, init_db
-from dependencies import init_roles_and_admin, get_db, initialize_settings, get_current_user
-from sqlalchemy.orm import Session
+from dependencies import AuthPrincipal, get_async_db, get_current_user_async
+from bootstrap import is_bootstrapped, run_bootstrap
+from sqlalchemy.ext.asyncio import AsyncSession
 from routes.auth import router as auth_router
 from routes.user import router as user_router
 from routes.admin import router as admin_router
-from routes.inventory import inventory_router, checklist_router, list_inventories_base
+from routes.inventory import inventory_router, checklist_router, list_recent_inventories_base, RECENTS_MAX_LIMIT
 from routes.item import router as item_router
 from routes.system import router as system_router
 from routes.settings import router as settings_router
@@ -17,23 +17,24 @@ from routes.audit import router as audit_router
 from routes.metadata import router as metadata_router
 from routes.filters import router as filters_router
 from fastapi.middleware.cors import CORSMiddleware
-from models import Inventory, Item, User
-from scheduler import start_scheduler
+from metrics import RequestMetricsMiddleware
+from stats import dashboard_stats_statement, get_cached_dashboard_stats, store_dashboard_stats
+from scheduler import acquire_scheduler_leadership, start_scheduler, shutdown_scheduler
 from fastapi.responses import JSONResponse
 
 logging.basicConfig(level=logging.INFO)
 
-db = SessionLocal()
-init_db()
-init_roles_and_admin(db)
-db.close()
+# Con più worker il bootstrap è già stato fatto da entrypoint.sh prima del fork
+if not is_bootstrapped():
+    run_bootstrap()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    db = next(get_db())
-    initialize_settings(db)
+    # Lo scheduler dei backup gira in un solo processo (quello che ottiene il lock)
+    if acquire_scheduler_leadership():
+        start_scheduler()
     yield
-    db.close()
+    shutdown_scheduler()
 
 root_path = os.getenv("FASTAPI_ROOT_PATH", "")
 api_version = os.getenv("API_VERSION", "unknown")
@@ -49,8 +50,8 @@ app = FastAPI(
 )
 app.openapi_schema = None  # Rigenera lo schema alla prima richiesta
 
-# Avvio dello scheduler per i backup
-start_scheduler()
+# Latenza, numero di query e tempo DB per route (Server-Timing e /system/metrics)
+app.add_middleware(RequestMetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -74,57 +75,26 @@ app.include_router(metadata_router, prefix="/metadata", tags=["Metadata"])
 app.include_router(filters_router, prefix="/filter-templates", tags=["Filter Templates"])
 
 @app.get("/")
-def home():
-    db = SessionLocal()
-    num_inventories = db.query(Inventory).filter(Inventory.type == "INVENTORY").count()
-    num_checklists = db.query(Inventory).filter(Inventory.type == "CHECKLIST").count()
-    num_inventories_items = db.query(Item).filter(Item.inventory.has(type="INVENTORY")).count()
-    num_checklists_items = db.query(Item).filter(Item.inventory.has(type="CHECKLIST")).count()
-    num_users = db.query(User).count()
-    db.close()
+async def home(adb: AsyncSession = Depends(get_async_db)):
+    stats = get_cached_dashboard_stats()
+    if stats is None:
+        row = (await adb.execute(dashboard_stats_statement())).one()
+        stats = dict(row._mapping)
+        store_dashboard_stats(stats)
 
     return {
         "title": "Home Inventory/List Management",
         "message": "Benvenuto nell'applicazione di gestione inventari e liste!",
-        "stats": {
-            "total_inventories": num_inventories,
-            "total_inventories_items": num_inventories_items,
-            "total_checklists": num_checklists,
-            "total_checklists_items": num_checklists_items,
-            "total_users": num_users
-        }
+        "stats": stats
     }
 
 @app.get("/recents")
-def get_recent_items(
+async def get_recent_items(
     limit: int = 5,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    adb: AsyncSession = Depends(get_async_db),
+    current_user: AuthPrincipal = Depends(get_current_user_async)
 ):
-    inventories = list_inventories_base("INVENTORY", "", db, current_user)
-    checklists = list_inventories_base("CHECKLIST", "", db, current_user)
-
-    for i in inventories:
-        i["type"] = "INVENTORY"
-    for c in checklists:
-        c["type"] = "CHECKLIST"
-
-    combined = inventories + checklists
-    combined.sort(key=lambda x: x["data_mod"], reverse=True)
-
-    # Arricchisce i risultati recenti con username dell'ultimo modificatore.
-    recent_slice = combined[:limit]
-    user_mod_ids = {
-        item.get("user_mod")
-        for item in recent_slice
-        if item.get("user_mod") is not None
-    }
-    username_by_id = {
-        user.id: user.username
-        for user in db.query(User).filter(User.id.in_(user_mod_ids)).all()
-    } if user_mod_ids else {}
-
-    for item in recent_slice:
-        item["username_mod"] = username_by_id.get(item.get("user_mod"))
-
-    return recent_slice  # Restituisce gli ultimi N elementi
\ No newline at end of file
+    # Restituisce gli ultimi N inventari/liste modificati visibili all'utente;
+    # limiti fuori intervallo vengono riportati nei limiti invece di essere rifiutati
+    limit = max(0, min(limit, RECENTS_MAX_LIMIT))
+    return await adb.run_sync(list_recent_inventories_base, current_user, limit)
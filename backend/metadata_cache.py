@@ -0,0 +1,159 @@
+"""Cache delle definizioni metadati applicabili a un inventario.
+
+La risoluzione GLOBAL < INVENTORY_TYPE < INVENTORY serve a ogni filtro metadati, a ogni
+upsert massivo e a `list_applicable_definitions`, mentre le definizioni cambiano di rado.
+Le voci sono indicizzate per (inventory_id, inventory_type, include_inactive) e contengono
+copie immutabili (ApplicableDefinition), utilizzabili al di fuori della sessione che le ha lette.
+
+Un contatore di generazione avanza al commit di ogni sessione che ha scritto definizioni o
+assegnazioni (flush ORM o insert/update/delete bulk): le voci di generazioni precedenti sono
+scartate e un calcolo iniziato prima dell'invalidazione non viene salvato.
+Con più worker l'invalidazione è locale al processo: negli altri vale il TTL.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from cache import TTLCache
+from models import MetadataDefinition, MetadataDefinitionAssignment
+
+METADATA_DEFINITIONS_CACHE_TTL_SECONDS = float(os.getenv("METADATA_DEFINITIONS_CACHE_TTL_SECONDS", "300"))
+
+applicable_definitions_cache: TTLCache[tuple[int, tuple["ApplicableDefinition", ...]]] = TTLCache(
+    ttl_seconds=METADATA_DEFINITIONS_CACHE_TTL_SECONDS,
+    max_entries=4096,
+)
+
+_CACHED_MODELS = (MetadataDefinition, MetadataDefinitionAssignment)
+_SESSION_FLAG = "metadata_definitions_dirty"
+
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+@dataclass(frozen=True, slots=True)
+class ApplicableAssignment:
+    id: int
+    definition_id: int
+    scope: str
+    inventory_type: str | None
+    inventory_id: int | None
+    data_ins: datetime | None
+    data_mod: datetime | None
+
+
+@dataclass(frozen=True, slots=True)
+class ApplicableDefinition:
+    """Stessi attributi di MetadataDefinition (compatibile con MetadataDefinitionResponse)."""
+    id: int
+    key: str
+    label: str
+    description: str | None
+    field_type: str
+    list_options: tuple[dict, ...] | None
+    sort_order: int
+    is_required: bool
+    is_active: bool
+    data_ins: datetime
+    data_mod: datetime
+    user_ins: int | None
+    user_mod: int | None
+    assignments: tuple[ApplicableAssignment, ...]
+
+    @classmethod
+    def from_model(cls, definition: MetadataDefinition) -> "ApplicableDefinition":
+        return cls(
+            id=definition.id,
+            key=definition.key,
+            label=definition.label,
+            description=definition.description,
+            field_type=definition.field_type,
+            list_options=tuple(dict(option) for option in definition.list_options)
+            if definition.list_options is not None else None,
+            sort_order=definition.sort_order,
+            is_required=definition.is_required,
+            is_active=definition.is_active,
+            data_ins=definition.data_ins,
+            data_mod=definition.data_mod,
+            user_ins=definition.user_ins,
+            user_mod=definition.user_mod,
+            assignments=tuple(
+                ApplicableAssignment(
+                    id=assignment.id,
+                    definition_id=assignment.definition_id,
+                    scope=assignment.scope,
+                    inventory_type=assignment.inventory_type,
+                    inventory_id=assignment.inventory_id,
+                    data_ins=assignment.data_ins,
+                    data_mod=assignment.data_mod,
+                )
+                for assignment in definition.assignments
+            ),
+        )
+
+
+def current_generation() -> int:
+    """Avanza a ogni scrittura di definizioni o assegnazioni: utile come parte di chiavi di cache derivate."""
+    return _generation
+
+
+def get_or_load_applicable_definitions(
+    key: tuple[int, str, bool],
+    loader: Callable[[], list[ApplicableDefinition]],
+) -> list[ApplicableDefinition]:
+    generation = _generation
+    entry = applicable_definitions_cache.get(key)
+    if entry is not None and entry[0] == generation:
+        return list(entry[1])
+
+    definitions = loader()
+    # Se nel frattempo una scrittura ha invalidato la cache il risultato potrebbe essere già vecchio
+    with _generation_lock:
+        if generation == _generation:
+            applicable_definitions_cache.set(key, (generation, tuple(definitions)))
+    return definitions
+
+
+def invalidate_applicable_definitions() -> None:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        applicable_definitions_cache.clear()
+
+
+#############################################################################
+# Invalidazione automatica sulle scritture
+
+@event.listens_for(Session, "before_flush")
+def _track_flush(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _CACHED_MODELS):
+            session.info[_SESSION_FLAG] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statement(orm_execute_state: ORMExecuteState):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in _CACHED_MODELS:
+        orm_execute_state.session.info[_SESSION_FLAG] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop(_SESSION_FLAG, False):
+        invalidate_applicable_definitions()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_after_rollback(session):
+    session.info.pop(_SESSION_FLAG, None)
@@ -0,0 +1,300 @@
+"""Proiezione denormalizzata dei metadati di ogni item in `items.metadata_doc`.
+
+Mappa chiave definizione -> valore tipizzato, con i dati necessari a ricostruire
+ItemMetadataValueResponse senza join:
+
+    {"colore": {"id": 7, "definition_id": 3, "label": "Colore", "field_type": "TEXT",
+                "value": "rosso", "data_ins": "...", "data_mod": "...", "user_ins": 1, "user_mod": 1}}
+
+Le liste e la ricerca di item leggono solo la tabella items. La colonna è facoltativa:
+NULL significa "non materializzata" (database non ancora ricostruito) e in quel caso i
+metadati si leggono dalla tabella EAV come prima.
+
+Si aggiorna nella stessa transazione delle scritture, come inventory_access: gli eventi
+di sessione raccolgono gli item i cui valori cambiano (o le cui definizioni cambiano
+chiave, etichetta o tipo) e ne ricalcolano il documento dopo il flush. Gli statement bulk
+ORM ricalcolano al commit solo gli item coinvolti: quelli indicati nei parametri, o che
+hanno valori selezionati dalla WHERE (direttamente o tramite le definizioni toccate);
+chi scrive fuori dall'ORM (restore via psql) deve chiamare rebuild_metadata_docs().
+
+Ricalcolo completo manuale: `python metadata_doc.py`.
+"""
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable, cast
+
+from sqlalchemy import Connection, bindparam, event, func, inspect, select, update
+from sqlalchemy.orm import ORMExecuteState, Session, attributes, selectinload
+
+from bulk_statements import assigned_columns, statement_rows
+from metadata_model import MetadataFieldType
+from models import Item, ItemMetadataValue, MetadataDefinition
+from schemas import ItemMetadataValueResponse
+
+logger = logging.getLogger(__name__)
+
+REBUILD_CHUNK_SIZE = 1_000
+
+_DEFINITION_FIELDS = ("key", "label", "field_type")
+_PENDING_KEY = "metadata_doc_pending"
+_BULK_ITEMS_KEY = "metadata_doc_bulk_items"
+_NUMBER_QUANTUM = Decimal(1).scaleb(-cast(int, ItemMetadataValue.value_number.type.scale))
+
+
+def _document_entry(row) -> dict[str, Any]:
+    # `row`: colonne del valore più key/label/field_type della definizione
+    typed = next(
+        (v for v in (row.value_text, row.value_number, row.value_boolean, row.value_date) if v is not None),
+        None,
+    )
+    if isinstance(typed, Decimal):
+        typed = float(typed)  # numero JSON: le ricerche per contenimento restano tipizzate
+    elif isinstance(typed, date):
+        typed = typed.isoformat()
+    return {
+        "id": row.id,
+        "definition_id": row.definition_id,
+        "label": row.label,
+        "field_type": row.field_type,
+        "value": typed,
+        "data_ins": row.data_ins.isoformat() if row.data_ins else None,
+        "data_mod": row.data_mod.isoformat() if row.data_mod else None,
+        "user_ins": row.user_ins,
+        "user_mod": row.user_mod,
+    }
+
+
+def _typed_fields(field_type: str, value: Any) -> dict[str, Any]:
+    if value is None:
+        return {}
+    if field_type == MetadataFieldType.NUMBER.value:
+        return {"value_number": Decimal(str(value)).quantize(_NUMBER_QUANTUM)}
+    if field_type == MetadataFieldType.DATE.value:
+        return {"value_date": date.fromisoformat(value)}
+    if field_type == MetadataFieldType.BOOLEAN.value:
+        return {"value_boolean": value}
+    return {"value_text": value}
+
+
+def _parse_datetime(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def item_metadata_responses(item: Item) -> list[ItemMetadataValueResponse]:
+    """Metadati dell'item dal documento denormalizzato, o dalla tabella EAV se non materializzato."""
+    document = item.metadata_doc
+    if document is None:
+        return [
+            ItemMetadataValueResponse(
+                **value.__dict__,
+                definition_key=value.definition.key if value.definition else None,
+                definition_label=value.definition.label if value.definition else None,
+                field_type=value.definition.field_type if value.definition else None,
+            )
+            for value in item.metadata_values
+        ]
+    return [
+        ItemMetadataValueResponse(
+            id=entry["id"],
+            item_id=cast(int, item.id),
+            definition_id=entry["definition_id"],
+            definition_key=key,
+            definition_label=entry["label"],
+            field_type=entry["field_type"],
+            data_ins=_parse_datetime(entry["data_ins"]),
+            data_mod=_parse_datetime(entry["data_mod"]),
+            user_ins=entry["user_ins"],
+            user_mod=entry["user_mod"],
+            **_typed_fields(entry["field_type"], entry["value"]),
+        )
+        for key, entry in sorted(document.items(), key=lambda pair: pair[1]["id"])
+    ]
+
+
+def load_missing_metadata(db: Session, items: Iterable[Item]) -> None:
+    """Carica in una sola query i metadati EAV degli item senza documento materializzato."""
+    missing = [cast(int, item.id) for item in items if item.metadata_doc is None]
+    if missing:
+        db.execute(
+            select(Item)
+            .where(Item.id.in_(missing))
+            .options(selectinload(Item.metadata_values).joinedload(ItemMetadataValue.definition))
+        ).scalars().all()
+
+
+def _build_documents(connection: Connection, item_ids: list[int]) -> dict[int, dict]:
+    documents: dict[int, dict] = {item_id: {} for item_id in item_ids}
+    rows = connection.execute(
+        select(
+            ItemMetadataValue.id,
+            ItemMetadataValue.item_id,
+            ItemMetadataValue.definition_id,
+            ItemMetadataValue.value_text,
+            ItemMetadataValue.value_number,
+            ItemMetadataValue.value_boolean,
+            ItemMetadataValue.value_date,
+            ItemMetadataValue.data_ins,
+            ItemMetadataValue.data_mod,
+            ItemMetadataValue.user_ins,
+            ItemMetadataValue.user_mod,
+            MetadataDefinition.key,
+            MetadataDefinition.label,
+            MetadataDefinition.field_type,
+        )
+        .join(MetadataDefinition, MetadataDefinition.id == ItemMetadataValue.definition_id)
+        .where(ItemMetadataValue.item_id.in_(item_ids))
+    )
+    for row in rows:
+        documents[row.item_id][row.key] = _document_entry(row)
+    return documents
+
+
+def _write_documents(connection: Connection, documents: dict[int, dict]) -> None:
+    table = Item.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("item_id"))
+        # data_mod esplicito: il ricalcolo non è una modifica dell'item (niente onupdate)
+        .values(metadata_doc=bindparam("doc"), data_mod=table.c.data_mod)
+    )
+    connection.execute(statement, [{"item_id": item_id, "doc": doc} for item_id, doc in documents.items()])
+
+
+def rebuild_metadata_docs(connection: Connection, item_ids: set[int] | None = None) -> None:
+    """Ricalcola il documento degli item indicati, o di tutti se non se ne indicano."""
+    if item_ids is None:
+        targets = list(connection.execute(select(Item.id).order_by(Item.id)).scalars())
+    else:
+        targets = sorted(item_ids)
+    for start in range(0, len(targets), REBUILD_CHUNK_SIZE):
+        _write_documents(connection, _build_documents(connection, targets[start:start + REBUILD_CHUNK_SIZE]))
+
+
+#############################################################################
+# Manutenzione automatica sulle scritture ORM
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault(_PENDING_KEY, {"items": [], "definitions": set()})
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_metadata_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, ItemMetadataValue):
+            pending = _pending(session)
+            if obj in session.new:
+                pending["items"].append(obj)  # item_id può arrivare dalla relazione: si legge in after_flush
+            else:
+                history = inspect(obj).attrs["item_id"].history
+                pending["items"].extend([*history.added, *history.deleted, *history.unchanged])
+        elif isinstance(obj, MetadataDefinition) and obj in session.dirty:
+            if any(inspect(obj).attrs[field].history.has_changes() for field in _DEFINITION_FIELDS):
+                _pending(session)["definitions"].add(obj.id)
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_metadata_changes(session, flush_context):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    item_ids = {ref if isinstance(ref, int) else ref.item_id for ref in pending["items"]} - {None}
+    connection = session.connection()
+    if pending["definitions"]:
+        item_ids |= set(connection.execute(
+            select(ItemMetadataValue.item_id).where(ItemMetadataValue.definition_id.in_(pending["definitions"]))
+        ).scalars())
+    if not item_ids:
+        return
+    documents = _build_documents(connection, sorted(item_ids))
+    _write_documents(connection, documents)
+    # Gli item già in sessione vedono subito il documento aggiornato, senza rileggerlo
+    for item_id, document in documents.items():
+        item = session.identity_map.get(inspect(Item).identity_key_from_primary_key((item_id,)))
+        if item is not None:
+            attributes.set_committed_value(item, "metadata_doc", document)
+
+
+def _bulk_statement_item_ids(orm_execute_state: ORMExecuteState) -> set[int] | None:
+    """Item toccati da uno statement bulk, o None se non si possono determinare."""
+    model = orm_execute_state.bind_mapper.class_
+    rows = statement_rows(orm_execute_state)
+    if orm_execute_state.is_insert:
+        if model is MetadataDefinition:
+            return set()  # una definizione nuova non ha ancora valori
+        # Insert multi-riga (import, benchmark): gli item sono nei parametri
+        if rows is not None and all("item_id" in row for row in rows):
+            return {row["item_id"] for row in rows}
+        return None
+
+    # Per i delete nessuna colonna assegnata; per gli update None = colonne non note
+    assigned = assigned_columns(orm_execute_state) if orm_execute_state.is_update else set()
+    whereclause = orm_execute_state.statement.whereclause
+    if model is MetadataDefinition:
+        if orm_execute_state.is_update and assigned is not None and not assigned & set(_DEFINITION_FIELDS):
+            return set()  # es. descrizione: il documento non cambia
+        definitions = select(MetadataDefinition.id)
+        if whereclause is not None:
+            definitions = definitions.where(whereclause)
+        values = select(ItemMetadataValue.item_id).where(ItemMetadataValue.definition_id.in_(definitions))
+    else:
+        values = select(ItemMetadataValue.item_id)
+        if whereclause is not None:
+            values = values.where(whereclause)
+        elif rows is not None and all("id" in row for row in rows):
+            # Update bulk per chiave primaria: le righe sono nei parametri
+            values = values.where(ItemMetadataValue.id.in_([row["id"] for row in rows]))
+
+    # Letti prima dell'esecuzione: dopo un delete le righe non ci sono più
+    item_ids = set(orm_execute_state.session.connection().execute(values.distinct()).scalars())
+    if model is ItemMetadataValue and (assigned is None or "item_id" in assigned):
+        # Valori spostati su altri item: anche le destinazioni vanno ricalcolate
+        if assigned is None or rows is None:
+            return None
+        item_ids |= {row["item_id"] for row in rows if row.get("item_id") is not None}
+    return item_ids
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statement(orm_execute_state: ORMExecuteState):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in (ItemMetadataValue, MetadataDefinition):
+        return
+    info = orm_execute_state.session.info
+    item_ids = _bulk_statement_item_ids(orm_execute_state)
+    if item_ids is None:
+        info[_BULK_ITEMS_KEY] = None  # item non noti: ricalcolo completo al commit
+        return
+    if not item_ids:
+        return
+    bulk_items = info.setdefault(_BULK_ITEMS_KEY, set())
+    if bulk_items is not None:
+        bulk_items.update(item_ids)
+
+
+@event.listens_for(Session, "before_commit")
+def _rebuild_after_bulk_statements(session):
+    if _BULK_ITEMS_KEY in session.info:
+        rebuild_metadata_docs(session.connection(), session.info.pop(_BULK_ITEMS_KEY))
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_BULK_ITEMS_KEY, None)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        rebuild_metadata_docs(db.connection())
+        db.commit()
+        rows = db.execute(select(func.count()).select_from(Item).where(Item.metadata_doc.isnot(None))).scalar()
+        logger.info("Documenti metadati ricostruiti: %d item", rows)
+    finally:
+        db.close()
@@ -0,0 +1,246 @@
+"""Motore unico dei filtri avanzati sui metadati degli item.
+
+Un filtro è un albero di gruppi (match_mode "all"/"any") con criteri di tipo misto.
+Viene compilato in un'unica query: gli item dell'inventario in LEFT JOIN con i soli valori
+delle definizioni coinvolte, raggruppati per item. Ogni criterio diventa un'aggregazione
+condizionale (MAX(CASE ...)) e l'albero AND/OR una condizione HAVING, quindi i valori
+vengono letti una volta sola invece che con una sottoquery EXISTS correlata per criterio.
+
+La compilazione dipende solo dai criteri e dal tipo delle definizioni, non dall'inventario:
+l'applicabilità delle definizioni va verificata a parte (definition_ids).
+
+Le condizioni HAVING non possono usare indici, quindi la compilazione ricava anche una
+precondizione necessaria (prefilter) dai criteri "positivi" (un valore che deve esistere):
+`item.id IN (SELECT item_id ... WHERE definition_id = ? AND value_<tipo> ...)`, servita
+dagli indici tipizzati (definition_id, value_<tipo>, item_id). Restringe gli item da
+aggregare senza cambiare il risultato, che resta deciso da HAVING.
+"""
+from __future__ import annotations
+
+import base64
+import json
+from dataclasses import dataclass
+from typing import Mapping
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import Select, and_, case, false, func, or_, select, true
+from sqlalchemy.sql.elements import ColumnElement
+
+from metadata_model import MetadataFieldType, MetadataFilterOperator
+from models import Item, ItemMetadataValue
+from schemas import (
+    BooleanMetadataFilterCriterion,
+    DateMetadataFilterCriterion,
+    MetadataFilterCriterion,
+    MetadataFilterGroup,
+    NumericMetadataFilterCriterion,
+    TextMetadataFilterCriterion,
+)
+
+MAX_FILTER_DEPTH = 4
+MAX_FILTER_CRITERIA = 50
+
+_TYPED_CRITERIA: dict[MetadataFieldType, type[BaseModel]] = {
+    MetadataFieldType.TEXT: TextMetadataFilterCriterion,
+    MetadataFieldType.LIST: TextMetadataFilterCriterion,
+    MetadataFieldType.NUMBER: NumericMetadataFilterCriterion,
+    MetadataFieldType.DATE: DateMetadataFilterCriterion,
+    MetadataFieldType.BOOLEAN: BooleanMetadataFilterCriterion,
+}
+
+_VALUE_COLUMNS = {
+    MetadataFieldType.TEXT: ItemMetadataValue.value_text,
+    MetadataFieldType.LIST: ItemMetadataValue.value_text,
+    MetadataFieldType.NUMBER: ItemMetadataValue.value_number,
+    MetadataFieldType.DATE: ItemMetadataValue.value_date,
+    MetadataFieldType.BOOLEAN: ItemMetadataValue.value_boolean,
+}
+
+
+class MetadataFilterError(ValueError):
+    """Filtro non valido: il messaggio è pensato per essere restituito al client (400)."""
+
+
+@dataclass(frozen=True)
+class CompiledMetadataFilter:
+    match_mode: str
+    definition_ids: frozenset[int]
+    condition: ColumnElement[bool]  # condizione HAVING sugli aggregati per item
+    prefilter: ColumnElement[bool] | None = None  # condizione WHERE necessaria, servita dagli indici
+
+
+def _typed_criterion(criterion: MetadataFilterCriterion, field_type: MetadataFieldType):
+    model = _TYPED_CRITERIA[field_type]
+    try:
+        return model.model_validate(criterion.model_dump(exclude={"field_type"}, exclude_none=True))
+    except ValidationError as exc:
+        message = str(exc.errors()[0]["msg"]).removeprefix("Value error, ")
+        raise MetadataFilterError(f"Criterio non valido per la definizione {criterion.definition_id}: {message}")
+
+
+def _value_condition(field_type: MetadataFieldType, criterion) -> ColumnElement[bool]:
+    op = criterion.operator
+    column = _VALUE_COLUMNS[field_type]
+
+    if field_type in (MetadataFieldType.TEXT, MetadataFieldType.LIST):
+        if field_type == MetadataFieldType.LIST and op in (
+            MetadataFilterOperator.CONTAINS,
+            MetadataFilterOperator.NOT_CONTAINS,
+        ):
+            raise MetadataFilterError("L'operatore scelto non è supportato per il tipo LIST")
+        value = criterion.value_text
+    elif field_type == MetadataFieldType.NUMBER:
+        value = criterion.value_number
+    elif field_type == MetadataFieldType.DATE:
+        value = criterion.value_date
+    else:
+        value = criterion.value_boolean
+
+    if op == MetadataFilterOperator.EQUALS:
+        comparison = column == value
+    elif op == MetadataFilterOperator.NOT_EQUALS:
+        comparison = column != value
+    elif op == MetadataFilterOperator.CONTAINS:
+        comparison = column.ilike(f"%{value}%")
+    elif op == MetadataFilterOperator.NOT_CONTAINS:
+        comparison = ~column.ilike(f"%{value}%")
+    elif op == MetadataFilterOperator.GREATER_THAN:
+        comparison = column > value
+    elif op == MetadataFilterOperator.GREATER_THAN_OR_EQUAL:
+        comparison = column >= value
+    elif op == MetadataFilterOperator.LESS_THAN:
+        comparison = column < value
+    elif op == MetadataFilterOperator.LESS_THAN_OR_EQUAL:
+        comparison = column <= value
+    elif op == MetadataFilterOperator.BETWEEN:
+        comparison = column.between(criterion.range_from, criterion.range_to)
+    else:
+        raise MetadataFilterError(f"Operatore non supportato: {op.value}")
+    return and_(column.is_not(None), comparison)
+
+
+def _criterion_condition(
+    criterion: MetadataFilterCriterion,
+    field_type: MetadataFieldType,
+) -> tuple[ColumnElement[bool], ColumnElement[bool] | None]:
+    """Condizione HAVING del criterio e, se il criterio richiede una riga, il predicato su quella riga."""
+    typed = _typed_criterion(criterion, field_type)
+    of_definition = ItemMetadataValue.definition_id == criterion.definition_id
+
+    # 1 se almeno una riga del gruppo (item) soddisfa la condizione, 0 altrimenti
+    def any_row(condition):
+        return func.max(case((condition, 1), else_=0))
+
+    if typed.operator == MetadataFilterOperator.IS_NULL:
+        return any_row(of_definition) == 0, None
+    if typed.operator == MetadataFilterOperator.IS_NOT_NULL:
+        return any_row(of_definition) == 1, of_definition
+    row_condition = and_(of_definition, _value_condition(field_type, typed))
+    return any_row(row_condition) == 1, row_condition
+
+
+def _items_with_rows(row_condition: ColumnElement[bool]) -> ColumnElement[bool]:
+    return Item.id.in_(select(ItemMetadataValue.item_id).where(row_condition))
+
+
+def compile_metadata_filter(
+    group: MetadataFilterGroup,
+    field_types: Mapping[int, str],
+) -> CompiledMetadataFilter:
+    """Compila un gruppo di criteri; `field_types` mappa definition_id -> field_type delle definizioni ammesse."""
+    definition_ids: set[int] = set()
+    criteria_count = 0
+
+    def compile_group(
+        node: MetadataFilterGroup,
+        depth: int,
+    ) -> tuple[ColumnElement[bool], ColumnElement[bool] | None]:
+        nonlocal criteria_count
+        if depth > MAX_FILTER_DEPTH:
+            raise MetadataFilterError(f"Troppi livelli di gruppi annidati (massimo {MAX_FILTER_DEPTH})")
+        conditions = []
+        row_conditions = []
+        for criterion in node.criteria:
+            criteria_count += 1
+            if criteria_count > MAX_FILTER_CRITERIA:
+                raise MetadataFilterError(f"Troppi criteri nel filtro (massimo {MAX_FILTER_CRITERIA})")
+            field_type = field_types.get(criterion.definition_id)
+            if field_type is None:
+                raise MetadataFilterError(
+                    "Una o più definizioni non sono valide per questo inventario o risultano inattive"
+                )
+            definition_ids.add(criterion.definition_id)
+            condition, row_condition = _criterion_condition(criterion, MetadataFieldType(field_type))
+            conditions.append(condition)
+            row_conditions.append(row_condition)
+        children = [compile_group(child, depth + 1) for child in node.groups]
+        conditions.extend(condition for condition, _ in children)
+        if not conditions:
+            return (true(), None) if node.match_mode == "all" else (false(), None)
+
+        if node.match_mode == "all":
+            # Ogni criterio positivo e ogni precondizione dei sottogruppi è necessaria
+            prefilters = [_items_with_rows(row) for row in row_conditions if row is not None]
+            prefilters.extend(prefilter for _, prefilter in children if prefilter is not None)
+            return and_(*conditions), and_(*prefilters) if prefilters else None
+
+        # "any": serve una precondizione per ogni alternativa, altrimenti nessuna
+        if any(row is None for row in row_conditions) or any(prefilter is None for _, prefilter in children):
+            return or_(*conditions), None
+        prefilters = [_items_with_rows(or_(*row_conditions))] if row_conditions else []
+        prefilters.extend(prefilter for _, prefilter in children)
+        return or_(*conditions), or_(*prefilters)
+
+    condition, prefilter = compile_group(group, 1)
+    return CompiledMetadataFilter(
+        match_mode=group.match_mode,
+        definition_ids=frozenset(definition_ids),
+        condition=condition,
+        prefilter=prefilter,
+    )
+
+
+def filter_definition_ids(group: MetadataFilterGroup) -> set[int]:
+    ids = {criterion.definition_id for criterion in group.criteria}
+    for child in group.groups:
+        ids |= filter_definition_ids(child)
+    return ids
+
+
+def matching_items_select(
+    inventory_id: int,
+    compiled: CompiledMetadataFilter,
+    after_id: int | None = None,
+) -> Select:
+    """ID degli item dell'inventario che soddisfano il filtro, in ordine di ID."""
+    query = (
+        select(Item.id)
+        .outerjoin(
+            ItemMetadataValue,
+            and_(
+                ItemMetadataValue.item_id == Item.id,
+                ItemMetadataValue.definition_id.in_(sorted(compiled.definition_ids)),
+            ),
+        )
+        .where(Item.inventory_id == inventory_id)
+        .group_by(Item.id)
+        .having(compiled.condition)
+        .order_by(Item.id.asc())
+    )
+    if compiled.prefilter is not None:
+        query = query.where(compiled.prefilter)
+    if after_id is not None:
+        query = query.where(Item.id > after_id)
+    return query
+
+
+def encode_filter_cursor(item_id: int) -> str:
+    payload = json.dumps({"after": item_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_filter_cursor(cursor: str) -> int:
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))["after"])
+    except (ValueError, KeyError, TypeError, UnicodeError):
+        raise MetadataFilterError("Cursore non valido")
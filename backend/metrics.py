@@ -0,0 +1,240 @@
+"""Strumentazione delle richieste HTTP: latenza per route, numero di query SQL e tempo DB.
+
+Il middleware ASGI apre un contatore per richiesta (contextvar, ereditato anche dai thread
+del threadpool e dalle sessioni async), gli eventi dell'Engine lo incrementano a ogni
+statement e a fine richiesta i valori confluiscono negli istogrammi per route.
+La risposta riceve l'header `Server-Timing`; gli aggregati sono esposti in formato
+Prometheus da `GET /system/metrics`. I dati sono per processo (un set per worker).
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SERVER_TIMING_ENABLED = os.getenv("METRICS_SERVER_TIMING", "true").lower() == "true"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+UNMATCHED_ROUTE = "unmatched"
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+_current_request: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> RequestStats | None:
+    return _current_request.get()
+
+
+#############################################################################
+# Eventi SQLAlchemy: valgono per tutti gli engine (sync, async e quelli dei test)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_request.get() is not None:
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_request.get()
+    started = conn.info.get("query_started_at")
+    if stats is None or not started:
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - started.pop()
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started_at") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+#############################################################################
+# Aggregati per route
+
+@dataclass
+class _Histogram:
+    buckets: tuple
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    samples: int = 0
+
+    def __post_init__(self):
+        self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float):
+        self.samples += 1
+        self.total += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+@dataclass
+class _RouteMetrics:
+    latency: _Histogram = field(default_factory=lambda: _Histogram(LATENCY_BUCKETS))
+    queries: _Histogram = field(default_factory=lambda: _Histogram(QUERY_COUNT_BUCKETS))
+    db_seconds: float = 0.0
+
+
+class RequestMetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: dict[tuple[str, str, str], _RouteMetrics] = {}
+
+    def observe(self, method: str, route: str, status: int, duration: float, stats: RequestStats):
+        key = (method, route, str(status))
+        with self._lock:
+            metrics = self._routes.get(key)
+            if metrics is None:
+                metrics = self._routes[key] = _RouteMetrics()
+            metrics.latency.observe(duration)
+            metrics.queries.observe(stats.queries)
+            metrics.db_seconds += stats.db_seconds
+
+    def snapshot(self) -> dict[tuple[str, str, str], _RouteMetrics]:
+        with self._lock:
+            return {
+                key: _RouteMetrics(
+                    latency=_copy_histogram(value.latency),
+                    queries=_copy_histogram(value.queries),
+                    db_seconds=value.db_seconds,
+                )
+                for key, value in self._routes.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+def _copy_histogram(histogram: _Histogram) -> _Histogram:
+    copy = _Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.total = histogram.total
+    copy.samples = histogram.samples
+    return copy
+
+
+request_metrics = RequestMetricsRegistry()
+
+
+def route_template(scope) -> str:
+    # Template della route (/item/{item_id}) invece del path reale, per non esplodere la cardinalità.
+    # Con i router inclusi la route conosce solo il proprio path: il prefisso si ricava dal path reale.
+    route = scope.get("route")
+    path_regex = getattr(route, "path_regex", None)
+    path_format = getattr(route, "path_format", None)
+    if path_regex is None or path_format is None:
+        return UNMATCHED_ROUTE
+    path = scope.get("path", "")
+    for index, char in enumerate(path):
+        if char == "/" and path_regex.match(path[index:]):
+            return path[:index] + path_format
+    return path_format
+
+
+#############################################################################
+# Middleware ASGI (puro: non bufferizza le StreamingResponse)
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    header = (
+                        f'app;dur={elapsed_ms:.1f}, '
+                        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"'
+                    ).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            request_metrics.observe(scope["method"], route_template(scope), status_code, time.perf_counter() - started, stats)
+
+
+#############################################################################
+# Esposizione in formato Prometheus
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{name}="{_escape_label(str(value))}"' for name, value in labels.items())
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render_histogram(lines: list[str], name: str, labels: str, histogram: _Histogram):
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.samples}')
+    lines.append(f"{name}_sum{{{labels}}} {_format_value(histogram.total)}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.samples}")
+
+
+def render_prometheus(gauges: dict[str, tuple[str, str, float | int | None]] | None = None) -> str:
+    """Restituisce le metriche in formato testo Prometheus.
+
+    `gauges` aggiunge metriche puntuali nella forma {nome: (tipo, descrizione, valore)}.
+    """
+    lines: list[str] = []
+    snapshot = request_metrics.snapshot()
+
+    lines.append("# HELP http_request_duration_seconds Durata delle richieste HTTP per route.")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route, status), metrics in sorted(snapshot.items()):
+        _render_histogram(lines, "http_request_duration_seconds", _labels(method=method, route=route, status=status), metrics.latency)
+
+    lines.append("# HELP http_request_sql_queries Numero di statement SQL eseguiti per richiesta.")
+    lines.append("# TYPE http_request_sql_queries histogram")
+    for (method, route, status), metrics in sorted(snapshot.items()):
+        _render_histogram(lines, "http_request_sql_queries", _labels(method=method, route=route, status=status), metrics.queries)
+
+    lines.append("# HELP http_request_db_seconds_total Tempo totale speso nel database per route.")
+    lines.append("# TYPE http_request_db_seconds_total counter")
+    for (method, route, status), metrics in sorted(snapshot.items()):
+        lines.append(f"http_request_db_seconds_total{{{_labels(method=method, route=route, status=status)}}} {_format_value(metrics.db_seconds)}")
+
+    for name, (metric_type, description, value) in (gauges or {}).items():
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,41 @@
+"""add composite indexes for keyset item pagination
+
+Revision ID: a3b4c5d6e7f8
+Revises: f2a3b4c5d6e7
+Create Date: 2026-10-18 12:00:00.000000
+
+Un indice (inventory_id, <campo ordinamento>, id) per ogni ordinamento di
+/item/{inventory_id}/page: ogni pagina è un index range scan limitato.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3b4c5d6e7f8'
+down_revision: Union[str, None] = 'f2a3b4c5d6e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_inventory_name_id "
+        "ON items (inventory_id, name, id)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_inventory_data_mod_id "
+        "ON items (inventory_id, data_mod, id)"
+    )
+    # Deve coincidere con l'espressione di ordinamento in _item_sort_expression("quantity")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_inventory_quantity_id "
+        "ON items (inventory_id, (coalesce(quantity, 0)), id)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_items_inventory_quantity_id")
+    op.execute("DROP INDEX IF EXISTS ix_items_inventory_data_mod_id")
+    op.execute("DROP INDEX IF EXISTS ix_items_inventory_name_id")
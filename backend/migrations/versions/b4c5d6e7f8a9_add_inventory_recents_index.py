@@ -0,0 +1,30 @@
+"""add inventories (data_mod, id) index for /recents
+
+Revision ID: b4c5d6e7f8a9
+Revises: a3b4c5d6e7f8
+Create Date: 2026-10-18 14:00:00.000000
+
+/recents ordina gli inventari visibili per data_mod DESC, id DESC con LIMIT:
+con questo indice il planner legge solo le prime righe invece di ordinare la tabella.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4c5d6e7f8a9'
+down_revision: Union[str, None] = 'a3b4c5d6e7f8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_inventories_data_mod_id "
+        "ON inventories (data_mod DESC, id DESC)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_inventories_data_mod_id")
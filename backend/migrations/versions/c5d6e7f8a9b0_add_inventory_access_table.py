@@ -0,0 +1,72 @@
+"""add materialized inventory_access table
+
+Revision ID: c5d6e7f8a9b0
+Revises: b4c5d6e7f8a9
+Create Date: 2026-10-18 16:00:00.000000
+
+Accesso effettivo utente/inventario (proprietario, condivisione diretta o di gruppo)
+mantenuto dall'applicazione (inventory_access.py): i controlli di visibilità diventano
+una lookup sulla chiave primaria invece di tre sottoquery su condivisioni e gruppi.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d6e7f8a9b0'
+down_revision: Union[str, None] = 'b4c5d6e7f8a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if 'inventory_access' not in set(inspector.get_table_names()):
+        op.create_table(
+            'inventory_access',
+            sa.Column('user_id', sa.Integer(),
+                      sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('inventory_id', sa.Integer(),
+                      sa.ForeignKey('inventories.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('level', sa.String(length=8), nullable=False),
+            sa.CheckConstraint("level IN ('view', 'edit')", name='ck_inventory_access_level'),
+        )
+
+    op.execute("CREATE INDEX IF NOT EXISTS ix_inventory_access_inventory_id ON inventory_access (inventory_id)")
+
+    # Popolamento iniziale (idempotente): stesse regole di inventory_access.effective_access_select
+    op.execute("DELETE FROM inventory_access")
+    op.execute(
+        """
+        INSERT INTO inventory_access (user_id, inventory_id, level)
+        SELECT
+            paths.user_id,
+            paths.inventory_id,
+            CASE WHEN r.name IN ('admin', 'moderator') THEN 'edit' ELSE 'view' END
+        FROM (
+            SELECT owner_id AS user_id, id AS inventory_id
+            FROM inventories
+            WHERE owner_id IS NOT NULL
+            UNION
+            SELECT user_id, inventory_id
+            FROM shared_inventories
+            WHERE user_id IS NOT NULL AND inventory_id IS NOT NULL
+            UNION
+            SELECT uga.user_id, sig.inventory_id
+            FROM shared_inventory_groups sig
+            JOIN user_group_association uga ON uga.group_id = sig.group_id
+            WHERE sig.inventory_id IS NOT NULL
+        ) paths
+        JOIN users u ON u.id = paths.user_id
+        JOIN roles r ON r.id = u.role_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_inventory_access_inventory_id")
+    op.drop_table('inventory_access')
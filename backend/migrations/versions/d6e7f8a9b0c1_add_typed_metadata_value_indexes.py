@@ -0,0 +1,47 @@
+"""add typed partial indexes for metadata filters
+
+Revision ID: d6e7f8a9b0c1
+Revises: c5d6e7f8a9b0
+Create Date: 2026-10-18 18:00:00.000000
+
+I filtri sui metadati cercano sempre (definition_id, valore tipizzato): un indice
+(definition_id, value_<tipo>, item_id) parziale sulle sole righe di quel tipo rende
+ogni criterio di confronto o intervallo un index range scan che restituisce gli item
+senza leggere la tabella. Sostituiscono gli indici su singola colonna di valore,
+mai usati da soli e costosi a ogni scrittura.
+
+I testi restano coperti dall'indice trigram GIN su value_text (e1f2a3b4c5d6), che
+serve sia ILIKE '%...%' sia l'uguaglianza, e dall'indice B-tree su value_text.
+Gli stessi indici sono dichiarati in models.ItemMetadataValue.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6e7f8a9b0c1'
+down_revision: Union[str, None] = 'c5d6e7f8a9b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TYPED_VALUE_COLUMNS = ("value_number", "value_date", "value_boolean")
+
+
+def upgrade() -> None:
+    for column in TYPED_VALUE_COLUMNS:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_item_metadata_values_definition_{column}_item "
+            f"ON item_metadata_values (definition_id, {column}, item_id) "
+            f"WHERE {column} IS NOT NULL"
+        )
+        op.execute(f"DROP INDEX IF EXISTS ix_item_metadata_values_{column}")
+
+
+def downgrade() -> None:
+    for column in reversed(TYPED_VALUE_COLUMNS):
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_item_metadata_values_{column} "
+            f"ON item_metadata_values ({column})"
+        )
+        op.execute(f"DROP INDEX IF EXISTS ix_item_metadata_values_definition_{column}_item")
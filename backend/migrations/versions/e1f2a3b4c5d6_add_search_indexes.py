@@ -0,0 +1,42 @@
+"""add trigram search indexes on items
+
+Revision ID: e1f2a3b4c5d6
+Revises: d4e5f6a7b8c9
+Create Date: 2026-10-18 10:00:00.000000
+
+Indici usati da search.search_items: GIN pg_trgm su items.name, items.description
+e item_metadata_values.value_text (ILIKE '%filtro%' senza full scan).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f2a3b4c5d6'
+down_revision: Union[str, None] = 'd4e5f6a7b8c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_name_trgm "
+        "ON items USING gin (name gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_description_trgm "
+        "ON items USING gin (description gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_item_metadata_values_value_text_trgm "
+        "ON item_metadata_values USING gin (value_text gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_item_metadata_values_value_text_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_items_description_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_items_name_trgm")
@@ -0,0 +1,75 @@
+"""add denormalized metadata projection on items
+
+Revision ID: e7f8a9b0c1d2
+Revises: d6e7f8a9b0c1
+Create Date: 2026-10-18 20:00:00.000000
+
+items.metadata_doc: mappa chiave definizione -> valore tipizzato (più id, etichetta,
+tipo e dati di log del valore), mantenuta dall'applicazione (metadata_doc.py) nella
+stessa transazione delle scritture sui metadati. Liste e ricerca di item leggono solo
+la tabella items invece di caricare valori e definizioni.
+
+Su PostgreSQL la colonna è JSONB con indice GIN (jsonb_path_ops, per le ricerche
+per contenimento) e viene popolata qui; sugli altri database resta NULL, cioè
+"non materializzata", finché non si esegue `python metadata_doc.py`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7f8a9b0c1d2'
+down_revision: Union[str, None] = 'd6e7f8a9b0c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    columns = {column["name"] for column in sa.inspect(bind).get_columns("items")}
+    if "metadata_doc" not in columns:
+        op.add_column(
+            "items",
+            sa.Column("metadata_doc", sa.JSON().with_variant(postgresql.JSONB(), "postgresql"), nullable=True),
+        )
+
+    if bind.dialect.name != "postgresql":
+        return
+
+    # Stesso formato di metadata_doc._document_entry
+    op.execute(
+        """
+        UPDATE items SET metadata_doc = docs.doc
+        FROM (
+            SELECT v.item_id, jsonb_object_agg(d.key, jsonb_build_object(
+                'id', v.id,
+                'definition_id', v.definition_id,
+                'label', d.label,
+                'field_type', d.field_type,
+                'value', coalesce(to_jsonb(v.value_text), to_jsonb(v.value_number),
+                                  to_jsonb(v.value_boolean), to_jsonb(v.value_date)),
+                'data_ins', v.data_ins,
+                'data_mod', v.data_mod,
+                'user_ins', v.user_ins,
+                'user_mod', v.user_mod
+            )) AS doc
+            FROM item_metadata_values v
+            JOIN metadata_definitions d ON d.id = v.definition_id
+            GROUP BY v.item_id
+        ) AS docs
+        WHERE docs.item_id = items.id
+        """
+    )
+    op.execute("UPDATE items SET metadata_doc = '{}'::jsonb WHERE metadata_doc IS NULL")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_metadata_doc "
+        "ON items USING gin (metadata_doc jsonb_path_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_items_metadata_doc")
+    op.drop_column("items", "metadata_doc")
@@ -0,0 +1,48 @@
+"""add current_version to items and inventories
+
+Revision ID: f2a3b4c5d6e7
+Revises: e1f2a3b4c5d6
+Create Date: 2026-10-18 11:00:00.000000
+
+Contatore dell'ultima version_num scritta, mantenuto da _write_item_version /
+_write_inventory_version: evita un MAX() sulle shadow table per ogni riga letta.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a3b4c5d6e7'
+down_revision: Union[str, None] = 'e1f2a3b4c5d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for table_name in ('items', 'inventories'):
+        existing_columns = {column['name'] for column in inspector.get_columns(table_name)}
+        if 'current_version' not in existing_columns:
+            op.add_column(
+                table_name,
+                sa.Column('current_version', sa.Integer(), nullable=False, server_default='0'),
+            )
+
+    # Backfill dalla cronologia esistente
+    op.execute(
+        "UPDATE items SET current_version = COALESCE("
+        "(SELECT MAX(v.version_num) FROM item_versions v WHERE v.item_id = items.id), 0)"
+    )
+    op.execute(
+        "UPDATE inventories SET current_version = COALESCE("
+        "(SELECT MAX(v.version_num) FROM inventory_versions v WHERE v.inventory_id = inventories.id), 0)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('inventories', 'current_version')
+    op.drop_column('items', 'current_version')
@@ -14,11 +14,14 @@ from sqlalchemy import (
     func,
     UniqueConstraint,
     CheckConstraint,
+    Index,
+    text,
 )
 try:
-    from sqlalchemy.dialects.postgresql import JSON
+    from sqlalchemy.dialects.postgresql import JSON, JSONB
 except ImportError:
     from sqlalchemy import JSON
+    JSONB = JSON
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship, sessionmaker, declarative_base, Session
 from enum import Enum
@@ -103,6 +106,11 @@ class User(Base, LoggingData):
                           overlaps="group_associations,user,group"
                         )
 
+    @property
+    def group_ids(self) -> frozenset[int]:
+        # Stessa interfaccia di dependencies.AuthPrincipal.group_ids
+        return frozenset(cast(int, assoc.group_id) for assoc in self.group_associations)
+
 ################################################
 class Group(Base, LoggingData):
     __tablename__ = "groups"
@@ -137,6 +145,7 @@ class Inventory(Base, LoggingData):
     type = Column(String, nullable=False, default="INVENTORY")
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", foreign_keys=[owner_id])
+    current_version = Column(Integer, nullable=False, default=0, server_default="0")  # ultima version_num scritta
     items = relationship("Item", back_populates="inventory", cascade="all, delete-orphan")
 
     # Relazione per gli utenti con cui è condiviso
@@ -154,6 +163,13 @@ class Item(Base, LoggingData):
     description = Column(String, nullable=True)
     quantity = Column(Integer, index=True)
     inventory_id = Column(Integer, ForeignKey("inventories.id"), nullable=False)
+    current_version = Column(Integer, nullable=False, default=0, server_default="0")  # ultima version_num scritta
+    # Proiezione dei metadati mantenuta da metadata_doc.py; NULL = non materializzata
+    metadata_doc = Column(
+        JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql"),
+        nullable=True,
+        default=dict,
+    )
     inventory = relationship("Inventory", back_populates="items")
     metadata_values = relationship("ItemMetadataValue", back_populates="item", cascade="all, delete-orphan")
 
@@ -220,6 +236,16 @@ class ItemMetadataValue(Base, LoggingData):
             ") = 1",
             name="ck_item_metadata_values_single_typed_value",
         ),
+        # Indici tipizzati per i filtri: (definizione, valore) -> item, solo sulle righe del tipo
+        *(
+            Index(
+                f"ix_item_metadata_values_definition_{column}_item",
+                "definition_id", column, "item_id",
+                postgresql_where=text(f"{column} IS NOT NULL"),
+                sqlite_where=text(f"{column} IS NOT NULL"),
+            )
+            for column in ("value_number", "value_date", "value_boolean")
+        ),
     )
 
     id = Column(Integer, primary_key=True, index=True)
@@ -256,6 +282,21 @@ class SharedInventoryGroup(Base, LoggingData):
     inventory = relationship("Inventory", back_populates="shared_with_groups")
     group = relationship("Group", backref="shared_inventories")
 
+################################################
+class InventoryAccess(Base):
+    """Accesso effettivo di un utente a un inventario (proprietario, condivisione diretta o di gruppo).
+
+    Tabella derivata, mantenuta da inventory_access.py: non va scritta direttamente.
+    """
+    __tablename__ = "inventory_access"
+    __table_args__ = (
+        CheckConstraint("level IN ('view', 'edit')", name="ck_inventory_access_level"),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    inventory_id = Column(Integer, ForeignKey("inventories.id", ondelete="CASCADE"), primary_key=True, index=True)
+    level = Column(String(8), nullable=False)  # "edit" per admin e moderatori, altrimenti "view"
+
 ################################################
 class Setting(Base, LoggingData):
     __tablename__ = "settings"
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from models import User, Role, RoleEnum
-from dependencies import get_db, role_required
+from dependencies import get_db, invalidate_principal, role_required
 
 #router = APIRouter()
 router = APIRouter(dependencies=[Depends(role_required(RoleEnum.admin))])
@@ -33,6 +33,7 @@ def update_user_role(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Ruolo non valido")
 
     db.commit()
+    invalidate_principal(user_id)
 
     return {
         "message": "Ruolo aggiornato con successo",
@@ -3,12 +3,12 @@ Route centralizzato per audit log e query storiche
 """
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, false, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, desc, func, select
 from datetime import datetime, timezone
-from models import ItemVersion, InventoryVersion, User, Inventory
+from models import ItemVersion, InventoryVersion, Inventory
 from schemas import ItemVersionResponse, InventoryVersionResponse
-from routes.auth import get_current_user
-from dependencies import get_db
+from dependencies import AuthPrincipal, get_async_db, get_current_user_async
 from typing import List, Optional, cast
 
 router = APIRouter()
@@ -17,21 +17,36 @@ router = APIRouter()
 # Query audit centralizzate (sola lettura)
 #############################################################################
 
+# Le route sono async: le query (sync) girano con adb.run_sync sul driver async
 @router.get("/logs/items", response_model=List[ItemVersionResponse])
-def get_item_audit_logs(
+async def get_item_audit_logs(
     inventory_id: Optional[int] = None,
     user_id: Optional[int] = None,
     user_scope: Optional[str] = None,
     operation: Optional[str] = None,
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    adb: AsyncSession = Depends(get_async_db),
+    current_user: AuthPrincipal = Depends(get_current_user_async),
 ):
     """
     Recupera i log di audit degli item filtrati.
     Solo admin può vedere tutti i log; gli altri vedono solo i log dei loro inventari.
     """
+    return await adb.run_sync(lambda db: item_audit_logs_base(
+        db, current_user, inventory_id, user_id, user_scope, operation, from_date, to_date
+    ))
+
+def item_audit_logs_base(
+    db: Session,
+    current_user: AuthPrincipal,
+    inventory_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    user_scope: Optional[str] = None,
+    operation: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+):
     query = db.query(ItemVersion)
 
     # Filtri opzionali
@@ -70,22 +85,10 @@ def get_item_audit_logs(
         normalized_to = to_date.astimezone(timezone.utc).replace(tzinfo=None) if to_date.tzinfo else to_date
         query = query.filter(ItemVersion.changed_at <= normalized_to)
 
-    # Permessi: solo admin vede tutto, altri vedono solo i loro inventari
+    # Permessi: solo admin vede tutto, altri vedono solo i loro inventari (filtro in SQL)
     if current_user.role.name != "admin":
-        visible_inventory_ids = (
-            db.query(Inventory.id)
-            .filter(
-                or_(
-                    Inventory.owner_id == current_user.id,
-                )
-            )
-            .all()
-        )
-        ids = [inv_id[0] for inv_id in visible_inventory_ids]
-        if ids:
-            query = query.filter(ItemVersion.inventory_id.in_(ids))
-        else:
-            query = query.filter(false())  # No access
+        owned_inventory_ids = select(Inventory.id).where(Inventory.owner_id == current_user.id)
+        query = query.filter(ItemVersion.inventory_id.in_(owned_inventory_ids))
 
     logs = query.order_by(desc(ItemVersion.changed_at)).all()
 
@@ -128,20 +131,34 @@ def get_item_audit_logs(
     return logs
 
 @router.get("/logs/inventories", response_model=List[InventoryVersionResponse])
-def get_inventory_audit_logs(
+async def get_inventory_audit_logs(
     user_id: Optional[int] = None,
     user_scope: Optional[str] = None,
     operation: Optional[str] = None,
     inventory_type: Optional[str] = None,
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    adb: AsyncSession = Depends(get_async_db),
+    current_user: AuthPrincipal = Depends(get_current_user_async),
 ):
     """
     Recupera i log di audit degli inventari/liste filtrati.
     Solo admin può vedere tutti; gli altri vedono solo i loro.
     """
+    return await adb.run_sync(lambda db: inventory_audit_logs_base(
+        db, current_user, user_id, user_scope, operation, inventory_type, from_date, to_date
+    ))
+
+def inventory_audit_logs_base(
+    db: Session,
+    current_user: AuthPrincipal,
+    user_id: Optional[int] = None,
+    user_scope: Optional[str] = None,
+    operation: Optional[str] = None,
+    inventory_type: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+):
     query = db.query(InventoryVersion)
 
     if user_id:
@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from models import User, RoleEnum, Role
 from schemas import UserCreateSelf, Token, UserResponse, UserSelfUpdate
 from passlib.context import CryptContext
 import jwt
+import asyncio
 import datetime
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.security.utils import get_authorization_scheme_param
 from dotenv import load_dotenv
-from dependencies import get_db, get_current_user
+from dependencies import get_db, get_current_user, invalidate_principal
 from crud import get_setting, set_setting
 
 load_dotenv()
@@ -20,7 +24,18 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Costo bcrypt: gli hash con un costo diverso vengono ricalcolati al login successivo
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 def hash_password(password: str):
@@ -29,6 +44,52 @@ def hash_password(password: str):
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+#############################################################################
+# Pool dedicato per bcrypt: login/registrazione non occupano i thread condivisi
+# degli endpoint sync. Oltre PASSWORD_HASH_MAX_QUEUE richieste in attesa si risponde 503.
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_password_stats_lock = threading.Lock()
+_password_stats = {"pending": 0, "running": 0, "completed": 0, "rejected": 0}
+
+
+def get_password_hash_stats() -> dict:
+    with _password_stats_lock:
+        stats = dict(_password_stats)
+    stats["queued"] = max(0, stats["pending"] - stats["running"])
+    stats.update(workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE, bcrypt_rounds=BCRYPT_ROUNDS)
+    return stats
+
+
+def _run_tracked(func, *args):
+    with _password_stats_lock:
+        _password_stats["running"] += 1
+    try:
+        return func(*args)
+    finally:
+        with _password_stats_lock:
+            _password_stats["running"] -= 1
+            _password_stats["pending"] -= 1
+            _password_stats["completed"] += 1
+
+
+async def _run_password_task(func, *args):
+    with _password_stats_lock:
+        if _password_stats["pending"] - _password_stats["running"] >= PASSWORD_HASH_MAX_QUEUE:
+            _password_stats["rejected"] += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server occupato, riprova tra poco")
+        _password_stats["pending"] += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, _run_tracked, func, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_password_task(pwd_context.hash, password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    # Restituisce (valida, nuovo_hash); nuovo_hash è valorizzato se il costo è cambiato
+    return await _run_password_task(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: int = ACCESS_TOKEN_EXPIRE_MINUTES):
     expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=expires_delta)
     to_encode = data.copy()
@@ -37,20 +98,17 @@ def create_access_token(data: dict, expires_delta: int = ACCESS_TOKEN_EXPIRE_MIN
 
 #############################################################################
 # Registrazione utente
-@router.post("/register", response_model=dict)
-def register(
-    user: UserCreateSelf,
-    db: Session = Depends(get_db)
-):
+# Gli handler sono async: le query girano nel threadpool, bcrypt nel pool dedicato
+def _check_registration_allowed(db: Session, username: str):
     setting = get_setting(db, "ENABLE_REGISTRATION")
     if (setting.value if setting else "true").lower() != "true":
         raise HTTPException(status_code=403, detail="Registrazione disabilitata")
-    
-    db_user = db.query(User).filter(User.username == user.username).first()
+
+    db_user = db.query(User).filter(User.username == username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username già in uso")
-    hashed_password = hash_password(user.password)
 
+def _create_registered_user(db: Session, user: UserCreateSelf, hashed_password: str):
     viewer_role = db.query(Role).filter(Role.name == RoleEnum.viewer).first()
     if not viewer_role:
         raise HTTPException(status_code=500, detail="Ruolo viewer non trovato nel database")
@@ -63,12 +121,25 @@ def register(
     )
     db.add(new_user)
     db.commit()
+
+@router.post("/register", response_model=dict)
+async def register(
+    user: UserCreateSelf,
+    db: Session = Depends(get_db)
+):
+    await run_in_threadpool(_check_registration_allowed, db, user.username)
+    hashed_password = await hash_password_async(user.password)
+    await run_in_threadpool(_create_registered_user, db, user, hashed_password)
     return {"message": "Utente registrato con successo"}
 
 #############################################################################
 # Login utente
+def _store_rehashed_password(db: Session, user: User, new_hash: str):
+    user.hashed_password = new_hash
+    db.commit()
+
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
@@ -77,11 +148,19 @@ def login(
     if db is None:  # ✅ Debug: Controlla se db è None
         raise HTTPException(status_code=500, detail="Errore interno: database non disponibile")
 
-    user = db.query(User).filter(User.username == form_data.username).first()
+    user = await run_in_threadpool(
+        lambda: db.query(User).filter(User.username == form_data.username).first()
+    )
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenziali non valide")
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    is_valid, new_hash = await verify_and_update_password_async(form_data.password, user.hashed_password)
+    if not is_valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenziali non valide")
-    
+    if new_hash:
+        # Costo bcrypt cambiato: aggiorna l'hash in modo trasparente
+        await run_in_threadpool(_store_rehashed_password, db, user, new_hash)
+
     token = create_access_token({"sub": user.username})
     return {"access_token": token, "token_type": "bearer"}
 
@@ -172,25 +251,30 @@ def get_current_user_info(request: Request, db: Session = Depends(get_db)):
 
 #############################################################################
 # Aggiornamento dati utente autenticato (anche se non ADMIN)
-@router.put("/me", response_model=UserResponse, status_code=status.HTTP_200_OK, dependencies=[])
-def update_own_user(update: UserSelfUpdate, 
-                    db: Session = Depends(get_db), 
-                    current_user: User = Depends(get_current_user)):
-
-    user = db.query(User).filter(User.id == current_user.id).first()
+def _apply_own_user_update(db: Session, user_id: int, update: UserSelfUpdate, hashed_password: str | None):
+    user = db.query(User).filter(User.id == user_id).first()
 
     if not user:
         raise HTTPException(status_code=404, detail="Utente non trovato")
 
     if update.email:
         user.email = update.email
-    if update.password:
-        user.hashed_password = hash_password(update.password)
+    if hashed_password:
+        user.hashed_password = hashed_password
 
     db.commit()
+    invalidate_principal(user.id)
     db.refresh(user)
     return user
 
+@router.put("/me", response_model=UserResponse, status_code=status.HTTP_200_OK, dependencies=[])
+async def update_own_user(update: UserSelfUpdate, 
+                          db: Session = Depends(get_db), 
+                          current_user: User = Depends(get_current_user)):
+    # bcrypt nel pool dedicato, le query nel threadpool (come register e login)
+    hashed_password = await hash_password_async(update.password) if update.password else None
+    return await run_in_threadpool(_apply_own_user_update, db, current_user.id, update, hashed_password)
+
 #############################################################################
 # Debug DB
 @router.get("/debug/db")
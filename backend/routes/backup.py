@@ -12,7 +12,11 @@ import logging
 import json
 import re
 from functools import lru_cache
-from dependencies import get_db, role_required
+from dependencies import get_db, invalidate_principal, role_required
+from metadata_cache import invalidate_applicable_definitions
+from stats import invalidate_dashboard_stats
+from inventory_access import rebuild_inventory_access
+from metadata_doc import rebuild_metadata_docs
 from models import RoleEnum
 from dotenv import load_dotenv
 from database import SessionLocal
@@ -313,6 +317,23 @@ def _sync_id_sequences(db: Session) -> None:
     db.commit()
 
 
+def _sync_current_versions(db: Session) -> None:
+    """Riallinea `current_version` di item e inventari all'ultima versione in cronologia.
+
+    I backup precedenti alla colonna la ripristinano a 0: senza riallineamento
+    le nuove versioni riuserebbero numeri gia presenti.
+    """
+    db.execute(text(
+        "UPDATE items SET current_version = COALESCE("
+        "(SELECT MAX(v.version_num) FROM item_versions v WHERE v.item_id = items.id), 0)"
+    ))
+    db.execute(text(
+        "UPDATE inventories SET current_version = COALESCE("
+        "(SELECT MAX(v.version_num) FROM inventory_versions v WHERE v.inventory_id = inventories.id), 0)"
+    ))
+    db.commit()
+
+
 def _write_backup_metadata(file_path: Path, metadata: dict) -> None:
     meta_path = _backup_meta_path(file_path)
     with open(meta_path, "w", encoding="utf-8") as f:
@@ -617,6 +638,7 @@ def restore_backup(filename: str, payload: RestoreRequest = Body(...)):
 
                 # Ordine child -> parent per minimizzare problemi FK
                 for table_name in [
+                    "inventory_access",
                     "shared_inventories",
                     "shared_inventory_groups",
                     "item_metadata_values",
@@ -655,6 +677,14 @@ def restore_backup(filename: str, payload: RestoreRequest = Body(...)):
 
                 # Allinea tutte le sequence PK dopo il restore per evitare duplicate key.
                 _sync_id_sequences(db)
+                _sync_current_versions(db)
+                # Il restore scrive via psql, fuori dagli eventi ORM: ricalcola accessi, metadati e cache a mano
+                rebuild_inventory_access(db.connection())
+                rebuild_metadata_docs(db.connection())
+                db.commit()
+                invalidate_dashboard_stats()
+                invalidate_principal()
+                invalidate_applicable_definitions()
                 logger.info(f"Restore completato per il file: {filename}")
             except Exception as e:
                 logger.error(f"Errore durante il restore: {str(e)}")
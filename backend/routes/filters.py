@@ -1,12 +1,24 @@
+import os
+from datetime import date
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
+from cache import TTLCache
 from dependencies import get_db
-from models import FilterTemplate, Inventory, MetadataDefinitionAssignment, RoleEnum, User
+from metadata_cache import current_generation
+from metadata_filters import (
+    CompiledMetadataFilter,
+    MetadataFilterError,
+    compile_metadata_filter,
+    filter_definition_ids,
+)
+from models import FilterTemplate, Inventory, MetadataDefinition, MetadataDefinitionAssignment, RoleEnum, User
 from routes.auth import get_current_user
-from routes.inventory import can_access_inventory
+from routes.inventory import ITEM_PAGE_DEFAULT_LIMIT, ITEM_PAGE_MAX_LIMIT, can_access_inventory
+from routes.metadata import _resolve_applicable_definitions, _run_compiled_filter
 from schemas import (
     FilterTemplateCreate,
     FilterTemplateListResponse,
@@ -14,11 +26,22 @@ from schemas import (
     FilterTemplateScopeInventory,
     FilterTemplateScopePreview,
     FilterTemplateUpdate,
+    MetadataFilterGroup,
+    MetadataFilterResponse,
 )
 
 
 router = APIRouter()
 
+FILTER_TEMPLATE_PLAN_TTL_SECONDS = float(os.getenv("FILTER_TEMPLATE_PLAN_TTL_SECONDS", "600"))
+
+# Filtri compilati dei template, per (id, data_mod, generazione delle definizioni, giorno):
+# il giorno perché i criteri data possono usare il token relativo "today".
+template_plan_cache: TTLCache[CompiledMetadataFilter] = TTLCache(
+    ttl_seconds=FILTER_TEMPLATE_PLAN_TTL_SECONDS,
+    max_entries=256,
+)
+
 
 def _get_inventory_or_404(db: Session, inventory_id: int) -> Inventory:
     inventory = db.query(Inventory).filter(Inventory.id == inventory_id).first()
@@ -55,6 +78,41 @@ def _extract_definition_ids_from_criteria(criteria: object) -> list[int]:
     return list(set(ids))
 
 
+def _template_filter_group(template: FilterTemplate) -> MetadataFilterGroup:
+    criteria = template.criteria
+    if isinstance(criteria, list):
+        criteria = {"criteria": criteria}
+    try:
+        return MetadataFilterGroup.model_validate(criteria)
+    except ValidationError as exc:
+        message = str(exc.errors()[0]["msg"]).removeprefix("Value error, ")
+        raise HTTPException(status_code=400, detail=f"Template filtro non valido: {message}")
+
+
+def _compile_filter_template(db: Session, template: FilterTemplate) -> CompiledMetadataFilter:
+    key = (template.id, template.data_mod, current_generation(), date.today())
+    compiled = template_plan_cache.get(key)
+    if compiled is not None:
+        return compiled
+
+    group = _template_filter_group(template)
+    field_types = dict(
+        db.query(MetadataDefinition.id, MetadataDefinition.field_type)
+        .filter(MetadataDefinition.id.in_(filter_definition_ids(group)))
+        .all()
+    )
+    try:
+        compiled = compile_metadata_filter(group, field_types)
+    except MetadataFilterError as exc:
+        raise HTTPException(status_code=400, detail=f"Template filtro non valido: {exc}")
+    template_plan_cache.set(key, compiled)
+    return compiled
+
+
+def _invalidate_template_plans(template_id: int) -> None:
+    template_plan_cache.invalidate_where(lambda key, _compiled: key[0] == template_id)
+
+
 def _count_criteria(criteria: object) -> int:
     if isinstance(criteria, dict):
         items = criteria.get("criteria", [])
@@ -285,6 +343,45 @@ def get_filter_template(
     return template
 
 
+@router.post("/{template_id}/execute", response_model=MetadataFilterResponse)
+def execute_filter_template(
+    template_id: int,
+    inventory_id: int = Query(..., gt=0),
+    limit: int = Query(ITEM_PAGE_DEFAULT_LIMIT, ge=1, le=ITEM_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = Query(None),
+    include_items: bool = Query(True),
+    include_total: bool = Query(False),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Esegue un template salvato su un inventario: item corrispondenti paginati, filtro compilato in cache."""
+    template = _get_filter_template_or_404(db, template_id)
+    if template.inventory_id and template.inventory_id != inventory_id:
+        template_inventory = _get_inventory_or_404(db, template.inventory_id)
+        if not can_access_inventory(user, template_inventory, action="view"):
+            raise HTTPException(status_code=403, detail="Accesso negato")
+    inventory = _get_inventory_or_404(db, inventory_id)
+    if not can_access_inventory(user, inventory, action="view"):
+        raise HTTPException(status_code=403, detail="Accesso negato")
+
+    compiled = _compile_filter_template(db, template)
+    applicable_ids = {d.id for d in _resolve_applicable_definitions(db, inventory)}
+    if not compiled.definition_ids <= applicable_ids:
+        raise HTTPException(
+            status_code=400,
+            detail="Il template usa definizioni non valide per questo inventario o inattive",
+        )
+    return _run_compiled_filter(
+        db,
+        inventory_id,
+        compiled,
+        limit=limit,
+        cursor=cursor,
+        include_items=include_items,
+        include_total=include_total,
+    )
+
+
 @router.post("", response_model=FilterTemplateResponse, status_code=status.HTTP_201_CREATED)
 def create_filter_template(
     payload: FilterTemplateCreate,
@@ -344,6 +441,7 @@ def update_filter_template(
 
     template.user_mod = user.id
     db.commit()
+    _invalidate_template_plans(template.id)
     db.refresh(template)
     return template
 
@@ -360,4 +458,5 @@ def delete_filter_template(
 
     db.delete(template)
     db.commit()
+    _invalidate_template_plans(template_id)
     return {"detail": "Template filtro eliminato"}
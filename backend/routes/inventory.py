@@ -1,23 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
-from dependencies import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, aliased, contains_eager, joinedload, object_session
+from sqlalchemy import and_, exists, false, func, or_, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from dependencies import AuthPrincipal, get_async_db, get_current_user_async, get_db
 from models import (
     User,
     Inventory,
     Item,
     ItemMetadataValue,
+    MetadataDefinition,
     SharedInventory,
     Group,
     SharedInventoryGroup,
+    Role,
     RoleEnum,
+    UserGroupAssociation,
     InventoryVersion,
-    ItemVersion,
+    InventoryAccess,
 )
-from schemas import InventoryCreate, InventoryResponse, InventoryUpdate, ItemMetadataValueResponse, ItemResponse, UserResponse, InventoryResponseWithItemCount, InventoryVersionResponse, VersionBulkDeleteRequest
+from schemas import InventoryCreate, InventoryResponse, InventoryUpdate, ItemPageResponse, ItemResponse, UserResponse, InventoryResponseWithItemCount, InventoryVersionResponse, VersionBulkDeleteRequest
 from routes.auth import get_current_user
-from typing import Any, List, cast
-import re
+from search import ItemSearchHit, search_items
+from inventory_access import user_access_level
+from metadata_doc import item_metadata_responses, load_missing_metadata
+from typing import Any, List, Literal, cast
+from dataclasses import dataclass
+import base64
+import csv
+import io
 import json
 from datetime import datetime, timezone
 
@@ -30,32 +41,39 @@ def can_access_inventory(user: User, inventory: Inventory, action: str = "view")
     # Admin ha sempre accesso
     if user.role.name == RoleEnum.admin.value:
         return True
+    if action not in ("view", "edit", "delete"):
+        return False
+    # Moderatori possono modificare/eliminare solo se è proprio o condiviso con loro
+    if action in ("edit", "delete") and user.role.name != RoleEnum.moderator.value:
+        return False
+
+    # Proprietario, condivisione diretta o di gruppo: una lookup sulla tabella inventory_access
+    db = object_session(inventory)
+    if db is None:
+        return False
+    level = user_access_level(db, cast(int, user.id), cast(int, inventory.id))
+    if level is None:
+        return False
+    return action == "view" or level == "edit"
+
+# Predicato SQL equivalente a can_access_inventory: va applicato direttamente nelle query
+# così gli inventari non visibili non vengono mai caricati.
+def inventory_access_filter(user: User, action: str = "view"):
+    if user.role.name == RoleEnum.admin.value:
+        return true()
+    if action not in ("view", "edit", "delete"):
+        return false()
+    if action in ("edit", "delete") and user.role.name != RoleEnum.moderator.value:
+        return false()
 
-    owner_id = cast(int | None, inventory.owner_id)
+    conditions = [InventoryAccess.inventory_id == Inventory.id, InventoryAccess.user_id == user.id]
+    if action in ("edit", "delete"):
+        conditions.append(InventoryAccess.level == "edit")
+    return exists().where(*conditions)
 
-    if action == "view":
-        # Chiunque può vedere se è condiviso o è il proprietario
-        if owner_id == user.id:
-            return True
-        if user.id in [s.user_id for s in inventory.shared_with_users]:
-            return True
-        user_group_ids = {assoc.group_id for assoc in user.group_associations}
-        inventory_group_ids = {g.group_id for g in inventory.shared_with_groups}
-        if user_group_ids & inventory_group_ids:
-            return True
-    elif action in ("edit", "delete"):
-        # Moderatori possono modificare/eliminare solo se è proprio o condiviso con loro
-        if user.role.name == RoleEnum.moderator.value:
-            if owner_id == user.id:
-                return True
-            if user.id in [s.user_id for s in inventory.shared_with_users]:
-                return True
-            user_group_ids = {assoc.group_id for assoc in user.group_associations}
-            inventory_group_ids = {g.group_id for g in inventory.shared_with_groups}
-            if user_group_ids & inventory_group_ids:
-                return True
-
-    return False
+# Subquery con gli ID degli inventari accessibili, utile per filtrare tabelle collegate (es. audit)
+def accessible_inventory_ids(user: User, action: str = "view"):
+    return select(Inventory.id).where(inventory_access_filter(user, action))
 
 #############################################################################
 # Helper per versioning inventario
@@ -67,11 +85,12 @@ def _snapshot_inventory(inv: Inventory) -> dict[str, Any]:
         "owner_id": inv.owner_id,
     }
 
-def _next_inventory_version_num(db: Session, inventory_id: int) -> int:
+def _last_inventory_version_num(db: Session, inventory_id: int) -> int:
+    # Solo per riallineare `current_version` quando si ricrea un inventario cancellato
     last = db.query(func.max(InventoryVersion.version_num)).filter(
         InventoryVersion.inventory_id == inventory_id
     ).scalar()
-    return (last or 0) + 1
+    return last or 0
 
 def _write_inventory_version(
     db: Session, inv: Inventory, operation: str, user: User, old_snapshot: dict[str, Any] | None = None
@@ -85,13 +104,15 @@ def _write_inventory_version(
                 diff[key] = {"from": old_val, "to": new_val}
 
     inventory_id = cast(int, inv.id)
+    version_num = cast(int, inv.current_version or 0) + 1
+    setattr(inv, "current_version", version_num)
     version = InventoryVersion(
         inventory_id=inventory_id,
         name=inv.name,
         type=inv.type,
         owner_id=inv.owner_id,
         owner_username=inv.owner.username if inv.owner else None,
-        version_num=_next_inventory_version_num(db, inventory_id),
+        version_num=version_num,
         operation=operation,
         changed_by_id=user.id,
         changed_by_username=user.username,
@@ -99,20 +120,40 @@ def _write_inventory_version(
     )
     db.add(version)
 
-def _build_inventory_response(db: Session, inv: Inventory) -> InventoryResponse:
-    current_version = db.query(func.max(InventoryVersion.version_num)).filter(
-        InventoryVersion.inventory_id == inv.id
-    ).scalar() or 0
+def _build_inventory_response(inv: Inventory) -> InventoryResponse:
     resp = InventoryResponse.model_validate(inv)
-    resp.version_num = current_version
+    resp.version_num = cast(int, inv.current_version or 0)
     return resp
 
-def _current_item_version_num(db: Session, item_id: int) -> int:
-    return (
-        db.query(func.max(ItemVersion.version_num))
-        .filter(ItemVersion.item_id == item_id)
-        .scalar()
-        or 0
+# Numero di item per inventario con un solo GROUP BY (senza caricare gli item)
+def _item_counts(db: Session, inventory_ids: list[int]) -> dict[int, int]:
+    if not inventory_ids:
+        return {}
+    rows = db.execute(
+        select(Item.inventory_id, func.count(Item.id))
+        .where(Item.inventory_id.in_(inventory_ids))
+        .group_by(Item.inventory_id)
+    )
+    return {inventory_id: count for inventory_id, count in rows}
+
+def _item_count(db: Session, inventory_id: int) -> int:
+    return db.scalar(select(func.count(Item.id)).where(Item.inventory_id == inventory_id)) or 0
+
+def _item_response(item: Item, include_metadata: bool = True) -> ItemResponse:
+    return ItemResponse(
+        id=cast(int, item.id),
+        name=cast(str, item.name),
+        description=cast(str | None, item.description),
+        quantity=cast(int, item.quantity),
+        inventory_id=cast(int, item.inventory_id),
+        data_ins=item.data_ins,
+        data_mod=item.data_mod,
+        user_ins=item.user_ins,
+        user_mod=item.user_mod,
+        username_ins=item.user_ins_rel.username if item.user_ins_rel else None,
+        username_mod=item.user_mod_rel.username if item.user_mod_rel else None,
+        metadata_values=item_metadata_responses(item) if include_metadata else [],
+        version_num=cast(int, item.current_version or 0),
     )
 
 #############################################################################
@@ -123,131 +164,95 @@ def list_inventories_base(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user)
 ):
-    query = db.query(Inventory).filter(Inventory.type == inventory_type)
-    if filtro:
-        query = query.options(
-            joinedload(Inventory.items).joinedload(Item.metadata_values).joinedload(ItemMetadataValue.definition)
-        )
-    else:
-        query = query.options(joinedload(Inventory.items))
-
-    inventories = query.all()
-    visible_inventories = [
-        inv for inv in inventories if can_access_inventory(user, inv, action="view")
-    ]
-
-    def highlight_match(text: str, filtro: str) -> str:
-        pattern = re.compile(re.escape(filtro), re.IGNORECASE)
-        return pattern.sub(lambda m: f"**{m.group(0)}**", text)
-
-    def resolve_metadata_search_text(metadata_value: ItemMetadataValue) -> tuple[str, str] | None:
-        definition = metadata_value.definition
-        if definition is None:
-            return None
-
-        if not cast(bool, definition.is_active):
-            return None
-
-        field_type = cast(str, definition.field_type)
-        if field_type not in ("TEXT", "LIST"):
-            return None
-
-        raw_text = cast(str | None, metadata_value.value_text)
-        if not raw_text:
-            return None
-
-        display_text = raw_text
-        if field_type == "LIST":
-            for entry in cast(list[Any], definition.list_options or []):
-                if not isinstance(entry, dict):
-                    continue
-                entry_value = str(entry.get("value", "")).strip()
-                entry_label = str(entry.get("label", "")).strip()
-                if entry_value == raw_text:
-                    display_text = entry_label or raw_text
-                    break
+    visibility = and_(Inventory.type == inventory_type, inventory_access_filter(user, action="view"))
+    query = db.query(Inventory).filter(visibility).options(
+        joinedload(Inventory.owner).joinedload(User.role),
+    )
 
-        return raw_text, display_text
+    # Con filtro la ricerca avviene nel database: si caricano solo gli item corrispondenti
+    hits_by_inventory: dict[int, list[ItemSearchHit]] = {}
+    items_by_id: dict[int, Item] = {}
+    if filtro:
+        hits = search_items(db, filtro, visibility)
+        if not hits:
+            return []
+        for hit in hits:
+            hits_by_inventory.setdefault(hit.inventory_id, []).append(hit)
+        query = query.filter(Inventory.id.in_(list(hits_by_inventory)))
+        items_by_id = {
+            cast(int, item.id): item
+            for item in db.query(Item).options(
+                joinedload(Item.user_ins_rel),
+                joinedload(Item.user_mod_rel),
+            ).filter(Item.id.in_([hit.item_id for hit in hits]))
+        }
+        load_missing_metadata(db, items_by_id.values())
+
+    visible_inventories = query.all()
+    item_counts = _item_counts(db, [cast(int, inv.id) for inv in visible_inventories])
 
     result = []
-    filtro_lower = filtro.lower()
     for inv in visible_inventories:
         matching_items = []
         if filtro:
-            matching_items = []
-            for item in inv.items:
-                name_match = filtro_lower in (item.name or "").lower()
-                desc_match = filtro_lower in (item.description or "").lower() if item.description else False
-                highlighted_metadata = []
-                for metadata_value in item.metadata_values:
-                    resolved_metadata_text = resolve_metadata_search_text(metadata_value)
-                    if not resolved_metadata_text:
-                        continue
-                    raw_metadata_text, display_metadata_text = resolved_metadata_text
-                    definition_label = metadata_value.definition.label or metadata_value.definition.key
-                    metadata_text_match = (
-                        filtro_lower in raw_metadata_text.lower()
-                        or filtro_lower in display_metadata_text.lower()
-                    )
-                    if metadata_text_match:
-                        highlighted_metadata.append({
-                            "definition_label": definition_label,
-                            "value_text": highlight_match(display_metadata_text, filtro) if metadata_text_match else display_metadata_text,
-                        })
-
-                metadata_match = len(highlighted_metadata) > 0
-
-                if name_match or desc_match or metadata_match:
-                    # Evidenzia la parte corrispondente nel nome e nella descrizione (case-insensitive)
-                    name_highlight = (item.name or "")
-                    desc_highlight = (item.description or "") if item.description else None
-                    if name_match:
-                        name_highlight = highlight_match(name_highlight, filtro)
-                    if desc_match and desc_highlight is not None:
-                        desc_highlight = highlight_match(desc_highlight, filtro)
-                    matching_items.append({
-                        **ItemResponse(
-                            id=item.id,
-                            name=item.name,
-                            description=item.description,
-                            quantity=item.quantity,
-                            inventory_id=item.inventory_id,
-                            data_ins=item.data_ins,
-                            data_mod=item.data_mod,
-                            user_ins=item.user_ins,
-                            user_mod=item.user_mod,
-                            username_ins=item.user_ins_rel.username if item.user_ins_rel else None,
-                            username_mod=item.user_mod_rel.username if item.user_mod_rel else None,
-                            metadata_values=[
-                                ItemMetadataValueResponse(
-                                    **value.__dict__,
-                                    definition_key=value.definition.key if value.definition else None,
-                                    definition_label=value.definition.label if value.definition else None,
-                                    field_type=value.definition.field_type if value.definition else None,
-                                )
-                                for value in item.metadata_values
-                            ],
-                            version_num=_current_item_version_num(db, item.id),
-                        ).model_dump(),
-                        "highlighted": {
-                            "name": name_highlight,
-                            "description": desc_highlight,
-                            "metadata_text": highlighted_metadata,
-                        }
-                    })
+            for hit in hits_by_inventory.get(cast(int, inv.id), []):
+                item = items_by_id.get(hit.item_id)
+                if item is None:
+                    continue
+                matching_items.append({
+                    **_item_response(item).model_dump(),
+                    "highlighted": {
+                        "name": hit.name,
+                        "description": hit.description,
+                        "metadata_text": hit.metadata_text,
+                    }
+                })
             if not matching_items:
                 continue  # Skip inventories that do not match the filter
 
         result.append({
             **InventoryResponseWithItemCount(
-                **_build_inventory_response(db, inv).model_dump(),
-                item_count=len(inv.items)
+                **_build_inventory_response(inv).model_dump(),
+                item_count=item_counts.get(cast(int, inv.id), 0)
             ).model_dump(),
             "matching_items": matching_items if filtro else None
         })
 
     return result
 
+# Inventari e liste modificati più di recente (top-N in SQL, costo proporzionale a `limit`)
+RECENTS_MAX_LIMIT = 100
+
+def list_recent_inventories_base(db: Session, user: User, limit: int) -> list[dict]:
+    user_mod_rel = aliased(User)
+    item_count = (
+        select(func.count(Item.id))
+        .where(Item.inventory_id == Inventory.id)
+        .correlate(Inventory)
+        .scalar_subquery()
+    )
+    rows = (
+        db.query(Inventory, item_count.label("item_count"), user_mod_rel.username)
+        .outerjoin(user_mod_rel, user_mod_rel.id == Inventory.user_mod)
+        .options(joinedload(Inventory.owner).joinedload(User.role))
+        .filter(inventory_access_filter(user, action="view"))
+        .order_by(Inventory.data_mod.desc(), Inventory.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            **InventoryResponseWithItemCount(
+                **_build_inventory_response(inv).model_dump(),
+                item_count=count
+            ).model_dump(),
+            "matching_items": None,
+            "type": inv.type,
+            "username_mod": username_mod,
+        }
+        for inv, count, username_mod in rows
+    ]
+
 # Creazione inventario
 def create_inventory_base(
     inventory_type: str, 
@@ -263,7 +268,7 @@ def create_inventory_base(
     _write_inventory_version(db, new_inventory, "CREATE", user)
     db.commit()
     db.refresh(new_inventory)
-    return _build_inventory_response(db, new_inventory)
+    return _build_inventory_response(new_inventory)
 
 # Aggiornamento inventario
 def update_inventory_base(
@@ -286,7 +291,7 @@ def update_inventory_base(
     _write_inventory_version(db, inventory, "UPDATE", user, old_snapshot)
     db.commit()
     db.refresh(inventory)
-    return _build_inventory_response(db, inventory)
+    return _build_inventory_response(inventory)
 
 # Eliminazione inventario
 def delete_inventory_base(
@@ -317,40 +322,264 @@ def list_items_base(
     inventory = db.query(Inventory).options(
         joinedload(Inventory.items).joinedload(Item.user_ins_rel),
         joinedload(Inventory.items).joinedload(Item.user_mod_rel),
-        joinedload(Inventory.items).joinedload(Item.metadata_values).joinedload(ItemMetadataValue.definition),
     ).filter_by(id=inventory_id, type=inventory_type).first()
     if not inventory:
         raise HTTPException(status_code=404, detail="Inventario non trovato")
     if not can_access_inventory(user, inventory, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
+    load_missing_metadata(db, inventory.items)
     #return inventory.items
     return [
-        ItemResponse(
-            id=item.id,
-            name=item.name,
-            description=item.description,
-            quantity=item.quantity,
-            inventory_id=item.inventory_id,
-            data_ins=item.data_ins,
-            data_mod=item.data_mod,
-            user_ins=item.user_ins,
-            user_mod=item.user_mod,
-            username_ins=item.user_ins_rel.username if item.user_ins_rel else None,
-            username_mod=item.user_mod_rel.username if item.user_mod_rel else None,
-            metadata_values=[
-                ItemMetadataValueResponse(
-                    **value.__dict__,
-                    definition_key=value.definition.key if value.definition else None,
-                    definition_label=value.definition.label if value.definition else None,
-                    field_type=value.definition.field_type if value.definition else None,
-                )
-                for value in item.metadata_values
-            ],
-            version_num=_current_item_version_num(db, item.id),
-        )
+        _item_response(item)
         for item in inventory.items
     ]
 
+# Paginazione keyset degli item: ordinamento stabile (campo, id) e cursore opaco
+ITEM_PAGE_DEFAULT_LIMIT = 100
+ITEM_PAGE_MAX_LIMIT = 1000
+ITEM_PAGE_SORT_FIELDS = ("name", "data_mod", "quantity", "id")
+ItemPageSort = Literal["name", "data_mod", "quantity", "id"]
+ItemPageOrder = Literal["asc", "desc"]
+
+
+def _item_sort_expression(sort: str):
+    if sort == "name":
+        return Item.name
+    if sort == "data_mod":
+        return Item.data_mod
+    if sort == "quantity":
+        # quantity è nullable: coalesce per avere un ordinamento totale
+        return func.coalesce(Item.quantity, 0)
+    return Item.id
+
+
+def _encode_item_cursor(sort: str, order: str, item: Item) -> str:
+    if sort == "data_mod":
+        value: Any = cast(datetime, item.data_mod).isoformat()
+    elif sort == "quantity":
+        value = item.quantity or 0
+    elif sort == "name":
+        value = item.name
+    else:
+        value = item.id
+    payload = json.dumps({"s": sort, "o": order, "v": value, "id": item.id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_item_cursor(cursor: str, sort: str, order: str) -> tuple[Any, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if payload["s"] != sort or payload["o"] != order:
+            raise ValueError("ordinamento diverso")
+        value = payload["v"]
+        if sort == "data_mod":
+            value = datetime.fromisoformat(value)
+        elif sort in ("quantity", "id"):
+            value = int(value)
+        else:
+            value = str(value)
+        return value, int(payload["id"])
+    except (ValueError, KeyError, TypeError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+
+
+def list_items_page_base(
+    inventory_type: str,
+    inventory_id: int,
+    limit: int = ITEM_PAGE_DEFAULT_LIMIT,
+    cursor: str | None = None,
+    sort: str = "name",
+    order: str = "asc",
+    include_total: bool = False,
+    include_metadata: bool = True,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    if sort not in ITEM_PAGE_SORT_FIELDS or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Ordinamento non valido")
+
+    inventory = db.query(Inventory).filter_by(id=inventory_id, type=inventory_type).first()
+    if not inventory:
+        raise HTTPException(status_code=404, detail="Inventario non trovato")
+    if not can_access_inventory(user, inventory, action="view"):
+        raise HTTPException(status_code=403, detail="Accesso negato")
+
+    sort_expr = _item_sort_expression(sort)
+    descending = order == "desc"
+    query = db.query(Item).filter(Item.inventory_id == inventory_id)
+
+    total = query.count() if include_total else None
+
+    if cursor:
+        value, last_id = _decode_item_cursor(cursor, sort, order)
+        if sort == "id":
+            query = query.filter(Item.id < last_id if descending else Item.id > last_id)
+        elif descending:
+            query = query.filter(or_(sort_expr < value, and_(sort_expr == value, Item.id < last_id)))
+        else:
+            query = query.filter(or_(sort_expr > value, and_(sort_expr == value, Item.id > last_id)))
+
+    options: list[Any] = [joinedload(Item.user_ins_rel), joinedload(Item.user_mod_rel)]
+    order_by = [sort_expr.desc(), Item.id.desc()] if descending else [sort_expr.asc(), Item.id.asc()]
+    if sort == "id":
+        order_by = order_by[1:]
+
+    # Una riga in più per sapere se esiste la pagina successiva senza un'altra query
+    rows = query.options(*options).order_by(*order_by).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if include_metadata:
+        load_missing_metadata(db, rows)
+
+    return ItemPageResponse(
+        items=[_item_response(item, include_metadata=include_metadata) for item in rows],
+        next_cursor=_encode_item_cursor(sort, order, rows[-1]) if has_more and rows else None,
+        total=total,
+    )
+
+# Export in streaming degli item (NDJSON o CSV), metadati pivotati per chiave
+EXPORT_CHUNK_SIZE = 500
+EXPORT_ITEM_FIELDS = ("id", "name", "description", "quantity", "data_ins", "data_mod", "version_num")
+ItemExportFormat = Literal["ndjson", "csv"]
+
+
+def _export_metadata_definitions(db: Session, inventory: Inventory) -> list[MetadataDefinition]:
+    # Colonne = definizioni applicabili (anche inattive) + quelle che hanno comunque valori
+    # negli item dell'inventario, così l'export non perde dati.
+    from routes.metadata import _resolve_applicable_definitions
+
+    definitions = {
+        cast(int, definition.id): definition
+        for definition in _resolve_applicable_definitions(db, inventory, include_inactive=True)
+    }
+    used_ids = select(ItemMetadataValue.definition_id).join(Item, Item.id == ItemMetadataValue.item_id).where(
+        Item.inventory_id == inventory.id
+    ).distinct()
+    for definition in db.query(MetadataDefinition).filter(
+        MetadataDefinition.id.in_(used_ids),
+        MetadataDefinition.id.not_in(list(definitions)),
+    ):
+        definitions[cast(int, definition.id)] = definition
+    return sorted(definitions.values(), key=lambda d: (cast(int, d.sort_order), cast(int, d.id)))
+
+
+def _iter_export_rows(db: Session, inventory_id: int, definitions: list[MetadataDefinition]):
+    # Server-side cursor sugli item; i metadati vengono letti un blocco alla volta
+    from routes.metadata import _to_jsonable_metadata_value
+
+    keys_by_definition = {cast(int, d.id): cast(str, d.key) for d in definitions}
+    item_rows = db.execute(
+        select(
+            Item.id,
+            Item.name,
+            Item.description,
+            Item.quantity,
+            Item.data_ins,
+            Item.data_mod,
+            Item.current_version,
+        )
+        .where(Item.inventory_id == inventory_id)
+        .order_by(Item.id.asc())
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    for chunk in item_rows.partitions():
+        metadata_by_item: dict[int, dict[str, Any]] = {}
+        for value in db.execute(
+            select(
+                ItemMetadataValue.item_id,
+                ItemMetadataValue.definition_id,
+                ItemMetadataValue.value_text,
+                ItemMetadataValue.value_number,
+                ItemMetadataValue.value_boolean,
+                ItemMetadataValue.value_date,
+            ).where(ItemMetadataValue.item_id.in_([row.id for row in chunk]))
+        ):
+            key = keys_by_definition.get(value.definition_id)
+            if key is None:
+                continue
+            typed = next(
+                (v for v in (value.value_text, value.value_number, value.value_boolean, value.value_date) if v is not None),
+                None,
+            )
+            metadata_by_item.setdefault(value.item_id, {})[key] = _to_jsonable_metadata_value(typed)
+
+        yield [
+            (
+                {
+                    "id": row.id,
+                    "name": row.name,
+                    "description": row.description,
+                    "quantity": row.quantity,
+                    "data_ins": row.data_ins.isoformat() if row.data_ins else None,
+                    "data_mod": row.data_mod.isoformat() if row.data_mod else None,
+                    "version_num": row.current_version or 0,
+                },
+                metadata_by_item.get(row.id, {}),
+            )
+            for row in chunk
+        ]
+
+
+def export_items_base(
+    inventory_type: str,
+    inventory_id: int,
+    export_format: str = "ndjson",
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    inventory = db.query(Inventory).filter_by(id=inventory_id, type=inventory_type).first()
+    if not inventory:
+        raise HTTPException(status_code=404, detail="Inventario non trovato")
+    if not can_access_inventory(user, inventory, action="view"):
+        raise HTTPException(status_code=403, detail="Accesso negato")
+
+    definitions = _export_metadata_definitions(db, inventory)
+    metadata_keys = [cast(str, d.key) for d in definitions]
+    filename = f"{inventory_type.lower()}_{inventory_id}.{export_format}"
+    bind = db.get_bind()
+
+    def export_rows():
+        # Lo stream prosegue dopo la chiusura della sessione della richiesta (get_db):
+        # usa una sessione propria sullo stesso engine, chiusa a fine stream o disconnessione
+        stream_db = Session(bind=bind)
+        try:
+            yield from _iter_export_rows(stream_db, inventory_id, definitions)
+        finally:
+            stream_db.close()
+
+    def ndjson_stream():
+        for rows in export_rows():
+            yield "".join(
+                json.dumps({**fields, "metadata": metadata}, ensure_ascii=False) + "\n"
+                for fields, metadata in rows
+            )
+
+    def csv_stream():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([*EXPORT_ITEM_FIELDS, *metadata_keys])
+        for rows in export_rows():
+            for fields, metadata in rows:
+                writer.writerow([
+                    *(fields[name] for name in EXPORT_ITEM_FIELDS),
+                    *(metadata.get(key) for key in metadata_keys),
+                ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    if export_format == "csv":
+        stream, media_type = csv_stream(), "text/csv; charset=utf-8"
+    else:
+        stream, media_type = ndjson_stream(), "application/x-ndjson"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 # Contare gli item dell'inventario
 def count_items_base(
     inventory_type: str,
@@ -363,7 +592,7 @@ def count_items_base(
         raise HTTPException(status_code=404, detail="Inventario non trovato")
     if not can_access_inventory(user, inventory, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
-    return len(inventory.items)
+    return _item_count(db, inventory_id)
 
 #############################################################################
 # Condivisione inventario
@@ -442,10 +671,7 @@ def list_shares_base(
     if not can_access_inventory(user, inventory, action="edit"):
         raise HTTPException(status_code=403, detail="Accesso negato")
 
-    return [
-        db.query(User).get(share.user_id)
-        for share in inventory.shared_with_users
-    ]
+    return _direct_share_users(db, inventory_id)
 
 #############################################################################
 # Condivisione con gruppo
@@ -512,6 +738,98 @@ def list_group_shares_base(
 
     return [share.group.name for share in inventory.shared_with_groups]
 
+#############################################################################
+# Accessi effettivi a un inventario (owner, admin, condivisioni dirette e di gruppo)
+# calcolati con poche query aggregate invece di una query per utente o gruppo.
+@dataclass(frozen=True)
+class AccessEntry:
+    username: str
+    access: str           # "edit" | "view"
+    via: str              # "owner" | "admin" | "share" | "group"
+    group: str | None = None
+
+def _role_access(role_name: str) -> str:
+    return "edit" if role_name in (RoleEnum.admin.value, RoleEnum.moderator.value) else "view"
+
+def _users_with_role(db: Session):
+    return db.query(User).join(User.role).options(contains_eager(User.role))
+
+# Utenti con condivisione diretta, nell'ordine di condivisione
+def _direct_share_users(db: Session, inventory_id: int) -> list[User]:
+    return (
+        _users_with_role(db)
+        .join(SharedInventory, SharedInventory.user_id == User.id)
+        .filter(SharedInventory.inventory_id == inventory_id)
+        .order_by(SharedInventory.id)
+        .all()
+    )
+
+# Membri dei gruppi con cui è condiviso l'inventario, con il nome del gruppo
+def _group_share_members(db: Session, inventory_id: int) -> list[tuple[User, str]]:
+    return (
+        _users_with_role(db)
+        .join(UserGroupAssociation, UserGroupAssociation.user_id == User.id)
+        .join(SharedInventoryGroup, SharedInventoryGroup.group_id == UserGroupAssociation.group_id)
+        .join(Group, Group.id == SharedInventoryGroup.group_id)
+        .filter(SharedInventoryGroup.inventory_id == inventory_id)
+        .add_columns(Group.name)
+        .order_by(SharedInventoryGroup.id, User.id)
+        .all()
+    )
+
+# Subquery con gli ID degli utenti che vedono l'inventario tramite condivisione (diretta o di gruppo)
+def shared_user_ids(inventory_id: int):
+    direct = select(SharedInventory.user_id).where(SharedInventory.inventory_id == inventory_id)
+    via_group = (
+        select(UserGroupAssociation.user_id)
+        .join(SharedInventoryGroup, SharedInventoryGroup.group_id == UserGroupAssociation.group_id)
+        .where(SharedInventoryGroup.inventory_id == inventory_id)
+    )
+    return direct.union(via_group)
+
+def inventory_access_entries(db: Session, inventory: Inventory) -> list[AccessEntry]:
+    owner_id = cast(int | None, inventory.owner_id)
+    entries = []
+
+    # Proprietario e amministratori in un'unica query
+    owner_and_admins = (
+        _users_with_role(db)
+        .filter(or_(User.id == owner_id, Role.name == RoleEnum.admin.value))
+        .order_by(User.id)
+        .all()
+    )
+    entries.extend(
+        AccessEntry(username=u.username, access="edit", via="owner")
+        for u in owner_and_admins if cast(int, u.id) == owner_id
+    )
+    entries.extend(
+        AccessEntry(username=u.username, access="edit", via="admin")
+        for u in owner_and_admins if cast(int, u.id) != owner_id
+    )
+
+    for shared_user in _direct_share_users(db, cast(int, inventory.id)):
+        entries.append(AccessEntry(username=shared_user.username, access=_role_access(shared_user.role.name), via="share"))
+
+    for member, group_name in _group_share_members(db, cast(int, inventory.id)):
+        entries.append(AccessEntry(username=member.username, access=_role_access(member.role.name), via="group", group=group_name))
+
+    return entries
+
+# Accesso effettivo per utente: "edit", "view" o "admin" (admin senza altri percorsi di accesso)
+def effective_access_map(entries: list[AccessEntry]) -> dict[str, str]:
+    access_by_user: dict[str, str] = {}
+    for entry in entries:
+        if entry.via == "owner":
+            access_by_user[entry.username] = "edit"
+        elif entry.via == "admin":
+            access_by_user.setdefault(entry.username, "admin")
+        elif entry.via == "share":
+            access_by_user[entry.username] = entry.access
+        elif access_by_user.get(entry.username) != "edit":
+            # Tramite gruppo: non declassa un accesso "edit" già presente
+            access_by_user[entry.username] = entry.access
+    return access_by_user
+
 #############################################################################
 # Elencare tutti gli utenti che hanno accesso a un inventario, con tipo di accesso e modalità
 def list_access_details_base(
@@ -526,57 +844,10 @@ def list_access_details_base(
     if not can_access_inventory(user, inventory, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
 
-    access_details = []
-
-    # Utente proprietario
-    owner = db.query(User).get(inventory.owner_id)
-    if owner is not None:
-        access_details.append({
-            "username": owner.username,
-            "access": "edit",
-            "via": "owner",
-            "group": None
-        })
-
-    # Amministratori
-    admins = db.query(User).filter(User.role.has(name=RoleEnum.admin.value)).all()
-    for admin in admins:
-        if cast(int | None, admin.id) != cast(int | None, inventory.owner_id):
-            access_details.append({
-                "username": admin.username,
-                "access": "edit",
-                "via": "admin",
-                "group": None
-            })
-
-    # Utenti condivisione diretta
-    for share in inventory.shared_with_users:
-        shared_user = db.query(User).get(share.user_id)
-        if shared_user is None or shared_user.role is None:
-            continue
-        access = "edit" if shared_user.role.name in (RoleEnum.admin.value, RoleEnum.moderator.value) else "view"
-        access_details.append({
-            "username": shared_user.username,
-            "access": access,
-            "via": "share",
-            "group": None
-        })
-
-    # Utenti condivisione tramite gruppo
-    for shared_group in inventory.shared_with_groups:
-        group = db.query(Group).get(shared_group.group_id)
-        if group is None:
-            continue
-        for assoc in group.user_associations:
-            access = "edit" if assoc.user.role.name in (RoleEnum.admin.value, RoleEnum.moderator.value) else "view"
-            access_details.append({
-                "username": assoc.user.username,
-                "access": access,
-                "via": "group",
-                "group": group.name
-            })
-
-    return access_details
+    return [
+        {"username": entry.username, "access": entry.access, "via": entry.via, "group": entry.group}
+        for entry in inventory_access_entries(db, inventory)
+    ]
 
 #############################################################################
 # Contare gli utenti che possono accedere all’inventario, raggruppati per accesso
@@ -592,37 +863,7 @@ def count_access_by_type_base(
     if not can_access_inventory(user, inventory, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
 
-    access_by_user = {}
-
-    # Owner
-    owner = db.query(User).get(inventory.owner_id)
-    if owner is not None:
-        access_by_user[owner.username] = "edit"
-
-    # Admin (aggiunti solo se non già presenti)
-    admins = db.query(User).filter(User.role.has(name=RoleEnum.admin.value)).all()
-    for admin in admins:
-        if admin.username not in access_by_user:
-            access_by_user[admin.username] = "admin"
-
-    # Dirette
-    for share in inventory.shared_with_users:
-        shared_user = db.query(User).get(share.user_id)
-        if shared_user is None or shared_user.role is None:
-            continue
-        access = "edit" if shared_user.role.name in (RoleEnum.admin.value, RoleEnum.moderator.value) else "view"
-        access_by_user[shared_user.username] = access
-
-    # Gruppi
-    for shared_group in inventory.shared_with_groups:
-        group = db.query(Group).get(shared_group.group_id)
-        if group is None:
-            continue
-        for assoc in group.user_associations:
-            access = "edit" if assoc.user.role.name in (RoleEnum.admin.value, RoleEnum.moderator.value) else "view"
-            # Se già presente come 'edit' non sovrascrivere
-            if assoc.user.username not in access_by_user or access_by_user[assoc.user.username] != "edit":
-                access_by_user[assoc.user.username] = access
+    access_by_user = effective_access_map(inventory_access_entries(db, inventory))
 
     # Conta
     view_count = sum(1 for access in access_by_user.values() if access == "view")
@@ -637,15 +878,15 @@ def get_by_id_base(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user)
 ):
-    inventory = db.query(Inventory).options(joinedload(Inventory.items)).filter_by(id=inventory_id, type=inventory_type).first()
+    inventory = db.query(Inventory).filter_by(id=inventory_id, type=inventory_type).first()
     if not inventory:
         raise HTTPException(status_code=404, detail="Inventario non trovato")
     if not can_access_inventory(user, inventory, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
 
     return InventoryResponseWithItemCount(
-        **_build_inventory_response(db, inventory).model_dump(),
-        item_count=len(inventory.items)
+        **_build_inventory_response(inventory).model_dump(),
+        item_count=_item_count(db, inventory_id)
     )
 
 #############################################################################
@@ -656,31 +897,31 @@ def get_by_id_base(
 #############################################################################
 # Lista degli inventari visibili all'utente
 @inventory_router.get("/", response_model=List[dict])
-def list_inventories(
+async def list_inventories(
     filtro: str = "",
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    adb: AsyncSession = Depends(get_async_db),
+    user: AuthPrincipal = Depends(get_current_user_async)
 ):
-    return list_inventories_base(
+    return await adb.run_sync(lambda db: list_inventories_base(
         inventory_type="INVENTORY",
         filtro=filtro,
         db=db,
         user=user
-    )
+    ))
 
 # Lista delle checklist visibili all'utente
 @checklist_router.get("/", response_model=List[dict])
-def list_checklists(
+async def list_checklists(
     filtro: str = "",
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    adb: AsyncSession = Depends(get_async_db),
+    user: AuthPrincipal = Depends(get_current_user_async)
 ):
-    return list_inventories_base(
+    return await adb.run_sync(lambda db: list_inventories_base(
         inventory_type="CHECKLIST",
         filtro=filtro,
         db=db,
         user=user
-    )
+    ))
 
 #############################################################################
 # Creazione inventario
@@ -773,27 +1014,109 @@ def delete_checklist(
 #############################################################################
 # Recupero item dell'inventario
 @inventory_router.get("/item/{inventory_id}/", response_model=List[ItemResponse])
-def list_items(
+async def list_items(
     inventory_id: int,
+    adb: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user_async)
+):
+    return await adb.run_sync(lambda db: list_items_base(
+        inventory_type="INVENTORY",
+        inventory_id=inventory_id,
+        db=db,
+        user=user
+    ))
+# Recupero item della checklist
+@checklist_router.get("/item/{inventory_id}/", response_model=List[ItemResponse])
+async def list_checklist_items(
+    inventory_id: int,
+    adb: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user_async)
+):
+    return await adb.run_sync(lambda db: list_items_base(
+        inventory_type="CHECKLIST",
+        inventory_id=inventory_id,
+        db=db,
+        user=user
+    ))
+
+# Pagina di item dell'inventario (keyset)
+@inventory_router.get("/item/{inventory_id}/page", response_model=ItemPageResponse)
+def list_items_page(
+    inventory_id: int,
+    limit: int = Query(ITEM_PAGE_DEFAULT_LIMIT, ge=1, le=ITEM_PAGE_MAX_LIMIT),
+    cursor: str | None = Query(None),
+    sort: ItemPageSort = Query("name"),
+    order: ItemPageOrder = Query("asc"),
+    include_total: bool = Query(False),
+    include_metadata: bool = Query(True),
     db: Session = Depends(get_db),
     user=Depends(get_current_user)
 ):
-    return list_items_base(
+    return list_items_page_base(
         inventory_type="INVENTORY",
         inventory_id=inventory_id,
+        limit=limit,
+        cursor=cursor,
+        sort=sort,
+        order=order,
+        include_total=include_total,
+        include_metadata=include_metadata,
         db=db,
         user=user
     )
-# Recupero item della checklist
-@checklist_router.get("/item/{inventory_id}/", response_model=List[ItemResponse])
-def list_checklist_items(
+# Pagina di item della checklist (keyset)
+@checklist_router.get("/item/{inventory_id}/page", response_model=ItemPageResponse)
+def list_checklist_items_page(
+    inventory_id: int,
+    limit: int = Query(ITEM_PAGE_DEFAULT_LIMIT, ge=1, le=ITEM_PAGE_MAX_LIMIT),
+    cursor: str | None = Query(None),
+    sort: ItemPageSort = Query("name"),
+    order: ItemPageOrder = Query("asc"),
+    include_total: bool = Query(False),
+    include_metadata: bool = Query(True),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    return list_items_page_base(
+        inventory_type="CHECKLIST",
+        inventory_id=inventory_id,
+        limit=limit,
+        cursor=cursor,
+        sort=sort,
+        order=order,
+        include_total=include_total,
+        include_metadata=include_metadata,
+        db=db,
+        user=user
+    )
+
+# Export in streaming degli item dell'inventario
+@inventory_router.get("/item/{inventory_id}/export")
+def export_items(
+    inventory_id: int,
+    export_format: ItemExportFormat = Query("ndjson", alias="format"),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    return export_items_base(
+        inventory_type="INVENTORY",
+        inventory_id=inventory_id,
+        export_format=export_format,
+        db=db,
+        user=user
+    )
+# Export in streaming degli item della checklist
+@checklist_router.get("/item/{inventory_id}/export")
+def export_checklist_items(
     inventory_id: int,
+    export_format: ItemExportFormat = Query("ndjson", alias="format"),
     db: Session = Depends(get_db),
     user=Depends(get_current_user)
 ):
-    return list_items_base(
+    return export_items_base(
         inventory_type="CHECKLIST",
         inventory_id=inventory_id,
+        export_format=export_format,
         db=db,
         user=user
     )
@@ -1176,6 +1499,7 @@ def rollback_inventory(
             name=target.name,
             type="INVENTORY",
             owner_id=target.owner_id or user.id,
+            current_version=_last_inventory_version_num(db, inventory_id),
             user_ins=user.id,
             user_mod=user.id,
             data_mod=datetime.now(timezone.utc),
@@ -1185,7 +1509,7 @@ def rollback_inventory(
         _write_inventory_version(db, restored, "CREATE", user)
         db.commit()
         db.refresh(restored)
-        return _build_inventory_response(db, restored)
+        return _build_inventory_response(restored)
 
     if not can_access_inventory(user, inv, action="edit"):
         raise HTTPException(status_code=403, detail="Accesso negato")
@@ -1197,7 +1521,7 @@ def rollback_inventory(
     _write_inventory_version(db, inv, "UPDATE", user, old_snapshot)
     db.commit()
     db.refresh(inv)
-    return _build_inventory_response(db, inv)
+    return _build_inventory_response(inv)
 
 # Rollback checklist
 @checklist_router.post("/{inventory_id}/rollback/{version_num}", response_model=InventoryResponse)
@@ -1230,6 +1554,7 @@ def rollback_checklist(
             name=target.name,
             type="CHECKLIST",
             owner_id=target.owner_id or user.id,
+            current_version=_last_inventory_version_num(db, inventory_id),
             user_ins=user.id,
             user_mod=user.id,
             data_mod=datetime.now(timezone.utc),
@@ -1239,7 +1564,7 @@ def rollback_checklist(
         _write_inventory_version(db, restored, "CREATE", user)
         db.commit()
         db.refresh(restored)
-        return _build_inventory_response(db, restored)
+        return _build_inventory_response(restored)
 
     if not can_access_inventory(user, inv, action="edit"):
         raise HTTPException(status_code=403, detail="Accesso negato")
@@ -1251,7 +1576,7 @@ def rollback_checklist(
     _write_inventory_version(db, inv, "UPDATE", user, old_snapshot)
     db.commit()
     db.refresh(inv)
-    return _build_inventory_response(db, inv)
+    return _build_inventory_response(inv)
 
 
 #############################################################################
@@ -1,11 +1,18 @@
+import csv
+import io
 import json
-from typing import Any, List, cast
-from fastapi import APIRouter, Depends, HTTPException
+import time
+from typing import Any, List, Literal, cast
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from pydantic import ValidationError
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
-from models import User, Item, Inventory, ItemVersion
-from dependencies import get_db
-from schemas import ItemCreate, ItemUpdate, ItemDelete, ItemMetadataValueResponse, ItemResponse, ItemVersionResponse, VersionBulkDeleteRequest
+from sqlalchemy import and_, case, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from metadata_doc import item_metadata_responses
+from metadata_model import get_value_column_for_type
+from models import User, Item, Inventory, ItemMetadataValue, ItemVersion
+from dependencies import get_async_db, get_current_user_async, get_db
+from schemas import ItemBatchRequest, ItemBatchResponse, ItemCreate, ItemUpdate, ItemDelete, ItemImportResponse, ItemImportRowError, ItemMetadataValueUpsert, ItemResponse, ItemVersionResponse, VersionBulkDeleteRequest
 from routes.auth import get_current_user
 from routes.inventory import can_access_inventory
 from fastapi import status
@@ -42,11 +49,63 @@ def _snapshot_item(item: Item) -> dict:
         "inventory_id": item.inventory_id,
     }
 
-def _next_item_version_num(db: Session, item_id: int) -> int:
+def _last_item_version_num(db: Session, item_id: int) -> int:
+    # Solo per riallineare `current_version` quando si ricrea un item cancellato
     last = db.query(func.max(ItemVersion.version_num)).filter(
         ItemVersion.item_id == item_id
     ).scalar()
-    return (last or 0) + 1
+    return last or 0
+
+def _quantity_merge_action(
+    last_version: ItemVersion | None,
+    user: User,
+    old_snapshot: dict[str, Any],
+    new_snapshot: dict[str, Any],
+) -> tuple[str, dict[str, Any] | None]:
+    """Decide come registrare una modifica di sola quantita rispetto all'ultima versione.
+
+    Restituisce ("new", None) se serve una nuova versione, ("cancel", None) se la modifica
+    annulla la versione precedente e ("merge", diff) se va accorpata nella precedente.
+    """
+    if not last_version:
+        return "new", None
+
+    raw_changed_at = cast(datetime | None, last_version.changed_at)
+    last_changed_at = _to_utc_naive(raw_changed_at) if raw_changed_at else None
+    last_operation = cast(str, last_version.operation)
+    last_changed_by_id = cast(int | None, last_version.changed_by_id)
+    last_diff_raw = cast(str | None, last_version.diff)
+
+    if not (
+        last_operation == "UPDATE"
+        and last_changed_by_id == user.id
+        and last_changed_at is not None
+        and last_changed_at >= _utc_now_naive() - timedelta(seconds=QUANTITY_MERGE_WINDOW_SECONDS)
+    ):
+        return "new", None
+
+    try:
+        previous_diff = json.loads(last_diff_raw) if last_diff_raw else {}
+    except Exception:
+        previous_diff = {}
+
+    # Accorpa solo se anche la versione precedente era di sola quantita
+    if set(previous_diff.keys()) != {"quantity"}:
+        return "new", None
+
+    qty_from = previous_diff.get("quantity", {}).get("from", old_snapshot.get("quantity"))
+    qty_to = new_snapshot.get("quantity")
+
+    # Se qty_from == qty_to, le modifiche si annullano: non registrare nulla
+    # MA solo se siamo ancora entro la finestra di merge (doppio check per sicurezza)
+    if qty_from == qty_to:
+        # Verifica ancora che siamo dentro la finestra (re-check per edge cases)
+        time_since_last = (_utc_now_naive() - last_changed_at).total_seconds()
+        if time_since_last <= QUANTITY_MERGE_WINDOW_SECONDS:
+            return "cancel", None
+        # Se siamo fuori della finestra, non cancellare: crea una nuova versione
+
+    return "merge", {"quantity": {"from": qty_from, "to": qty_to}}
 
 def _write_item_version(
     db: Session,
@@ -83,65 +142,33 @@ def _write_item_version(
                 .order_by(ItemVersion.version_num.desc())
                 .first()
             )
-
-            if not last_version:
-                last_changed_at = None
-                last_operation = None
-                last_changed_by_id = None
-                last_diff_raw = None
-            else:
-                raw_changed_at = cast(datetime | None, last_version.changed_at)
-                last_changed_at = _to_utc_naive(raw_changed_at) if raw_changed_at else None
-                last_operation = cast(str, last_version.operation)
-                last_changed_by_id = cast(int | None, last_version.changed_by_id)
-                last_diff_raw = cast(str | None, last_version.diff)
-
-            if (
-                last_version
-                and last_operation == "UPDATE"
-                and last_changed_by_id == user.id
-                and last_changed_at is not None
-                and last_changed_at >= _utc_now_naive() - timedelta(seconds=QUANTITY_MERGE_WINDOW_SECONDS)
-            ):
-                try:
-                    previous_diff = json.loads(last_diff_raw) if last_diff_raw else {}
-                except Exception:
-                    previous_diff = {}
-
-                # Accorpa solo se anche la versione precedente era di sola quantita
-                if set(previous_diff.keys()) == {"quantity"}:
-                    qty_from = previous_diff.get("quantity", {}).get("from", old_snapshot.get("quantity"))
-                    qty_to = new_snapshot.get("quantity")
-
-                    # Se qty_from == qty_to, le modifiche si annullano: non registrare nulla
-                    # MA solo se siamo ancora entro la finestra di merge (doppio check per sicurezza)
-                    if qty_from == qty_to:
-                        # Verifica ancora che siamo dentro la finestra (re-check per edge cases)
-                        time_since_last = (_utc_now_naive() - last_changed_at).total_seconds()
-                        if time_since_last <= QUANTITY_MERGE_WINDOW_SECONDS:
-                            # Rimuovi la versione precedente dal db poiché è stata annullata
-                            db.delete(last_version)
-                            return
-                        # Se siamo fuori della finestra, non cancellare: crea una nuova versione
-
-                    setattr(last_version, "name", item.name)
-                    setattr(last_version, "description", item.description)
-                    setattr(last_version, "quantity", item.quantity)
-                    setattr(last_version, "inventory_id", item.inventory_id)
-                    setattr(last_version, "changed_at", _utc_now_naive())
-                    setattr(last_version, "changed_by_username", user.username)
-                    setattr(last_version, "diff", json.dumps({"quantity": {"from": qty_from, "to": qty_to}}))
-                    return
+            action, merged_diff = _quantity_merge_action(last_version, user, old_snapshot, new_snapshot)
+            if last_version is not None and action == "cancel":
+                # Rimuovi la versione precedente dal db poiché è stata annullata
+                db.delete(last_version)
+                setattr(item, "current_version", cast(int, last_version.version_num) - 1)
+                return
+            if last_version is not None and action == "merge":
+                setattr(last_version, "name", item.name)
+                setattr(last_version, "description", item.description)
+                setattr(last_version, "quantity", item.quantity)
+                setattr(last_version, "inventory_id", item.inventory_id)
+                setattr(last_version, "changed_at", _utc_now_naive())
+                setattr(last_version, "changed_by_username", user.username)
+                setattr(last_version, "diff", json.dumps(merged_diff))
+                return
 
     item_id = cast(int, item.id)
     inventory_id = cast(int, item.inventory_id)
+    version_num = cast(int, item.current_version or 0) + 1
+    setattr(item, "current_version", version_num)
     version = ItemVersion(
         item_id=item_id,
         inventory_id=inventory_id,
         name=item.name,
         description=item.description,
         quantity=item.quantity,
-        version_num=_next_item_version_num(db, item_id),
+        version_num=version_num,
         operation=operation,
         changed_at=_utc_now_naive(),
         changed_by_id=user.id,
@@ -150,10 +177,7 @@ def _write_item_version(
     )
     db.add(version)
 
-def _build_item_response(db: Session, item: Item) -> ItemResponse:
-    current_version = db.query(func.max(ItemVersion.version_num)).filter(
-        ItemVersion.item_id == item.id
-    ).scalar() or 0
+def _build_item_response(item: Item) -> ItemResponse:
     return ItemResponse(
         id=cast(int, item.id),
         name=cast(str, item.name),
@@ -166,28 +190,23 @@ def _build_item_response(db: Session, item: Item) -> ItemResponse:
         user_mod=item.user_mod,
         username_ins=item.user_ins_rel.username if item.user_ins_rel else None,
         username_mod=item.user_mod_rel.username if item.user_mod_rel else None,
-        metadata_values=[
-            ItemMetadataValueResponse(
-                **value.__dict__,
-                definition_key=value.definition.key if value.definition else None,
-                definition_label=value.definition.label if value.definition else None,
-                field_type=value.definition.field_type if value.definition else None,
-            )
-            for value in item.metadata_values
-        ],
-        version_num=current_version,
+        metadata_values=item_metadata_responses(item),
+        version_num=cast(int, item.current_version or 0),
     )
 
 #############################################################################
 # Visualizzazione item
-@router.get("/{item_id}", response_model=ItemResponse)
-def get_item(item_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def get_item_base(db: Session, item_id: int, user) -> ItemResponse:
     item = db.query(Item).get(item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item non trovato")
     if not can_access_item(user, item, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
-    return _build_item_response(db, item)
+    return _build_item_response(item)
+
+@router.get("/{item_id}", response_model=ItemResponse)
+async def get_item(item_id: int, adb: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    return await adb.run_sync(get_item_base, item_id, user)
 
 #############################################################################
 # Creazione item
@@ -209,7 +228,386 @@ def create_item(item: ItemCreate, db: Session = Depends(get_db), user=Depends(ge
     inventory.data_mod = datetime.now(timezone.utc)
     inventory.user_mod = user.id
     db.commit()
-    return _build_item_response(db, db_item)
+    return _build_item_response(db_item)
+
+#############################################################################
+# Import massivo di item (CSV / NDJSON)
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 500
+IMPORT_IGNORED_FIELDS = {"id", "inventory_id", "data_ins", "data_mod", "version_num", "user_ins", "user_mod"}
+IMPORT_ITEM_FIELDS = {"name", "description", "quantity"}
+
+
+def _iter_import_records(file: UploadFile, import_format: str):
+    # Restituisce (numero riga, dict) senza caricare l'intero file in memoria
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    if import_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(stream), start=2):
+            yield row_number, {key: value for key, value in row.items() if key is not None and value != ""}
+        return
+    for row_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            yield row_number, None
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None
+            continue
+        yield row_number, record
+
+
+def _parse_import_record(
+    record: dict[str, Any],
+    inventory_id: int,
+    definitions_by_key: dict[str, Any],
+) -> tuple[ItemCreate, list[tuple[Any, dict[str, Any]]]]:
+    from routes.metadata import _assert_typed_values_match_definition, _coerce_field_type
+
+    nested = record.get("metadata")
+    if isinstance(nested, dict):
+        # NDJSON: metadati annidati sotto "metadata", non possono sostituire i campi dell'item
+        shadowed = sorted(key for key in nested if key in IMPORT_ITEM_FIELDS or key in IMPORT_IGNORED_FIELDS)
+        if shadowed:
+            raise ValueError(f"Chiavi metadato in conflitto con i campi dell'item: {', '.join(shadowed)}")
+        record = {**{key: value for key, value in record.items() if key != "metadata"}, **nested}
+
+    item = ItemCreate(
+        name=record.get("name"),
+        description=record.get("description"),
+        quantity=record.get("quantity"),
+        inventory_id=inventory_id,
+    )
+    metadata: list[tuple[Any, dict[str, Any]]] = []
+    for key, raw in record.items():
+        if key in IMPORT_ITEM_FIELDS or key in IMPORT_IGNORED_FIELDS or raw is None:
+            continue
+        definition = definitions_by_key.get(key)
+        if definition is None:
+            raise ValueError(f"Campo metadato '{key}' non applicabile all'inventario")
+        column = get_value_column_for_type(_coerce_field_type(definition))
+        typed_values = ItemMetadataValueUpsert(definition_id=definition.id, **{column: raw}).model_dump(
+            include={"value_text", "value_number", "value_boolean", "value_date"}
+        )
+        _assert_typed_values_match_definition(definition, typed_values)
+        metadata.append((definition, typed_values))
+    return item, metadata
+
+
+def _flush_import_batch(
+    db: Session,
+    batch: list[tuple[ItemCreate, list[tuple[Any, dict[str, Any]]]]],
+    user: User,
+) -> None:
+    # Tre INSERT multi-riga per blocco: item, valori metadati, versioni CREATE
+    now = _utc_now_naive()
+    item_ids = db.scalars(
+        insert(Item).returning(Item.id, sort_by_parameter_order=True),
+        [
+            {
+                **item.model_dump(),
+                "current_version": 1,
+                "user_ins": user.id,
+                "user_mod": user.id,
+            }
+            for item, _metadata in batch
+        ],
+    ).all()
+    metadata_rows = [
+        {
+            "item_id": item_id,
+            "definition_id": definition.id,
+            **typed_values,
+            "user_ins": user.id,
+            "user_mod": user.id,
+        }
+        for item_id, (_item, metadata) in zip(item_ids, batch)
+        for definition, typed_values in metadata
+    ]
+    if metadata_rows:
+        db.execute(insert(ItemMetadataValue), metadata_rows)
+    db.execute(
+        insert(ItemVersion),
+        [
+            {
+                "item_id": item_id,
+                "inventory_id": item.inventory_id,
+                "name": item.name,
+                "description": item.description,
+                "quantity": item.quantity,
+                "version_num": 1,
+                "operation": "CREATE",
+                "changed_at": now,
+                "changed_by_id": user.id,
+                "changed_by_username": user.username,
+                "diff": None,
+            }
+            for item_id, (item, _metadata) in zip(item_ids, batch)
+        ],
+    )
+
+
+@router.post("/import", response_model=ItemImportResponse)
+def import_items(
+    inventory_id: int = Form(...),
+    file: UploadFile = File(...),
+    import_format: Literal["csv", "ndjson"] | None = Form(None, alias="format"),
+    dry_run: bool = Form(False),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    from routes.metadata import _resolve_applicable_definitions
+
+    inventory = db.query(Inventory).filter(Inventory.id == inventory_id).first()
+    if not inventory:
+        raise HTTPException(status_code=404, detail="Inventario non trovato")
+    if not can_access_inventory(user, inventory, action="edit"):
+        raise HTTPException(status_code=403, detail="Accesso negato")
+
+    if import_format is None:
+        extension = (file.filename or "").rsplit(".", 1)[-1].lower()
+        import_format = "csv" if extension == "csv" else "ndjson" if extension in ("ndjson", "jsonl") else None
+        if import_format is None:
+            raise HTTPException(status_code=400, detail="Formato file non riconosciuto: usare CSV o NDJSON")
+
+    # Solo definizioni attive: le stesse accettate dagli endpoint dei valori metadati
+    definitions_by_key = {
+        cast(str, definition.key): definition
+        for definition in _resolve_applicable_definitions(db, inventory)
+    }
+
+    started = time.perf_counter()
+    total_rows = 0
+    imported = 0
+    failed = 0
+    errors: list[ItemImportRowError] = []
+    batch: list[tuple[ItemCreate, list[tuple[Any, dict[str, Any]]]]] = []
+
+    def reject(row_number: int, detail: str) -> None:
+        nonlocal failed
+        failed += 1
+        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+            errors.append(ItemImportRowError(row=row_number, detail=detail))
+
+    try:
+        for row_number, record in _iter_import_records(file, import_format):
+            total_rows += 1
+            try:
+                if record is None:
+                    raise ValueError("Riga non valida: atteso un oggetto JSON")
+                parsed = _parse_import_record(record, inventory_id, definitions_by_key)
+            except ValidationError as e:
+                reject(row_number, "; ".join(
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+                ))
+                continue
+            except HTTPException as e:
+                reject(row_number, str(e.detail))
+                continue
+            except ValueError as e:
+                reject(row_number, str(e))
+                continue
+            if (parsed[0].quantity or 0) < 0:
+                reject(row_number, "quantity non può essere negativo")
+                continue
+
+            imported += 1
+            if dry_run:
+                continue
+            batch.append(parsed)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                _flush_import_batch(db, batch, user)
+                batch = []
+        if batch:
+            _flush_import_batch(db, batch, user)
+    except (UnicodeDecodeError, csv.Error):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="File non leggibile: atteso testo UTF-8 in formato CSV o NDJSON")
+
+    # Unica transazione: item, metadati e versioni diventano visibili insieme
+    if imported and not dry_run:
+        inventory.data_mod = datetime.now(timezone.utc)
+        inventory.user_mod = user.id
+        db.commit()
+
+    elapsed = time.perf_counter() - started
+    return ItemImportResponse(
+        inventory_id=inventory_id,
+        dry_run=dry_run,
+        total_rows=total_rows,
+        imported=imported,
+        failed=failed,
+        errors=errors,
+        elapsed_ms=round(elapsed * 1000, 2),
+        rows_per_second=round(total_rows / elapsed, 1) if elapsed > 0 else 0.0,
+    )
+
+#############################################################################
+# Update/delete massivi con SQL set-based
+ITEM_BATCH_MAX_OPERATIONS = 1000
+ITEM_BATCH_UPDATE_FIELDS = ("name", "description", "quantity")
+
+
+@router.post("/batch", response_model=ItemBatchResponse)
+def batch_items(payload: ItemBatchRequest, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    if not payload.operations:
+        raise HTTPException(status_code=400, detail="Nessuna operazione richiesta")
+    if len(payload.operations) > ITEM_BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Massimo {ITEM_BATCH_MAX_OPERATIONS} operazioni per richiesta")
+
+    operations = {operation.item_id: operation for operation in payload.operations}
+    if len(operations) != len(payload.operations):
+        raise HTTPException(status_code=400, detail="Ogni item può comparire in una sola operazione")
+    if not payload.confirm_delete and any(operation.op == "delete" for operation in payload.operations):
+        raise HTTPException(status_code=400, detail="Cancellazione non confermata")
+    for operation in payload.operations:
+        if operation.op == "update" and operation.quantity is not None and operation.quantity < 0:
+            raise HTTPException(status_code=400, detail="quantity non può essere negativo")
+
+    items = {cast(int, item.id): item for item in db.query(Item).filter(Item.id.in_(list(operations)))}
+    missing = sorted(set(operations) - set(items))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Item non trovati: {', '.join(map(str, missing))}")
+
+    # Permessi verificati una volta per coppia (inventario, azione)
+    inventories = {
+        cast(int, inventory.id): inventory
+        for inventory in db.query(Inventory).filter(
+            Inventory.id.in_({cast(int, item.inventory_id) for item in items.values()})
+        )
+    }
+    required_actions = {
+        (cast(int, items[item_id].inventory_id), "edit" if operation.op == "update" else "delete")
+        for item_id, operation in operations.items()
+    }
+    for inventory_id, action in required_actions:
+        if not can_access_inventory(user, inventories[inventory_id], action=action):
+            raise HTTPException(status_code=403, detail="Accesso negato")
+
+    # Ultima versione di ogni item aggiornato, in una sola query (serve al merge delle quantità)
+    update_ids = [item_id for item_id, operation in operations.items() if operation.op == "update"]
+    last_versions: dict[int, ItemVersion] = {}
+    if update_ids:
+        # Ultima versione per numero, come _write_item_version (current_version può divergere)
+        latest = (
+            select(ItemVersion.item_id, func.max(ItemVersion.version_num).label("version_num"))
+            .where(ItemVersion.item_id.in_(update_ids))
+            .group_by(ItemVersion.item_id)
+            .subquery()
+        )
+        last_versions = {
+            cast(int, version.item_id): version
+            for version in db.query(ItemVersion).join(
+                latest,
+                and_(latest.c.item_id == ItemVersion.item_id, latest.c.version_num == ItemVersion.version_num),
+            )
+        }
+
+    now = _utc_now_naive()
+    result = ItemBatchResponse()
+    new_values: dict[str, dict[int, Any]] = {field: {} for field in (*ITEM_BATCH_UPDATE_FIELDS, "current_version")}
+    version_rows: list[dict[str, Any]] = []
+    replaced_version_ids: list[int] = []
+
+    def version_row(item_id: int, snapshot: dict[str, Any], version_num: int, operation: str, diff: dict | None) -> dict:
+        return {
+            "item_id": item_id,
+            "inventory_id": snapshot["inventory_id"],
+            "name": snapshot["name"],
+            "description": snapshot["description"],
+            "quantity": snapshot["quantity"],
+            "version_num": version_num,
+            "operation": operation,
+            "changed_at": now,
+            "changed_by_id": user.id,
+            "changed_by_username": user.username,
+            "diff": json.dumps(diff) if diff else None,
+        }
+
+    for item_id, operation in operations.items():
+        item = items[item_id]
+        old_snapshot = _snapshot_item(item)
+        current_version = cast(int, item.current_version or 0)
+
+        if operation.op == "delete":
+            version_rows.append(version_row(item_id, old_snapshot, current_version + 1, "DELETE", None))
+            result.deleted.append(item_id)
+            continue
+
+        changes = operation.model_dump(include=set(ITEM_BATCH_UPDATE_FIELDS), exclude_unset=True)
+        new_snapshot = {**old_snapshot, **changes}
+        diff = {
+            key: {"from": old_snapshot.get(key), "to": value}
+            for key, value in new_snapshot.items()
+            if old_snapshot.get(key) != value
+        }
+        if not diff:
+            result.unchanged.append(item_id)
+            continue
+        for field in diff:
+            new_values[field][item_id] = new_snapshot[field]
+        result.updated.append(item_id)
+
+        last_version = last_versions.get(item_id)
+        action, merged_diff = "new", None
+        if set(diff) == {"quantity"}:
+            action, merged_diff = _quantity_merge_action(last_version, user, old_snapshot, new_snapshot)
+        if last_version is not None and action == "cancel":
+            replaced_version_ids.append(cast(int, last_version.id))
+            new_values["current_version"][item_id] = cast(int, last_version.version_num) - 1
+        elif last_version is not None and action == "merge":
+            # L'accorpamento riscrive la versione precedente mantenendone il numero
+            replaced_version_ids.append(cast(int, last_version.id))
+            version_rows.append(version_row(item_id, new_snapshot, cast(int, last_version.version_num), "UPDATE", merged_diff))
+        else:
+            version_rows.append(version_row(item_id, new_snapshot, current_version + 1, "UPDATE", diff))
+            new_values["current_version"][item_id] = current_version + 1
+
+    if result.updated:
+        assignments: dict[str, Any] = {
+            field: case(values, value=Item.id, else_=getattr(Item, field))
+            for field, values in new_values.items()
+            if values
+        }
+        db.execute(
+            update(Item)
+            .where(Item.id.in_(result.updated))
+            .values(**assignments, user_mod=user.id, data_mod=func.now())
+            .execution_options(synchronize_session=False)
+        )
+    if replaced_version_ids:
+        db.execute(
+            delete(ItemVersion)
+            .where(ItemVersion.id.in_(replaced_version_ids))
+            .execution_options(synchronize_session=False)
+        )
+    if version_rows:
+        db.execute(insert(ItemVersion), version_rows)
+    if result.deleted:
+        db.execute(
+            delete(ItemMetadataValue)
+            .where(ItemMetadataValue.item_id.in_(result.deleted))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            delete(Item)
+            .where(Item.id.in_(result.deleted))
+            .execution_options(synchronize_session=False)
+        )
+    touched_inventory_ids = {
+        cast(int, items[item_id].inventory_id) for item_id in (*result.updated, *result.deleted)
+    }
+    if touched_inventory_ids:
+        db.execute(
+            update(Inventory)
+            .where(Inventory.id.in_(touched_inventory_ids))
+            .values(data_mod=datetime.now(timezone.utc), user_mod=user.id)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    return result
 
 #############################################################################
 # Aggiornamento item
@@ -234,7 +632,7 @@ def update_item(item_id: int, item_update: ItemUpdate, db: Session = Depends(get
     item.inventory.data_mod = datetime.now(timezone.utc)
     item.inventory.user_mod = user.id
     db.commit()
-    return _build_item_response(db, item)
+    return _build_item_response(item)
 
 #############################################################################
 # Eliminazione item
@@ -319,6 +717,7 @@ def rollback_item(
             description=target.description,
             quantity=target.quantity,
             inventory_id=target.inventory_id,
+            current_version=_last_item_version_num(db, item_id),
             user_ins=user.id,
             user_mod=user.id,
         )
@@ -327,7 +726,7 @@ def rollback_item(
         _write_item_version(db, restored_item, "CREATE", user)
         db.commit()
         db.refresh(restored_item)
-        return _build_item_response(db, restored_item)
+        return _build_item_response(restored_item)
 
     if not can_access_item(user, item, action="edit"):
         raise HTTPException(status_code=403, detail="Accesso negato")
@@ -340,7 +739,7 @@ def rollback_item(
     _write_item_version(db, item, "UPDATE", user, old_snapshot, merge_quantity_updates=False)
     db.commit()
     db.refresh(item)
-    return _build_item_response(db, item)
+    return _build_item_response(item)
 
 #############################################################################
 # Pulizia cronologia versioni item (solo admin)
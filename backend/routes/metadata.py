@@ -4,10 +4,20 @@ from typing import Any, List, cast
 import re
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 from dependencies import get_db
+from metadata_cache import ApplicableDefinition, get_or_load_applicable_definitions
+from metadata_doc import load_missing_metadata
+from metadata_filters import (
+    CompiledMetadataFilter,
+    MetadataFilterError,
+    compile_metadata_filter,
+    decode_filter_cursor,
+    encode_filter_cursor,
+    matching_items_select,
+)
 from metadata_model import (
     InventoryContainerType,
     MetadataDefinitionScope,
@@ -18,12 +28,10 @@ from metadata_model import (
 from models import Inventory, Item, ItemMetadataValue, MetadataDefinition, MetadataDefinitionAssignment, RoleEnum, User
 from routes.auth import get_current_user
 from routes.item import _snapshot_item, _write_item_version
-from routes.inventory import can_access_inventory
+from routes.inventory import ITEM_PAGE_DEFAULT_LIMIT, _item_response, can_access_inventory
 from schemas import (
-    BooleanMetadataFilterCriterion,
     BooleanMetadataFilterRequest,
     BooleanMetadataFilterResponse,
-    DateMetadataFilterCriterion,
     DateMetadataFilterRequest,
     DateMetadataFilterResponse,
     ItemMetadataBulkUpsertRequest,
@@ -36,10 +44,12 @@ from schemas import (
     MetadataDefinitionCreate,
     MetadataDefinitionResponse,
     MetadataDefinitionUpdate,
-    NumericMetadataFilterCriterion,
+    MetadataFilterCriterion,
+    MetadataFilterGroup,
+    MetadataFilterRequest,
+    MetadataFilterResponse,
     NumericMetadataFilterRequest,
     NumericMetadataFilterResponse,
-    TextMetadataFilterCriterion,
     TextMetadataFilterRequest,
     TextMetadataFilterResponse,
 )
@@ -199,11 +209,25 @@ def _resolve_applicable_definitions(
     db: Session,
     inventory: Inventory,
     include_inactive: bool = False,
-) -> list[MetadataDefinition]:
+) -> list[ApplicableDefinition]:
     # Restituisce le definizioni applicabili a un inventario con priorita' GLOBAL < TYPE < INVENTORY.
+    # Copie immutabili dalla cache di processo, invalidata al commit di definizioni/assegnazioni.
+    key = (cast(int, inventory.id), cast(str, inventory.type), include_inactive)
+    return get_or_load_applicable_definitions(
+        key, lambda: _load_applicable_definitions(db, inventory, include_inactive)
+    )
+
+
+def _load_applicable_definitions(
+    db: Session,
+    inventory: Inventory,
+    include_inactive: bool,
+) -> list[ApplicableDefinition]:
     raw_pairs = (
         db.query(MetadataDefinition, MetadataDefinitionAssignment)
         .join(MetadataDefinitionAssignment, MetadataDefinitionAssignment.definition_id == MetadataDefinition.id)
+        # Tutte le assegnazioni (anche di altri scope) servono alla risposta: una sola query aggiuntiva
+        .options(selectinload(MetadataDefinition.assignments))
         .filter(
             or_(
                 MetadataDefinitionAssignment.scope == MetadataDefinitionScope.GLOBAL.value,
@@ -234,7 +258,8 @@ def _resolve_applicable_definitions(
     by_key: dict[str, MetadataDefinition] = {}
     for definition, _assignment in pairs_sorted:
         by_key[cast(str, definition.key)] = definition
-    return sorted(by_key.values(), key=lambda d: (cast(int, d.sort_order), cast(int, d.id)))
+    resolved = sorted(by_key.values(), key=lambda d: (cast(int, d.sort_order), cast(int, d.id)))
+    return [ApplicableDefinition.from_model(d) for d in resolved]
 
 
 def _definition_applies_to_inventory(
@@ -401,169 +426,134 @@ def _touch_item_for_metadata_change(
 
 
 # ---------------------------------------------------------------------------
-# Helpers – predicati filtri avanzati
+# Helpers – filtri avanzati (motore unico in metadata_filters)
 # ---------------------------------------------------------------------------
 
-def _build_text_metadata_predicate(
-    db: Session,
-    criterion: TextMetadataFilterCriterion,
-    definition: MetadataDefinition,
-):
-    field_type = MetadataFieldType(definition.field_type)
-    if field_type not in {MetadataFieldType.TEXT, MetadataFieldType.LIST}:
-        raise HTTPException(status_code=400, detail=f"La definizione {definition.id} non è di tipo TEXT/LIST")
-
-    row_exists = db.query(ItemMetadataValue.id).filter(
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ).exists()
-    predicate = [
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ]
-    op = criterion.operator
-
-    if op == MetadataFilterOperator.IS_NULL:
-        return ~row_exists
-    elif op == MetadataFilterOperator.IS_NOT_NULL:
-        return row_exists
-    else:
-        predicate.append(ItemMetadataValue.value_text.is_not(None))
-        if field_type == MetadataFieldType.LIST and op in {
-            MetadataFilterOperator.CONTAINS,
-            MetadataFilterOperator.NOT_CONTAINS,
-        }:
-            raise HTTPException(status_code=400, detail="L'operatore scelto non è supportato per il tipo LIST")
-
-        if op == MetadataFilterOperator.EQUALS:
-            predicate.append(ItemMetadataValue.value_text == criterion.value_text)
-        elif op == MetadataFilterOperator.NOT_EQUALS:
-            predicate.append(ItemMetadataValue.value_text != criterion.value_text)
-        elif op == MetadataFilterOperator.CONTAINS:
-            predicate.append(ItemMetadataValue.value_text.ilike(f"%{criterion.value_text}%"))
-        elif op == MetadataFilterOperator.NOT_CONTAINS:
-            predicate.append(~ItemMetadataValue.value_text.ilike(f"%{criterion.value_text}%"))
-        else:
-            raise HTTPException(status_code=400, detail=f"Operatore non supportato: {op.value}")
-
-    return db.query(ItemMetadataValue.id).filter(and_(*predicate)).exists()
+def _compile_filter_or_400(group: MetadataFilterGroup, field_types: dict[int, str]) -> CompiledMetadataFilter:
+    try:
+        return compile_metadata_filter(group, field_types)
+    except MetadataFilterError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
-def _build_numeric_metadata_predicate(
+def _filter_item_ids_by_type(
     db: Session,
-    criterion: NumericMetadataFilterCriterion,
-    definition: MetadataDefinition,
-):
-    if MetadataFieldType(definition.field_type) != MetadataFieldType.NUMBER:
-        raise HTTPException(status_code=400, detail=f"La definizione {definition.id} non è di tipo NUMBER")
-    row_exists = db.query(ItemMetadataValue.id).filter(
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ).exists()
-    predicate = [
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ]
-    op = criterion.operator
-    if op == MetadataFilterOperator.IS_NULL:
-        return ~row_exists
-    elif op == MetadataFilterOperator.IS_NOT_NULL:
-        return row_exists
-    else:
-        predicate.append(ItemMetadataValue.value_number.is_not(None))
-        if op == MetadataFilterOperator.EQUALS:
-            predicate.append(ItemMetadataValue.value_number == criterion.value_number)
-        elif op == MetadataFilterOperator.NOT_EQUALS:
-            predicate.append(ItemMetadataValue.value_number != criterion.value_number)
-        elif op == MetadataFilterOperator.GREATER_THAN:
-            predicate.append(ItemMetadataValue.value_number > criterion.value_number)
-        elif op == MetadataFilterOperator.GREATER_THAN_OR_EQUAL:
-            predicate.append(ItemMetadataValue.value_number >= criterion.value_number)
-        elif op == MetadataFilterOperator.LESS_THAN:
-            predicate.append(ItemMetadataValue.value_number < criterion.value_number)
-        elif op == MetadataFilterOperator.LESS_THAN_OR_EQUAL:
-            predicate.append(ItemMetadataValue.value_number <= criterion.value_number)
-        elif op == MetadataFilterOperator.BETWEEN:
-            predicate.append(ItemMetadataValue.value_number.between(criterion.range_from, criterion.range_to))
-        else:
-            raise HTTPException(status_code=400, detail=f"Operatore non supportato: {op.value}")
-    return db.query(ItemMetadataValue.id).filter(and_(*predicate)).exists()
+    user: User,
+    payload: TextMetadataFilterRequest | NumericMetadataFilterRequest | DateMetadataFilterRequest | BooleanMetadataFilterRequest,
+    allowed_types: set[MetadataFieldType],
+    type_label: str,
+) -> list[int]:
+    # Endpoint per singolo tipo: stessi controlli di sempre, poi lo stesso motore del filtro composito
+    inventory = _get_inventory_or_404(db, payload.inventory_id)
+    if not can_access_inventory(user, inventory, action="view"):
+        raise HTTPException(status_code=403, detail="Accesso negato")
+    definitions = {cast(int, d.id): d for d in _resolve_applicable_definitions(db, inventory)}
+    if any(c.definition_id not in definitions for c in payload.criteria):
+        raise HTTPException(
+            status_code=400,
+            detail="Una o più definizioni non sono valide per questo inventario o risultano inattive",
+        )
+    for criterion in payload.criteria:
+        definition = definitions[criterion.definition_id]
+        if MetadataFieldType(definition.field_type) not in allowed_types:
+            raise HTTPException(status_code=400, detail=f"La definizione {definition.id} non è di tipo {type_label}")
+
+    group = MetadataFilterGroup(
+        match_mode=payload.match_mode,
+        criteria=[MetadataFilterCriterion.model_validate(c.model_dump()) for c in payload.criteria],
+    )
+    compiled = _compile_filter_or_400(group, {definition_id: d.field_type for definition_id, d in definitions.items()})
+    return list(db.execute(matching_items_select(payload.inventory_id, compiled)).scalars())
 
 
-def _build_date_metadata_predicate(
+def _run_compiled_filter(
     db: Session,
-    criterion: DateMetadataFilterCriterion,
-    definition: MetadataDefinition,
-):
-    if MetadataFieldType(definition.field_type) != MetadataFieldType.DATE:
-        raise HTTPException(status_code=400, detail=f"La definizione {definition.id} non è di tipo DATE")
-    row_exists = db.query(ItemMetadataValue.id).filter(
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ).exists()
-    predicate = [
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ]
-    op = criterion.operator
-    if op == MetadataFilterOperator.IS_NULL:
-        return ~row_exists
-    elif op == MetadataFilterOperator.IS_NOT_NULL:
-        return row_exists
-    else:
-        predicate.append(ItemMetadataValue.value_date.is_not(None))
-        if op == MetadataFilterOperator.EQUALS:
-            predicate.append(ItemMetadataValue.value_date == criterion.value_date)
-        elif op == MetadataFilterOperator.NOT_EQUALS:
-            predicate.append(ItemMetadataValue.value_date != criterion.value_date)
-        elif op == MetadataFilterOperator.GREATER_THAN:
-            predicate.append(ItemMetadataValue.value_date > criterion.value_date)
-        elif op == MetadataFilterOperator.GREATER_THAN_OR_EQUAL:
-            predicate.append(ItemMetadataValue.value_date >= criterion.value_date)
-        elif op == MetadataFilterOperator.LESS_THAN:
-            predicate.append(ItemMetadataValue.value_date < criterion.value_date)
-        elif op == MetadataFilterOperator.LESS_THAN_OR_EQUAL:
-            predicate.append(ItemMetadataValue.value_date <= criterion.value_date)
-        elif op == MetadataFilterOperator.BETWEEN:
-            predicate.append(ItemMetadataValue.value_date.between(criterion.range_from, criterion.range_to))
-        else:
-            raise HTTPException(status_code=400, detail=f"Operatore non supportato: {op.value}")
-    return db.query(ItemMetadataValue.id).filter(and_(*predicate)).exists()
+    inventory_id: int,
+    compiled: CompiledMetadataFilter,
+    limit: int | None = None,
+    cursor: str | None = None,
+    include_items: bool = False,
+    include_total: bool = False,
+) -> MetadataFilterResponse:
+    try:
+        after_id = decode_filter_cursor(cursor) if cursor else None
+    except MetadataFilterError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if include_items and limit is None:
+        limit = ITEM_PAGE_DEFAULT_LIMIT
+
+    total = None
+    if include_total:
+        total = db.execute(
+            select(func.count()).select_from(matching_items_select(inventory_id, compiled).subquery())
+        ).scalar_one()
+
+    query = matching_items_select(inventory_id, compiled, after_id=after_id)
+    if limit is not None:
+        # Una riga in più per sapere se esiste la pagina successiva
+        query = query.limit(limit + 1)
+    item_ids = list(db.execute(query).scalars())
+    next_cursor = None
+    if limit is not None and len(item_ids) > limit:
+        item_ids = item_ids[:limit]
+        next_cursor = encode_filter_cursor(item_ids[-1])
+
+    items = None
+    if include_items:
+        rows = db.query(Item).options(
+            joinedload(Item.user_ins_rel),
+            joinedload(Item.user_mod_rel),
+        ).filter(Item.id.in_(item_ids)).order_by(Item.id.asc()).all() if item_ids else []
+        load_missing_metadata(db, rows)
+        items = [_item_response(item) for item in rows]
+
+    return MetadataFilterResponse(
+        inventory_id=inventory_id,
+        match_mode=compiled.match_mode,
+        item_ids=item_ids,
+        count=len(item_ids),
+        items=items,
+        next_cursor=next_cursor,
+        total=total,
+    )
 
 
 # ===========================================================================
 # ROUTES – Filtri avanzati
 # ===========================================================================
 
-@router.post("/filters/text", response_model=TextMetadataFilterResponse)
-def filter_items_by_text_metadata(
-    payload: TextMetadataFilterRequest,
+@router.post("/filters", response_model=MetadataFilterResponse)
+def filter_items_by_metadata(
+    payload: MetadataFilterRequest,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
+    """Filtro composito: criteri di tipo misto e gruppi AND/OR, eseguiti con un'unica query."""
     inventory = _get_inventory_or_404(db, payload.inventory_id)
     if not can_access_inventory(user, inventory, action="view"):
         raise HTTPException(status_code=403, detail="Accesso negato")
-    definition_ids = {c.definition_id for c in payload.criteria}
-    definitions = {
-        cast(int, d.id): d
-        for d in _resolve_applicable_definitions(db, inventory)
-        if cast(int, d.id) in definition_ids
-    }
-    if len(definitions) != len(definition_ids):
-        raise HTTPException(
-            status_code=400,
-            detail="Una o più definizioni non sono valide per questo inventario o risultano inattive",
-        )
-    exists_predicates = [
-        _build_text_metadata_predicate(db, c, definitions[c.definition_id]) for c in payload.criteria
-    ]
-    query = db.query(Item.id).filter(Item.inventory_id == payload.inventory_id)
-    if payload.match_mode == "all":
-        query = query.filter(and_(*exists_predicates))
-    else:
-        query = query.filter(or_(*exists_predicates))
-    item_ids = [r[0] for r in query.order_by(Item.id.asc()).all()]
+    field_types = {cast(int, d.id): d.field_type for d in _resolve_applicable_definitions(db, inventory)}
+    compiled = _compile_filter_or_400(payload, field_types)
+    return _run_compiled_filter(
+        db,
+        payload.inventory_id,
+        compiled,
+        limit=payload.limit,
+        cursor=payload.cursor,
+        include_items=payload.include_items,
+        include_total=payload.include_total,
+    )
+
+
+@router.post("/filters/text", response_model=TextMetadataFilterResponse)
+def filter_items_by_text_metadata(
+    payload: TextMetadataFilterRequest,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    item_ids = _filter_item_ids_by_type(
+        db, user, payload, {MetadataFieldType.TEXT, MetadataFieldType.LIST}, "TEXT/LIST"
+    )
     return TextMetadataFilterResponse(
         inventory_id=payload.inventory_id,
         match_mode=payload.match_mode,
@@ -578,29 +568,7 @@ def filter_items_by_numeric_metadata(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    inventory = _get_inventory_or_404(db, payload.inventory_id)
-    if not can_access_inventory(user, inventory, action="view"):
-        raise HTTPException(status_code=403, detail="Accesso negato")
-    definition_ids = {c.definition_id for c in payload.criteria}
-    definitions = {
-        cast(int, d.id): d
-        for d in _resolve_applicable_definitions(db, inventory)
-        if cast(int, d.id) in definition_ids
-    }
-    if len(definitions) != len(definition_ids):
-        raise HTTPException(
-            status_code=400,
-            detail="Una o più definizioni non sono valide per questo inventario o risultano inattive",
-        )
-    exists_predicates = [
-        _build_numeric_metadata_predicate(db, c, definitions[c.definition_id]) for c in payload.criteria
-    ]
-    query = db.query(Item.id).filter(Item.inventory_id == payload.inventory_id)
-    if payload.match_mode == "all":
-        query = query.filter(and_(*exists_predicates))
-    else:
-        query = query.filter(or_(*exists_predicates))
-    item_ids = [r[0] for r in query.order_by(Item.id.asc()).all()]
+    item_ids = _filter_item_ids_by_type(db, user, payload, {MetadataFieldType.NUMBER}, "NUMBER")
     return NumericMetadataFilterResponse(
         inventory_id=payload.inventory_id,
         match_mode=payload.match_mode,
@@ -615,29 +583,7 @@ def filter_items_by_date_metadata(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    inventory = _get_inventory_or_404(db, payload.inventory_id)
-    if not can_access_inventory(user, inventory, action="view"):
-        raise HTTPException(status_code=403, detail="Accesso negato")
-    definition_ids = {c.definition_id for c in payload.criteria}
-    definitions = {
-        cast(int, d.id): d
-        for d in _resolve_applicable_definitions(db, inventory)
-        if cast(int, d.id) in definition_ids
-    }
-    if len(definitions) != len(definition_ids):
-        raise HTTPException(
-            status_code=400,
-            detail="Una o più definizioni non sono valide per questo inventario o risultano inattive",
-        )
-    exists_predicates = [
-        _build_date_metadata_predicate(db, c, definitions[c.definition_id]) for c in payload.criteria
-    ]
-    query = db.query(Item.id).filter(Item.inventory_id == payload.inventory_id)
-    if payload.match_mode == "all":
-        query = query.filter(and_(*exists_predicates))
-    else:
-        query = query.filter(or_(*exists_predicates))
-    item_ids = [r[0] for r in query.order_by(Item.id.asc()).all()]
+    item_ids = _filter_item_ids_by_type(db, user, payload, {MetadataFieldType.DATE}, "DATE")
     return DateMetadataFilterResponse(
         inventory_id=payload.inventory_id,
         match_mode=payload.match_mode,
@@ -646,66 +592,13 @@ def filter_items_by_date_metadata(
     )
 
 
-def _build_boolean_metadata_predicate(
-    db: Session,
-    criterion: BooleanMetadataFilterCriterion,
-    definition: MetadataDefinition,
-):
-    if MetadataFieldType(definition.field_type) != MetadataFieldType.BOOLEAN:
-        raise HTTPException(status_code=400, detail=f"La definizione {definition.id} non è di tipo BOOLEAN")
-    row_exists = db.query(ItemMetadataValue.id).filter(
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ).exists()
-    predicate = [
-        ItemMetadataValue.item_id == Item.id,
-        ItemMetadataValue.definition_id == criterion.definition_id,
-    ]
-    op = criterion.operator
-    if op == MetadataFilterOperator.IS_NULL:
-        return ~row_exists
-    elif op == MetadataFilterOperator.IS_NOT_NULL:
-        return row_exists
-    elif op == MetadataFilterOperator.EQUALS:
-        predicate.append(ItemMetadataValue.value_boolean.is_not(None))
-        predicate.append(ItemMetadataValue.value_boolean == criterion.value_boolean)
-    elif op == MetadataFilterOperator.NOT_EQUALS:
-        predicate.append(ItemMetadataValue.value_boolean.is_not(None))
-        predicate.append(ItemMetadataValue.value_boolean != criterion.value_boolean)
-    else:
-        raise HTTPException(status_code=400, detail=f"Operatore non supportato: {op.value}")
-    return db.query(ItemMetadataValue.id).filter(and_(*predicate)).exists()
-
-
 @router.post("/filters/boolean", response_model=BooleanMetadataFilterResponse)
 def filter_items_by_boolean_metadata(
     payload: BooleanMetadataFilterRequest,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    inventory = _get_inventory_or_404(db, payload.inventory_id)
-    if not can_access_inventory(user, inventory, action="view"):
-        raise HTTPException(status_code=403, detail="Accesso negato")
-    definition_ids = {c.definition_id for c in payload.criteria}
-    definitions = {
-        cast(int, d.id): d
-        for d in _resolve_applicable_definitions(db, inventory)
-        if cast(int, d.id) in definition_ids
-    }
-    if len(definitions) != len(definition_ids):
-        raise HTTPException(
-            status_code=400,
-            detail="Una o più definizioni non sono valide per questo inventario o risultano inattive",
-        )
-    exists_predicates = [
-        _build_boolean_metadata_predicate(db, c, definitions[c.definition_id]) for c in payload.criteria
-    ]
-    query = db.query(Item.id).filter(Item.inventory_id == payload.inventory_id)
-    if payload.match_mode == "all":
-        query = query.filter(and_(*exists_predicates))
-    else:
-        query = query.filter(or_(*exists_predicates))
-    item_ids = [r[0] for r in query.order_by(Item.id.asc()).all()]
+    item_ids = _filter_item_ids_by_type(db, user, payload, {MetadataFieldType.BOOLEAN}, "BOOLEAN")
     return BooleanMetadataFilterResponse(
         inventory_id=payload.inventory_id,
         match_mode=payload.match_mode,
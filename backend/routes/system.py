@@ -1,17 +1,63 @@
+import hmac
 import os
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+from fastapi.security import SecurityScopes
+from fastapi.security.utils import get_authorization_scheme_param
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
 from dotenv import load_dotenv
+from database import get_pool_stats
+from dependencies import get_current_user, get_db, principal_cache, role_required
+from metadata_cache import applicable_definitions_cache
+from metrics import render_prometheus
+from models import RoleEnum
+from routes.auth import get_password_hash_stats
+from routes.filters import template_plan_cache
+from stats import dashboard_stats_cache
 
 load_dotenv()
 
 router = APIRouter()
 
+# Token statico opzionale per lo scraping Prometheus (in alternativa serve un utente ADMIN)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 ##################################################
 # Modello per la risposta della versione dell'API
 class VersionResponse(BaseModel):
     version: str
 
+##################################################
+# Modello per lo stato del pool bcrypt
+class PasswordHashStatsResponse(BaseModel):
+    workers: int
+    max_queue: int
+    bcrypt_rounds: int
+    pending: int
+    running: int
+    queued: int
+    completed: int
+    rejected: int
+
+##################################################
+# Modello per lo stato del pool di connessioni al database
+class DatabasePoolStatsResponse(BaseModel):
+    pool_class: str
+    size: int | None = None
+    max_overflow: int | None = None
+    checked_out: int | None = None
+    checked_in: int | None = None
+    overflow: int | None = None
+    async_checked_out: int | None = None
+    connects: int
+    checkouts: int
+    checkins: int
+    invalidations: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+
 ##################################################
 # Modello per la risposta all'HEALTHCHECK dell'API
 class HealthCheckResponse(BaseModel):
@@ -28,4 +74,57 @@ def get_api_version():
 # Endpoint usato dall'HEALTHCHECK di Docker
 @router.get("/health-check", response_model=HealthCheckResponse)
 def get_health():
-    return {"status": "Everything is OK", "version": os.getenv("API_VERSION", "unknown")}
\ No newline at end of file
+    return {"status": "Everything is OK", "version": os.getenv("API_VERSION", "unknown")}
+
+#################################################
+# Stato del pool dedicato all'hashing delle password (solo ADMIN)
+@router.get("/password-hashing", response_model=PasswordHashStatsResponse,
+            dependencies=[Depends(role_required(RoleEnum.admin))])
+def get_password_hashing_stats():
+    return get_password_hash_stats()
+
+#################################################
+# Stato del pool di connessioni al database del processo corrente (solo ADMIN)
+@router.get("/database-pool", response_model=DatabasePoolStatsResponse,
+            dependencies=[Depends(role_required(RoleEnum.admin))])
+def get_database_pool_stats():
+    return get_pool_stats()
+
+#################################################
+# Metriche in formato Prometheus (ADMIN oppure `Authorization: Bearer <METRICS_TOKEN>`)
+def _authorize_metrics(request: Request, db: Session = Depends(get_db)):
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Non autenticato")
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return
+    user = get_current_user(SecurityScopes(), token, db)
+    if user.role.name != RoleEnum.admin.value:
+        raise HTTPException(status_code=403, detail="Accesso negato: permessi insufficienti")
+
+def _process_gauges() -> dict:
+    pool = get_pool_stats()
+    hashing = get_password_hash_stats()
+    return {
+        "db_pool_checked_out": ("gauge", "Connessioni al database in uso.", pool.get("checked_out")),
+        "db_pool_overflow": ("gauge", "Connessioni oltre pool_size.", pool.get("overflow")),
+        "db_pool_async_checked_out": ("gauge", "Connessioni async in uso.", pool.get("async_checked_out")),
+        "db_pool_checkouts_total": ("counter", "Connessioni prelevate dal pool.", pool["checkouts"]),
+        "db_pool_timeouts_total": ("counter", "Timeout in attesa di una connessione.", pool["timeouts"]),
+        "db_pool_wait_seconds_total": ("counter", "Tempo totale di attesa di una connessione.", pool["wait_seconds_total"]),
+        "password_hash_queued": ("gauge", "Hash bcrypt in coda.", hashing["queued"]),
+        "password_hash_running": ("gauge", "Hash bcrypt in esecuzione.", hashing["running"]),
+        "password_hash_rejected_total": ("counter", "Richieste rifiutate per coda bcrypt piena.", hashing["rejected"]),
+        "auth_principal_cache_hits_total": ("counter", "Hit della cache utenti autenticati.", principal_cache.hits),
+        "auth_principal_cache_misses_total": ("counter", "Miss della cache utenti autenticati.", principal_cache.misses),
+        "dashboard_stats_cache_hits_total": ("counter", "Hit della cache statistiche dashboard.", dashboard_stats_cache.hits),
+        "dashboard_stats_cache_misses_total": ("counter", "Miss della cache statistiche dashboard.", dashboard_stats_cache.misses),
+        "metadata_definitions_cache_hits_total": ("counter", "Hit della cache definizioni metadati applicabili.", applicable_definitions_cache.hits),
+        "metadata_definitions_cache_misses_total": ("counter", "Miss della cache definizioni metadati applicabili.", applicable_definitions_cache.misses),
+        "filter_template_plan_cache_hits_total": ("counter", "Hit della cache filtri compilati dei template.", template_plan_cache.hits),
+        "filter_template_plan_cache_misses_total": ("counter", "Miss della cache filtri compilati dei template.", template_plan_cache.misses),
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(_authorize_metrics)])
+def get_metrics():
+    return PlainTextResponse(render_prometheus(_process_gauges()), media_type="text/plain; version=0.0.4")
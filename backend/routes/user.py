@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import not_
-from routes.auth import hash_password, get_current_user
-from dependencies import get_db, role_required
+from routes.auth import hash_password_async, get_current_user
+from routes.inventory import shared_user_ids
+from dependencies import get_db, invalidate_principal, role_required
 from models import User, RoleEnum, Role, Group, Inventory
 import crud, schemas
 from typing import List
@@ -12,9 +13,10 @@ router = APIRouter(dependencies=[Depends(role_required(RoleEnum.admin))])
 #############################################################################
 # Creazione utente
 @router.post("/users/", response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    hashed_password = hash_password(user.password)
-    return crud.create_user(db, user, hashed_password)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    # bcrypt nel pool dedicato, le query nel threadpool
+    hashed_password = await hash_password_async(user.password)
+    return await run_in_threadpool(crud.create_user, db, user, hashed_password)
 
 # Elenco utenti
 @router.get("/users/", response_model=list[schemas.UserResponse])
@@ -22,16 +24,15 @@ def list_users(db: Session = Depends(get_db)):
     return db.query(User).all()
 
 # Modifica utente
-@router.put("/users/{user_id}", response_model=schemas.UserResponse)
-def update_user(user_id: int, update: schemas.UserUpdate, db: Session = Depends(get_db)):
+def _apply_user_update(db: Session, user_id: int, update: schemas.UserUpdate, hashed_password: str | None):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Utente non trovato")
 
     #if update.username is not None:
     #    user.username = update.username
-    if update.password is not None:
-        user.hashed_password = hash_password(update.password)
+    if hashed_password is not None:
+        user.hashed_password = hashed_password
     if update.email is not None:
         user.email = update.email
     if update.is_blocked is not None:
@@ -43,9 +44,15 @@ def update_user(user_id: int, update: schemas.UserUpdate, db: Session = Depends(
         user.role_id = update.role_id
 
     db.commit()
+    invalidate_principal(user.id)
     db.refresh(user)
     return user
 
+@router.put("/users/{user_id}", response_model=schemas.UserResponse)
+async def update_user(user_id: int, update: schemas.UserUpdate, db: Session = Depends(get_db)):
+    hashed_password = await hash_password_async(update.password) if update.password is not None else None
+    return await run_in_threadpool(_apply_user_update, db, user_id, update, hashed_password)
+
 # Eliminazione utente
 @router.delete("/users/{user_id}", response_model=dict)
 def delete_user(user_id: int, db: Session = Depends(get_db)):
@@ -61,6 +68,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
 
     db.delete(user)
     db.commit()
+    invalidate_principal(user_id)
     return {"detail": "Utente eliminato"}
 
 #############################################################################
@@ -82,6 +90,7 @@ def update_role(role_id: int, update: schemas.RoleCreate, db: Session = Depends(
         raise HTTPException(status_code=404, detail="Ruolo non trovato")
     role.name = update.name
     db.commit()
+    invalidate_principal()
     db.refresh(role)
     return role
 
@@ -93,6 +102,7 @@ def delete_role(role_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Ruolo non trovato")
     db.delete(role)
     db.commit()
+    invalidate_principal()
     return {"detail": "Ruolo eliminato"}
 
 #############################################################################
@@ -126,6 +136,7 @@ def delete_group(group_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Gruppo non trovato")
     db.delete(group)
     db.commit()
+    invalidate_principal()
     return {"detail": "Gruppo eliminato"}
 
 #############################################################################
@@ -141,6 +152,7 @@ def add_user_to_group(group_id: int, user_id: int, db: Session = Depends(get_db)
     if user not in group.users:
         group.users.append(user)
         db.commit()
+        invalidate_principal(user_id)
         db.refresh(group)
 
     return group
@@ -157,6 +169,7 @@ def remove_user_from_group(group_id: int, user_id: int, db: Session = Depends(ge
     if user in group.users:
         group.users.remove(user)
         db.commit()
+        invalidate_principal(user_id)
         db.refresh(group)
 
     return group
@@ -168,6 +181,7 @@ def assign_role(user_id: int, role_id: int, db: Session = Depends(get_db)):
     user = crud.assign_role_to_user(db, user_id, role_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_principal(user_id)
     return schemas.UserResponse.model_validate(user)  # ✅ Converti SQLAlchemy → Pydantic
 
 # Blocco/sblocco utente
@@ -187,6 +201,7 @@ def block_user(user_id: int,
 
     user.is_blocked = not user.is_blocked  # ✅ Inverte lo stato
     db.commit()
+    invalidate_principal(user_id)
     db.refresh(user)
     
     status_text = "bloccato" if user.is_blocked else "sbloccato"
@@ -197,26 +212,14 @@ def get_shareable_users(inventory_id: int, db: Session = Depends(get_db), curren
     if current_user.role.name not in ["admin", "moderator"]:
         raise HTTPException(status_code=403)
 
-    inventory = db.query(Inventory).options(
-        joinedload(Inventory.shared_with_users),
-        joinedload(Inventory.shared_with_groups)
-    ).get(inventory_id)
-    if not inventory:
+    inventory_exists = db.query(Inventory.id).filter(Inventory.id == inventory_id).first()
+    if not inventory_exists:
         raise HTTPException(status_code=404, detail="Inventario non trovato")
 
-    # utenti con accesso diretto
-    shared_user_ids = {s.user_id for s in inventory.shared_with_users}
-
-    # utenti che hanno già accesso (direttamente o tramite gruppo)
-    for shared_group in inventory.shared_with_groups:
-        group = db.query(Group).filter(Group.id == shared_group.group_id).first()
-        if group:
-            for user in group.users:
-                shared_user_ids.add(user.id)
-
-    # tutti gli utenti non admin
-    all_users = db.query(User).filter(User.role.has(Role.name != "admin")).all()
-
-    # ritorna solo quelli non ancora condivisi in nessun modo
-    return [u for u in all_users if u.id not in shared_user_ids]
-    # print("Utenti disponibili alla condivisione:", [u.username for u in all_users if u.id not in shared_user_ids])
\ No newline at end of file
+    # tutti gli utenti non admin non ancora condivisi in nessun modo (direttamente o tramite gruppo)
+    return (
+        db.query(User)
+        .options(joinedload(User.role))
+        .filter(User.role.has(Role.name != "admin"), User.id.not_in(shared_user_ids(inventory_id)))
+        .all()
+    )
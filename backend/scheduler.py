@@ -6,6 +6,7 @@ from routes.backup import create_backup, BACKUP_DIR
 from datetime import datetime, timezone, timedelta
 from crud import get_setting, set_setting
 import logging
+import os
 import traceback
 from models import ItemVersion, InventoryVersion, Item, Inventory
 
@@ -13,6 +14,46 @@ logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
+# Con più worker uvicorn lo scheduler deve girare in un solo processo: il primo che
+# ottiene il lock esclusivo sul file. Il lock si libera da solo se il processo termina.
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "/tmp/home-inventory-scheduler.lock")
+# Ogni quanto il processo leader rilegge la configurazione (modificabile da qualunque worker)
+SCHEDULER_SYNC_SECONDS = int(os.getenv("SCHEDULER_SYNC_SECONDS", "60"))
+
+_leader_lock_file = None
+_applied_schedule = None
+
+def acquire_scheduler_leadership() -> bool:
+    global _leader_lock_file
+    if _leader_lock_file is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:  # piattaforme senza fcntl: un solo processo, nessun lock
+        _leader_lock_file = True
+        return True
+
+    lock_file = open(SCHEDULER_LOCK_FILE, "a+")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        logger.info(f"Scheduler già attivo in un altro processo (pid {os.getpid()} non leader).")
+        return False
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _leader_lock_file = lock_file
+    logger.info(f"Processo {os.getpid()} leader dello scheduler.")
+    return True
+
+def is_scheduler_leader() -> bool:
+    return _leader_lock_file is not None
+
+def shutdown_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+
 def cleanup_old_backups(retention_count: int):
     backups = sorted(BACKUP_DIR.glob("auto_*.sql"), key=lambda x: x.stat().st_mtime)
     if len(backups) > retention_count:
@@ -76,19 +117,54 @@ def scheduled_backup():
         db.close()
     logger.info("Backup automatico completato.")
 
+def _read_backup_schedule(db):
+    setting = get_setting(db, "BACKUP_FREQUENCY")
+    frequency = (setting.value if setting else "none").lower()
+    setting = get_setting(db, "BACKUP_INTERVAL_DAYS")
+    interval_days = int(setting.value or 0) if setting else 0
+    setting = get_setting(db, "BACKUP_INTERVAL_HOURS")
+    interval_hours = int(setting.value or 0) if setting else 0
+    setting = get_setting(db, "BACKUP_INTERVAL_MINUTES")
+    interval_minutes = int(setting.value or 0) if setting else 0
+    return frequency, interval_days, interval_hours, interval_minutes
+
+def sync_backup_schedule():
+    # Job del leader: riapplica la configurazione se un altro worker l'ha modificata
+    db = SessionLocal()
+    try:
+        schedule = _read_backup_schedule(db)
+    except Exception:
+        logger.error(f"Errore nella lettura della schedulazione: {traceback.format_exc()}")
+        return
+    finally:
+        db.close()
+    if schedule != _applied_schedule:
+        start_scheduler()
+
 def start_scheduler():
+    global _applied_schedule
+    if not is_scheduler_leader():
+        logger.info(f"Scheduler gestito da un altro processo: la configurazione verrà applicata entro {SCHEDULER_SYNC_SECONDS}s.")
+        return
+
+    if not scheduler.running:
+        scheduler.start()
+    scheduler.add_job(
+        sync_backup_schedule,
+        trigger="interval",
+        seconds=SCHEDULER_SYNC_SECONDS,
+        id="schedule_sync_job",
+        replace_existing=True,
+    )
+
     db = SessionLocal()
     try:
-        setting = get_setting(db, "BACKUP_FREQUENCY")
-        frequency = (setting.value if setting else "none").lower()
-        setting = get_setting(db, "BACKUP_INTERVAL_DAYS")
-        interval_days = int(setting.value if setting else 0)
-        setting = get_setting(db, "BACKUP_INTERVAL_HOURS")
-        interval_hours = int(setting.value if setting else 0)
-        setting = get_setting(db, "BACKUP_INTERVAL_MINUTES")
-        interval_minutes = int(setting.value if setting else 0)
+        schedule = _read_backup_schedule(db)
+        frequency, interval_days, interval_hours, interval_minutes = schedule
+        _applied_schedule = schedule
 
-        scheduler.remove_all_jobs()
+        if scheduler.get_job("backup_job"):
+            scheduler.remove_job("backup_job")
 
         if frequency == "none":
             logger.info("Backup automatico disabilitato.")
@@ -128,9 +204,6 @@ def start_scheduler():
             logger.warning(f"Frequenza di backup non riconosciuta: {frequency}")
             return
 
-        if not scheduler.running:
-            scheduler.start()
-
     except Exception as e:
         logger.error(f"Errore durante l'avvio del scheduler: {traceback.format_exc()}")
     finally:
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import List, Literal, Optional, TYPE_CHECKING
+from typing import Any, List, Literal, Optional, TYPE_CHECKING
 from decimal import Decimal
 from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import datetime, date
@@ -153,6 +153,44 @@ class ItemResponse(ItemBase, LoggingResponse):
     class Config:
         from_attributes = True
 
+# Pagina di item con paginazione keyset (cursore opaco)
+class ItemPageResponse(BaseModel):
+    items: List[ItemResponse]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+# Esito import massivo di item (CSV/NDJSON)
+class ItemImportRowError(BaseModel):
+    row: int
+    detail: str
+
+class ItemImportResponse(BaseModel):
+    inventory_id: int
+    dry_run: bool = False
+    total_rows: int
+    imported: int
+    failed: int
+    errors: List[ItemImportRowError] = []
+    elapsed_ms: float
+    rows_per_second: float
+
+# Operazioni massive su item (update/delete)
+class ItemBatchOperation(BaseModel):
+    op: Literal["update", "delete"]
+    item_id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    quantity: Optional[int] = None
+
+class ItemBatchRequest(BaseModel):
+    operations: List[ItemBatchOperation]
+    confirm_delete: bool = False
+
+class ItemBatchResponse(BaseModel):
+    updated: List[int] = []
+    unchanged: List[int] = []
+    deleted: List[int] = []
+
 ItemBase.model_rebuild()
 ItemCreate.model_rebuild()
 ItemUpdate.model_rebuild()
@@ -411,6 +449,7 @@ ItemMetadataValueResponse.model_rebuild()
 ItemMetadataValueUpsert.model_rebuild()
 ItemMetadataBulkUpsertRequest.model_rebuild()
 ItemResponse.model_rebuild()
+ItemPageResponse.model_rebuild()
 
 
 ##############################################################
@@ -674,6 +713,58 @@ BooleanMetadataFilterRequest.model_rebuild()
 BooleanMetadataFilterResponse.model_rebuild()
 
 
+##############################################################
+# Filtro composito su metadati: criteri di tipo misto e gruppi AND/OR.
+# Il tipo di ogni criterio è quello della definizione: i valori vengono validati
+# lato server con i criteri tipizzati (Text/Numeric/Date/BooleanMetadataFilterCriterion).
+class MetadataFilterCriterion(BaseModel):
+    definition_id: int
+    field_type: Optional[MetadataFieldType] = None  # informativo, salvato dai template del frontend
+    operator: MetadataFilterOperator
+    value_text: Optional[str] = None
+    value_number: Optional[Decimal] = None
+    value_boolean: Optional[bool] = None
+    value_date: Optional[Any] = None
+    range_from: Optional[Any] = None
+    range_to: Optional[Any] = None
+
+
+class MetadataFilterGroup(BaseModel):
+    match_mode: Literal["all", "any"] = "all"
+    criteria: List[MetadataFilterCriterion] = Field(default_factory=list)
+    groups: List["MetadataFilterGroup"] = Field(default_factory=list)
+
+    @model_validator(mode="after")
+    def validate_group(self):
+        if not self.criteria and not self.groups:
+            raise ValueError("Almeno un criterio o un gruppo è obbligatorio")
+        return self
+
+
+class MetadataFilterRequest(MetadataFilterGroup):
+    inventory_id: int
+    limit: Optional[int] = Field(None, ge=1, le=1000)
+    cursor: Optional[str] = None
+    include_items: bool = False
+    include_total: bool = False
+
+
+class MetadataFilterResponse(BaseModel):
+    inventory_id: int
+    match_mode: Literal["all", "any"]
+    item_ids: List[int]
+    count: int
+    items: Optional[List[ItemResponse]] = None
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+MetadataFilterCriterion.model_rebuild()
+MetadataFilterGroup.model_rebuild()
+MetadataFilterRequest.model_rebuild()
+MetadataFilterResponse.model_rebuild()
+
+
 ##############################################################
 # Template filtri salvati
 class FilterTemplateCreate(BaseModel):
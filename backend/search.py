@@ -0,0 +1,150 @@
+"""Motore di ricerca testuale sugli item (nome, descrizione, metadati TEXT/LIST).
+
+La semantica è quella della ricerca originale: sottostringa case-insensitive (ILIKE),
+nessun limite sul numero di risultati. Su PostgreSQL gli ILIKE '%...%' sono serviti dagli
+indici `pg_trgm` creati dalla migrazione e1f2a3b4c5d6; il database restituisce solo gli
+item corrispondenti, ordinati per rilevanza (nome, poi descrizione).
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, cast
+
+from sqlalchemy import and_, case, exists, false, or_, select
+from sqlalchemy.orm import Session
+
+from metadata_model import MetadataFieldType
+from models import Inventory, Item, ItemMetadataValue, MetadataDefinition
+
+METADATA_FETCH_CHUNK = 500
+
+
+@dataclass
+class ItemSearchHit:
+    item_id: int
+    inventory_id: int
+    rank: float
+    name: str
+    description: str | None
+    metadata_text: list[dict[str, str]] = field(default_factory=list)
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _list_option_labels(definition: MetadataDefinition) -> dict[str, str]:
+    labels: dict[str, str] = {}
+    for entry in cast(list[Any], definition.list_options or []):
+        if not isinstance(entry, dict):
+            continue
+        entry_value = str(entry.get("value", "")).strip()
+        entry_label = str(entry.get("label", "")).strip()
+        if entry_value:
+            labels[entry_value] = entry_label or entry_value
+    return labels
+
+
+def search_items(
+    db: Session,
+    filtro: str,
+    inventory_filter: Any,
+    limit: int | None = None,
+) -> list[ItemSearchHit]:
+    """Cerca `filtro` negli item degli inventari che soddisfano `inventory_filter`.
+
+    Restituisce gli hit ordinati per ranking decrescente, già completi di evidenziazione
+    (`**match**`) per nome, descrizione e metadati testuali.
+    """
+    if not filtro:
+        return []
+
+    filtro_lower = filtro.lower()
+    highlight_pattern = re.compile(re.escape(filtro), re.IGNORECASE)
+    like_pattern = f"%{_escape_like(filtro)}%"
+
+    def highlight(text: str) -> str:
+        return highlight_pattern.sub(lambda m: f"**{m.group(0)}**", text)
+
+    # Definizioni ricercabili (poche righe): attive e di tipo TEXT/LIST.
+    # Le etichette LIST vengono risolte qui, così la query filtra direttamente sui valori salvati.
+    searchable_definitions = {
+        cast(int, d.id): d
+        for d in db.query(MetadataDefinition).filter(
+            MetadataDefinition.is_active.is_(True),
+            MetadataDefinition.field_type.in_((MetadataFieldType.TEXT.value, MetadataFieldType.LIST.value)),
+        )
+    }
+    list_labels = {
+        definition_id: _list_option_labels(definition)
+        for definition_id, definition in searchable_definitions.items()
+        if definition.field_type == MetadataFieldType.LIST.value
+    }
+    label_matches = [
+        and_(ItemMetadataValue.definition_id == definition_id, ItemMetadataValue.value_text.in_(values))
+        for definition_id, labels in list_labels.items()
+        if (values := [value for value, label in labels.items() if filtro_lower in label.lower()])
+    ]
+
+    name_match = Item.name.ilike(like_pattern, escape="\\")
+    desc_match = Item.description.ilike(like_pattern, escape="\\")
+    if searchable_definitions:
+        metadata_match = exists().where(
+            ItemMetadataValue.item_id == Item.id,
+            ItemMetadataValue.definition_id.in_(list(searchable_definitions)),
+            or_(ItemMetadataValue.value_text.ilike(like_pattern, escape="\\"), *label_matches),
+        )
+    else:
+        metadata_match = false()
+
+    rank = (case((name_match, 3.0), else_=0.0) + case((desc_match, 2.0), else_=0.0)).label("rank")
+    stmt = (
+        select(Item.id, Item.inventory_id, Item.name, Item.description, name_match, desc_match, rank)
+        .join(Inventory, Inventory.id == Item.inventory_id)
+        .where(inventory_filter, or_(name_match, desc_match, metadata_match))
+        .order_by(rank.desc(), Item.id.asc())
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    hits: list[ItemSearchHit] = []
+    for item_id, inventory_id, name, description, is_name_match, is_desc_match, row_rank in db.execute(stmt):
+        hits.append(ItemSearchHit(
+            item_id=item_id,
+            inventory_id=inventory_id,
+            rank=float(row_rank or 0),
+            name=highlight(name or "") if is_name_match else (name or ""),
+            description=(highlight(description) if is_desc_match else description) if description else None,
+        ))
+
+    if not hits or not searchable_definitions:
+        return hits
+
+    # Evidenziazione metadati: solo per gli item trovati, non per l'intero database
+    hits_by_id = {hit.item_id: hit for hit in hits}
+    hit_ids = list(hits_by_id)
+    for start in range(0, len(hit_ids), METADATA_FETCH_CHUNK):
+        chunk = hit_ids[start:start + METADATA_FETCH_CHUNK]
+        rows = db.execute(
+            select(ItemMetadataValue.item_id, ItemMetadataValue.definition_id, ItemMetadataValue.value_text)
+            .where(
+                ItemMetadataValue.item_id.in_(chunk),
+                ItemMetadataValue.definition_id.in_(list(searchable_definitions)),
+                ItemMetadataValue.value_text.is_not(None),
+            )
+            .order_by(ItemMetadataValue.item_id.asc(), ItemMetadataValue.id.asc())
+        )
+        for item_id, definition_id, raw_text in rows:
+            if not raw_text:
+                continue
+            definition = searchable_definitions[definition_id]
+            display_text = list_labels.get(definition_id, {}).get(raw_text, raw_text)
+            if filtro_lower not in raw_text.lower() and filtro_lower not in display_text.lower():
+                continue
+            hits_by_id[item_id].metadata_text.append({
+                "definition_label": cast(str, definition.label or definition.key),
+                "value_text": highlight(display_text),
+            })
+
+    return hits
@@ -0,0 +1,86 @@
+"""Statistiche della dashboard (`GET /`): conteggi di inventari, liste, item e utenti.
+
+Calcolate con un'unica query aggregata e tenute in cache per DASHBOARD_STATS_TTL_SECONDS.
+La cache viene svuotata al commit di ogni sessione che ha inserito o eliminato
+inventari, item o utenti (flush ORM o insert/delete Core come import e batch).
+Con più worker l'invalidazione è locale al processo: negli altri vale il TTL.
+"""
+import os
+
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from cache import TTLCache
+from models import Inventory, Item, User
+
+DASHBOARD_STATS_TTL_SECONDS = float(os.getenv("DASHBOARD_STATS_TTL_SECONDS", "60"))
+
+dashboard_stats_cache: TTLCache[dict] = TTLCache(ttl_seconds=DASHBOARD_STATS_TTL_SECONDS, max_entries=1)
+
+_STATS_KEY = "dashboard"
+_COUNTED_MODELS = (Inventory, Item, User)
+_SESSION_FLAG = "dashboard_stats_dirty"
+
+
+def dashboard_stats_statement():
+    # Aggregato senza GROUP BY: restituisce sempre una riga, anche a database vuoto
+    def count_inventories(inventory_type: str):
+        return func.count(func.distinct(case((Inventory.type == inventory_type, Inventory.id))))
+
+    def count_items(inventory_type: str):
+        return func.count(case((Inventory.type == inventory_type, Item.id)))
+
+    return (
+        select(
+            count_inventories("INVENTORY").label("total_inventories"),
+            count_items("INVENTORY").label("total_inventories_items"),
+            count_inventories("CHECKLIST").label("total_checklists"),
+            count_items("CHECKLIST").label("total_checklists_items"),
+            select(func.count()).select_from(User).scalar_subquery().label("total_users"),
+        )
+        .select_from(Inventory)
+        .outerjoin(Item, Item.inventory_id == Inventory.id)
+    )
+
+
+def get_cached_dashboard_stats() -> dict | None:
+    return dashboard_stats_cache.get(_STATS_KEY)
+
+
+def store_dashboard_stats(stats: dict) -> None:
+    dashboard_stats_cache.set(_STATS_KEY, stats)
+
+
+def invalidate_dashboard_stats() -> None:
+    dashboard_stats_cache.clear()
+
+
+#############################################################################
+# Invalidazione automatica sulle scritture
+
+@event.listens_for(Session, "before_flush")
+def _track_flush(session, flush_context, instances):
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, _COUNTED_MODELS):
+            session.info[_SESSION_FLAG] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statement(orm_execute_state: ORMExecuteState):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in _COUNTED_MODELS:
+        orm_execute_state.session.info[_SESSION_FLAG] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop(_SESSION_FLAG, False):
+        invalidate_dashboard_stats()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_after_rollback(session):
+    session.info.pop(_SESSION_FLAG, None)
@@ -0,0 +1,402 @@
+import itertools
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from main import app
+from database import Base
+from dependencies import get_async_db, get_db, principal_cache
+from metadata_cache import invalidate_applicable_definitions
+from metadata_filters import compile_metadata_filter, matching_items_select
+from models import (
+    FilterTemplate,
+    Group,
+    Inventory,
+    InventoryAccess,
+    InventoryVersion,
+    Item,
+    ItemMetadataValue,
+    ItemVersion,
+    MetadataDefinition,
+    MetadataDefinitionAssignment,
+    Role,
+    SharedInventory,
+    SharedInventoryGroup,
+    User,
+    UserGroupAssociation,
+)
+from routes.auth import create_access_token
+from schemas import MetadataFilterCriterion, MetadataFilterGroup
+
+
+# Numero massimo di query per richiesta (utente già in cache). Se un refactoring
+# le riduce, abbassare il valore; se le aumenta, è una regressione da giustificare.
+QUERY_BASELINES = {
+    "list_inventories": 2,
+    "list_inventories_filter": 6,
+    "list_items": 2,
+    "list_items_page": 3,
+    "item_audit_logs": 1,
+    "inventory_audit_logs": 1,
+    "filter_templates": 5,
+    "recents": 1,
+    "access_details": 6,
+    "access_count": 4,
+    "shares": 2,
+    "shareable_users": 2,
+    "applicable_definitions": 2,
+    "metadata_filter": 5,
+    "execute_filter_template": 6,
+}
+
+_sequence = itertools.count(1)
+
+
+@pytest.fixture(scope="module")
+def env(tmp_path_factory):
+    """App collegata a un database SQLite su file condiviso da engine sync e async."""
+    db_path = tmp_path_factory.mktemp("query_counts") / "test.db"
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with AsyncSessionLocal() as adb:
+            yield adb
+
+    previous_overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    principal_cache.clear()
+    invalidate_applicable_definitions()
+
+    session = SessionLocal()
+    admin_role, viewer_role = Role(name="admin"), Role(name="viewer")
+    session.add_all([admin_role, viewer_role])
+    session.flush()
+    owner = User(username="qc_owner", hashed_password="x", role_id=admin_role.id)
+    viewer = User(username="qc_viewer", hashed_password="x", role_id=viewer_role.id)
+    session.add_all([owner, viewer])
+    session.flush()
+    group = Group(name="qc_group", role_id=viewer_role.id)
+    session.add(group)
+    session.flush()
+    session.add(UserGroupAssociation(user_id=viewer.id, group_id=group.id))
+    definition = MetadataDefinition(key="qc_note", label="Nota", field_type="TEXT", user_ins=owner.id, user_mod=owner.id)
+    session.add(definition)
+    session.commit()
+
+    context = {
+        "client": TestClient(app),
+        "session": session,
+        "owner_id": owner.id,
+        "viewer_id": viewer.id,
+        "group_id": group.id,
+        "definition_id": definition.id,
+    }
+    context["inventory_id"] = add_inventory(context, shared_with="user")
+    yield context
+
+    session.close()
+    app.dependency_overrides.clear()
+    app.dependency_overrides.update(previous_overrides)
+    principal_cache.clear()
+    invalidate_applicable_definitions()
+    engine.dispose()
+
+
+def headers(username: str) -> dict:
+    return {"Authorization": "Bearer " + create_access_token({"sub": username})}
+
+
+def add_items(env, inventory_id: int, count: int = 3):
+    session = env["session"]
+    for _ in range(count):
+        n = next(_sequence)
+        item = Item(name=f"Vite {n}", description="acciaio", quantity=n, inventory_id=inventory_id,
+                    user_ins=env["owner_id"], user_mod=env["owner_id"])
+        session.add(item)
+        session.flush()
+        session.add(ItemMetadataValue(item_id=item.id, definition_id=env["definition_id"], value_text=f"nota {n}"))
+        session.add(ItemVersion(item_id=item.id, inventory_id=inventory_id, name=item.name, quantity=n,
+                                version_num=1, operation="CREATE", changed_by_id=env["owner_id"]))
+    session.commit()
+
+
+def add_inventory(env, shared_with: str = "user") -> int:
+    session = env["session"]
+    n = next(_sequence)
+    inventory = Inventory(name=f"Garage {n}", type="INVENTORY", owner_id=env["owner_id"],
+                          user_ins=env["owner_id"], user_mod=env["owner_id"])
+    session.add(inventory)
+    session.flush()
+    if shared_with == "user":
+        session.add(SharedInventory(inventory_id=inventory.id, user_id=env["viewer_id"]))
+    else:
+        session.add(SharedInventoryGroup(inventory_id=inventory.id, group_id=env["group_id"]))
+    session.add(InventoryVersion(inventory_id=inventory.id, name=inventory.name, type="INVENTORY",
+                                 owner_id=env["owner_id"], version_num=1, operation="CREATE",
+                                 changed_by_id=env["owner_id"]))
+    session.commit()
+    add_items(env, inventory.id)
+    return inventory.id
+
+
+def grow_inventories(env):
+    add_inventory(env, shared_with="user")
+    add_inventory(env, shared_with="group")
+
+
+def grow_shares(env):
+    session = env["session"]
+    inventory_id = env["inventory_id"]
+    if not session.query(SharedInventoryGroup).filter_by(inventory_id=inventory_id, group_id=env["group_id"]).first():
+        session.add(SharedInventoryGroup(inventory_id=inventory_id, group_id=env["group_id"]))
+    viewer_role = session.query(Role).filter_by(name="viewer").one()
+    for _ in range(3):
+        member = User(username=f"qc_member_{next(_sequence)}", hashed_password="x", role_id=viewer_role.id)
+        session.add(member)
+        session.flush()
+        session.add(UserGroupAssociation(user_id=member.id, group_id=env["group_id"]))
+        session.add(SharedInventory(inventory_id=inventory_id, user_id=member.id))
+    session.commit()
+
+
+def assign_definition_globally(env):
+    session = env["session"]
+    definition = session.get(MetadataDefinition, env["definition_id"])
+    if not definition.assignments:
+        session.add(MetadataDefinitionAssignment(definition_id=definition.id, scope="GLOBAL"))
+        session.commit()
+    return definition
+
+
+def get_ok(env, url: str, username: str = "qc_viewer"):
+    def call():
+        response = env["client"].get(url, headers=headers(username))
+        assert response.status_code == 200, response.text
+        return response
+    return call
+
+
+class TestQueryCounts:
+    """Il numero di query degli endpoint di lista non deve dipendere dal numero di righe."""
+
+    def test_list_inventories(self, env, assert_queries_constant):
+        count = assert_queries_constant(get_ok(env, "/inventory/"), lambda: grow_inventories(env), "GET /inventory/")
+        assert count <= QUERY_BASELINES["list_inventories"]
+
+    def test_list_inventories_with_filter(self, env, assert_queries_constant):
+        count = assert_queries_constant(get_ok(env, "/inventory/?filtro=vite"), lambda: grow_inventories(env), "GET /inventory/?filtro")
+        assert count <= QUERY_BASELINES["list_inventories_filter"]
+
+    def test_list_items(self, env, assert_queries_constant):
+        url = f"/inventory/item/{env['inventory_id']}/"
+        count = assert_queries_constant(get_ok(env, url), lambda: add_items(env, env["inventory_id"], 5), "GET /inventory/item/{id}/")
+        assert count <= QUERY_BASELINES["list_items"]
+
+    def test_list_items_page(self, env, assert_queries_constant):
+        url = f"/inventory/item/{env['inventory_id']}/page?limit=500"
+        count = assert_queries_constant(get_ok(env, url), lambda: add_items(env, env["inventory_id"], 5), "GET /inventory/item/{id}/page")
+        assert count <= QUERY_BASELINES["list_items_page"]
+
+    def test_item_audit_logs(self, env, assert_queries_constant):
+        count = assert_queries_constant(get_ok(env, "/audit/logs/items"), lambda: grow_inventories(env), "GET /audit/logs/items")
+        assert count <= QUERY_BASELINES["item_audit_logs"]
+
+    def test_inventory_audit_logs(self, env, assert_queries_constant):
+        count = assert_queries_constant(get_ok(env, "/audit/logs/inventories"), lambda: grow_inventories(env), "GET /audit/logs/inventories")
+        assert count <= QUERY_BASELINES["inventory_audit_logs"]
+
+    def test_list_filter_templates(self, env, assert_queries_constant):
+        def grow():
+            session = env["session"]
+            for _ in range(3):
+                session.add(FilterTemplate(
+                    name=f"Filtro {next(_sequence)}",
+                    filter_type="text",
+                    criteria={"criteria": [{"definition_id": env["definition_id"], "op": "contains", "value": "x"}]},
+                    is_shared=True,
+                    user_ins=env["owner_id"],
+                    user_mod=env["owner_id"],
+                ))
+            session.commit()
+            grow_inventories(env)
+
+        grow()
+        url = f"/filter-templates?inventory_id={env['inventory_id']}&include_incompatible=true"
+        count = assert_queries_constant(get_ok(env, url), grow, "GET /filter-templates")
+        assert count <= QUERY_BASELINES["filter_templates"]
+
+    def test_recents(self, env, assert_queries_constant):
+        count = assert_queries_constant(get_ok(env, "/recents?limit=10"), lambda: grow_inventories(env), "GET /recents")
+        assert count <= QUERY_BASELINES["recents"]
+
+    @pytest.mark.parametrize("name, url", [
+        ("access_details", "/inventory/access_details/{id}"),
+        ("access_count", "/inventory/access_count/{id}"),
+        ("shares", "/inventory/share/{id}"),
+        ("shareable_users", "/user/users/shareable/{id}"),
+    ])
+    def test_inventory_access(self, env, assert_queries_constant, name, url):
+        grow_shares(env)
+        url = url.format(id=env["inventory_id"])
+        count = assert_queries_constant(get_ok(env, url, username="qc_owner"), lambda: grow_shares(env), f"GET {url}")
+        assert count <= QUERY_BASELINES[name]
+
+    def test_item_list_reads_metadata_doc(self, env, query_counter):
+        call = get_ok(env, f"/inventory/item/{env['inventory_id']}/page?limit=500")
+        with query_counter() as counter:
+            items = call().json()["items"]
+        assert all(item["metadata_values"][0]["definition_key"] == "qc_note" for item in items)
+        # Metadati dalla proiezione items.metadata_doc: nessuna lettura di valori o definizioni
+        assert not any("item_metadata_values" in statement for statement in counter.statements), "\n".join(counter.statements)
+
+        session = env["session"]
+        value = session.query(ItemMetadataValue).filter_by(item_id=items[0]["id"]).one()
+        value.value_text = "modificata"
+        session.commit()
+        refreshed = next(item for item in call().json()["items"] if item["id"] == items[0]["id"])
+        assert refreshed["metadata_values"][0]["value_text"] == "modificata"
+
+    def test_applicable_definitions_cached(self, env, query_counter):
+        session = env["session"]
+        definition = assign_definition_globally(env)
+        call = get_ok(env, f"/metadata/applicable?inventory_id={env['inventory_id']}")
+
+        assert [d["label"] for d in call().json()] == ["Nota"]
+        with query_counter() as counter:
+            call()
+        # Dalla cache restano solo inventario e controllo di accesso
+        assert counter.count <= QUERY_BASELINES["applicable_definitions"], "\n".join(counter.statements)
+
+        definition.label = "Annotazione"
+        session.commit()
+        try:
+            assert [d["label"] for d in call().json()] == ["Annotazione"]
+        finally:
+            definition.label = "Nota"
+            session.commit()
+
+    def test_composite_metadata_filter(self, env, assert_queries_constant):
+        assign_definition_globally(env)
+        payload = {
+            "inventory_id": env["inventory_id"],
+            "match_mode": "any",
+            "criteria": [{"definition_id": env["definition_id"], "operator": "contains", "value_text": "nota"}],
+            "groups": [{"criteria": [{"definition_id": env["definition_id"], "operator": "is_null"}]}],
+            "limit": 1000,
+            "include_items": True,
+            "include_total": True,
+        }
+
+        def call():
+            response = env["client"].post("/metadata/filters", json=payload, headers=headers("qc_viewer"))
+            assert response.status_code == 200, response.text
+            assert response.json()["count"] == response.json()["total"]
+
+        count = assert_queries_constant(call, lambda: add_items(env, env["inventory_id"], 5), "POST /metadata/filters")
+        assert count <= QUERY_BASELINES["metadata_filter"]
+
+    def test_execute_filter_template(self, env, assert_queries_constant):
+        assign_definition_globally(env)
+        session = env["session"]
+        template = FilterTemplate(
+            name=f"Eseguibile {next(_sequence)}",
+            filter_type="text",
+            criteria={"match_mode": "all", "criteria": [
+                {"definition_id": env["definition_id"], "field_type": "TEXT", "operator": "contains", "value_text": "nota"},
+            ]},
+            is_shared=True,
+            user_ins=env["owner_id"],
+            user_mod=env["owner_id"],
+        )
+        session.add(template)
+        session.commit()
+        url = f"/filter-templates/{template.id}/execute?inventory_id={env['inventory_id']}&limit=1000&include_total=true"
+
+        def call():
+            response = env["client"].post(url, headers=headers("qc_viewer"))
+            assert response.status_code == 200, response.text
+            body = response.json()
+            assert body["count"] == body["total"] == len(body["items"])
+
+        # Il filtro compilato resta in cache: nessuna query sulle definizioni dopo la prima esecuzione
+        count = assert_queries_constant(call, lambda: add_items(env, env["inventory_id"], 5), "POST /filter-templates/{id}/execute")
+        assert count <= QUERY_BASELINES["execute_filter_template"]
+
+
+class TestInventoryAccessMaintenance:
+    """La tabella inventory_access segue le scritture che la influenzano, e solo quelle."""
+
+    def test_role_change_updates_access_level(self, env):
+        session = env["session"]
+        if not session.query(Role).filter_by(name="moderator").first():
+            session.add(Role(name="moderator"))
+            session.commit()
+
+        def level():
+            session.expire_all()
+            return session.query(InventoryAccess.level).filter_by(
+                user_id=env["viewer_id"], inventory_id=env["inventory_id"]
+            ).scalar()
+
+        assert level() == "view"
+        url = f"/admin/users/{env['viewer_id']}/role/"
+        try:
+            # update_user_role assegna la relazione `role`, non role_id
+            response = env["client"].put(url, params={"new_role": "moderator"}, headers=headers("qc_owner"))
+            assert response.status_code == 200, response.text
+            assert level() == "edit"
+        finally:
+            env["client"].put(url, params={"new_role": "viewer"}, headers=headers("qc_owner"))
+        assert level() == "view"
+
+    def test_item_batch_does_not_rebuild_access(self, env, query_counter):
+        item_id = env["session"].query(Item.id).filter_by(inventory_id=env["inventory_id"]).first()[0]
+        payload = {"inventory_id": env["inventory_id"], "operations": [{"op": "update", "item_id": item_id, "quantity": 99}]}
+        with query_counter() as counter:
+            response = env["client"].post("/item/batch", json=payload, headers=headers("qc_owner"))
+        assert response.status_code == 200, response.text
+        # L'aggiornamento bulk di data_mod/user_mod degli inventari non cambia l'accesso
+        assert not any("inventory_access" in statement for statement in counter.statements), "\n".join(counter.statements)
+
+
+class TestQueryPlans:
+    """I filtri sui metadati devono restare serviti dagli indici tipizzati."""
+
+    def test_numeric_range_filter_uses_typed_index(self, env):
+        session = env["session"]
+        definition = MetadataDefinition(key=f"qc_peso_{next(_sequence)}", label="Peso", field_type="NUMBER",
+                                        user_ins=env["owner_id"], user_mod=env["owner_id"])
+        session.add(definition)
+        session.flush()
+        for item in session.query(Item).filter(Item.inventory_id == env["inventory_id"]).all():
+            session.add(ItemMetadataValue(item_id=item.id, definition_id=definition.id, value_number=item.quantity))
+        session.commit()
+
+        group = MetadataFilterGroup(criteria=[
+            MetadataFilterCriterion(definition_id=definition.id, operator="between", range_from=2, range_to=5),
+        ])
+        query = matching_items_select(env["inventory_id"], compile_metadata_filter(group, {definition.id: "NUMBER"}))
+        sql = str(query.compile(dialect=session.bind.dialect, compile_kwargs={"literal_binds": True}))
+        plan = "\n".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+        assert "ix_item_metadata_values_definition_value_number_item" in plan, plan
+        expected = {
+            item_id for item_id, quantity in session.query(Item.id, Item.quantity).filter(Item.inventory_id == env["inventory_id"])
+            if 2 <= quantity <= 5
+        }
+        assert set(session.scalars(query)) == expected
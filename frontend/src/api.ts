@@ -27,6 +27,8 @@ import {
   DateMetadataFilterResponse,
   BooleanMetadataFilterRequest,
   BooleanMetadataFilterResponse,
+  MetadataFilterRequest,
+  MetadataFilterResponse,
   FilterTemplate,
   FilterTemplateCreate,
   FilterTemplateListItem,
@@ -820,6 +822,13 @@ export async function bulkUpsertItemMetadataValues(
 }
 
 /* === METADATA ADVANCED FILTERS === */
+export async function filterItemsByMetadata(
+  payload: MetadataFilterRequest,
+): Promise<MetadataFilterResponse> {
+  const response = await api.post('/metadata/filters', payload);
+  return response.data as MetadataFilterResponse;
+}
+
 export async function filterItemsByTextMetadata(
   payload: TextMetadataFilterRequest,
 ): Promise<TextMetadataFilterResponse> {
@@ -869,6 +878,17 @@ export async function getFilterTemplate(templateId: number): Promise<FilterTempl
   return response.data as FilterTemplate;
 }
 
+export async function executeFilterTemplate(
+  templateId: number,
+  inventoryId: number,
+  options: { limit?: number; cursor?: string | null; include_items?: boolean; include_total?: boolean } = {},
+): Promise<MetadataFilterResponse> {
+  const response = await api.post(`/filter-templates/${templateId}/execute`, null, {
+    params: { inventory_id: inventoryId, ...options },
+  });
+  return response.data as MetadataFilterResponse;
+}
+
 export async function createFilterTemplate(
   payload: FilterTemplateCreate,
 ): Promise<FilterTemplate> {
@@ -5,10 +5,9 @@ import {
   getChecklistById, getChecklistItems,
   createItem, updateItem, deleteItem,
   getMetadataDefinitions, listAllMetadataDefinitions, getItemMetadataValues,
-  getFilterTemplates, getFilterTemplate,
-  filterItemsByTextMetadata, filterItemsByNumericMetadata, filterItemsByDateMetadata, filterItemsByBooleanMetadata,
+  getFilterTemplates, executeFilterTemplate,
   bulkUpsertItemMetadataValues, deleteItemMetadataValue } from "../api";
-import { Inventory, Item, User, MetadataDefinition, ItemMetadataValue, ItemMetadataValueUpsert, FilterTemplate, FilterTemplateListItem } from "../types";
+import { Inventory, Item, User, MetadataDefinition, ItemMetadataValue, ItemMetadataValueUpsert, FilterTemplateListItem } from "../types";
 import { Dialog } from "@headlessui/react";
 import { useContext } from "react";
 import { AuthContext } from "../auth-context";
@@ -716,91 +715,22 @@ useEffect(() => {
 
     const applyTemplateToList = async (templateId: number) => {
       try {
-        const template: FilterTemplate = await getFilterTemplate(templateId);
-        const root = template.criteria as Record<string, unknown>;
-        const filterType = (root?.filter_type as string) || template.filter_type;
-        const matchMode = (root?.match_mode as 'all' | 'any') || 'all';
-        const criteria = Array.isArray(root?.criteria) ? root.criteria : [];
-
-        if (!criteria.length) {
-          alert('Il template non contiene criteri validi.');
-          return;
-        }
-
-        const asSet = (ids: number[]) => new Set(ids);
-        const intersect = (a: Set<number>, b: Set<number>) => new Set([...a].filter((x) => b.has(x)));
-        const union = (a: Set<number>, b: Set<number>) => new Set([...a, ...b]);
-
-        const byType = {
-          text: criteria.filter((c) => {
-            const raw = c as Record<string, unknown>;
-            return raw.field_type === 'TEXT' || raw.field_type === 'LIST' || raw.value_text != null || filterType === 'text';
-          }),
-          numeric: criteria.filter((c) => {
-            const raw = c as Record<string, unknown>;
-            return raw.field_type === 'NUMBER' || raw.value_number != null || filterType === 'numeric';
-          }),
-          date: criteria.filter((c) => {
-            const raw = c as Record<string, unknown>;
-            return raw.field_type === 'DATE' || raw.value_date != null || filterType === 'date';
-          }),
-          boolean: criteria.filter((c) => {
-            const raw = c as Record<string, unknown>;
-            return raw.field_type === 'BOOLEAN' || raw.value_boolean != null || filterType === 'boolean';
-          }),
-        };
-
-        const resultSets: Set<number>[] = [];
-
-        if (byType.text.length > 0) {
-          const response = await filterItemsByTextMetadata({
-            inventory_id: Number(id),
-            match_mode: matchMode,
-            criteria: byType.text as never,
-          });
-          resultSets.push(asSet(response.item_ids));
-        }
-
-        if (byType.numeric.length > 0) {
-          const response = await filterItemsByNumericMetadata({
-            inventory_id: Number(id),
-            match_mode: matchMode,
-            criteria: byType.numeric as never,
-          });
-          resultSets.push(asSet(response.item_ids));
-        }
-
-        if (byType.date.length > 0) {
-          const response = await filterItemsByDateMetadata({
-            inventory_id: Number(id),
-            match_mode: matchMode,
-            criteria: byType.date as never,
+        const templateName = filterTemplates.find((t) => t.id === templateId)?.name ?? '';
+        // Il server compila ed esegue il template: solo gli ID, una pagina alla volta
+        const itemIds: number[] = [];
+        let cursor: string | null | undefined = null;
+        do {
+          const page = await executeFilterTemplate(templateId, Number(id), {
+            limit: 1000,
+            cursor,
+            include_items: false,
           });
-          resultSets.push(asSet(response.item_ids));
-        }
-
-        if (byType.boolean.length > 0) {
-          const response = await filterItemsByBooleanMetadata({
-            inventory_id: Number(id),
-            match_mode: matchMode,
-            criteria: byType.boolean as never,
-          });
-          resultSets.push(asSet(response.item_ids));
-        }
-
-        if (resultSets.length === 0) {
-          alert('Tipo template non supportato.');
-          return;
-        }
-
-        let finalSet = resultSets[0];
-        for (let i = 1; i < resultSets.length; i += 1) {
-          finalSet = matchMode === 'all' ? intersect(finalSet, resultSets[i]) : union(finalSet, resultSets[i]);
-        }
+          itemIds.push(...page.item_ids);
+          cursor = page.next_cursor;
+        } while (cursor);
 
-        const itemIds = Array.from(finalSet.values()).sort((a, b) => a - b);
         setMetadataFilteredItemIds(itemIds);
-        setMetadataFilterSummary(`Template "${template.name}" applicato (${itemIds.length} risultati)`);
+        setMetadataFilterSummary(`Template "${templateName}" applicato (${itemIds.length} risultati)`);
         return;
 
       } catch {
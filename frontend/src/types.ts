@@ -338,6 +338,43 @@ export interface BooleanMetadataFilterResponse {
     count: number;
 }
 
+// Filtro composito: criteri di tipo misto e gruppi AND/OR annidati
+export interface MetadataFilterCriterion {
+    definition_id: number;
+    field_type?: MetadataFieldType | null;
+    operator: MetadataFilterOperator;
+    value_text?: string | null;
+    value_number?: number | string | null;
+    value_boolean?: boolean | null;
+    value_date?: string | null;
+    range_from?: number | string | null;
+    range_to?: number | string | null;
+}
+
+export interface MetadataFilterGroup {
+    match_mode?: "all" | "any";
+    criteria?: MetadataFilterCriterion[];
+    groups?: MetadataFilterGroup[];
+}
+
+export interface MetadataFilterRequest extends MetadataFilterGroup {
+    inventory_id: number;
+    limit?: number | null;
+    cursor?: string | null;
+    include_items?: boolean;
+    include_total?: boolean;
+}
+
+export interface MetadataFilterResponse {
+    inventory_id: number;
+    match_mode: "all" | "any";
+    item_ids: number[];
+    count: number;
+    items?: Item[] | null;
+    next_cursor?: string | null;
+    total?: number | null;
+}
+
 export type FilterTemplateType = "numeric" | "date" | "boolean" | "text" | "composite";
 
 export interface FilterTemplateBase {